@@ -0,0 +1,312 @@
+# benchmarks/daemon_bench.py
+"""
+End-to-end throughput benchmark for run_daemon.
+
+Starts the fakes in benchmarks/fakes.py (Graph, token endpoint, OpenAI) in a
+separate process and points the daemon at them with GRAPH_BASE_URL,
+AAD_LOGIN_BASE_URL and OPENAI_BASE_URL. Blob storage is real: Azurite by default
+(UseDevelopmentStorage=true), or whatever --blob-connection-string points at. Each
+corpus size gets fresh tenants, so containers, delta links and caches don't carry
+over between sizes.
+
+For every size and tick it reports wall time, files/sec, HTTP requests per file by
+service, peak RSS of the daemon process (extraction workers not included) and the
+per-stage latency from the run metrics in daemon_status.json.
+
+  azurite-blob --silent &
+  python -m benchmarks.daemon_bench --files 100,1000,10000 --ticks 2 --json out.json
+  python -m benchmarks.daemon_bench --files 1000 --graph-429-rate 0.05 --baseline out.json
+
+Daemon settings (DAEMON_WORKERS, DAEMON_FILE_CONCURRENCY, EXTRACT_PROCESSES, ...)
+are taken from the environment as usual and recorded in the JSON output. Tagging
+runs in sync mode unless --tagging-mode batch; batch mode queues files on the first
+tick and applies the fake batches' results on the next, so use --ticks 2 or more.
+"""
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import multiprocessing
+import urllib.request
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .fakes import FakeConfig, serve_forever
+
+ROOT = Path(__file__).resolve().parents[1]
+DAEMON_DIR = ROOT / "doc_tagger_daemon"
+
+# ---------- fakes process ----------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _http(url: str, method: str = "GET") -> Dict[str, Any]:
+    req = urllib.request.Request(url, method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read() or b"{}")
+
+def start_fakes(cfg: FakeConfig, port: int = 0) -> "tuple[multiprocessing.Process, str]":
+    port = port or _free_port()
+    proc = multiprocessing.get_context("spawn").Process(
+        target=serve_forever, args=(asdict(cfg), "127.0.0.1", port), name="doctagger-fakes", daemon=True,
+    )
+    proc.start()
+    root = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            _http(f"{root}/_stats")
+            return proc, root
+        except OSError:
+            if time.monotonic() > deadline or not proc.is_alive():
+                proc.terminate()
+                raise RuntimeError("fake services did not start")
+            time.sleep(0.1)
+
+def configure_env(root: str, blob_conn: str, tagging_mode: str = "sync") -> None:
+    """
+    Must run before the daemon modules are imported: endpoints and credentials are
+    read at import time.
+    """
+    os.environ.pop("KEY_VAULT_URI", None)
+    os.environ.update({
+        "GRAPH_BASE_URL": f"{root}/graph/v1.0",
+        "AAD_LOGIN_BASE_URL": f"{root}/login",
+        "OPENAI_BASE_URL": f"{root}/openai/v1",
+        "OPENAI_API_KEY": "bench",
+        "DAEMON_CLIENT_ID": "bench",
+        "DAEMON_CLIENT_SECRET": "bench",
+        "AZURE_STORAGE_CONNECTION_STRING": blob_conn,
+        "DAEMON_TAGGING_MODE": tagging_mode,
+    })
+    os.environ.setdefault("DAEMON_JOB_QUEUE_BACKEND", "memory")
+    if str(DAEMON_DIR) not in sys.path:
+        sys.path.insert(0, str(DAEMON_DIR))
+
+# ---------- measurements ----------
+
+class RssSampler:
+    """
+    Peak resident set size of this process while a tick runs, sampled from
+    /proc/self/status; falls back to ru_maxrss (peak since process start) elsewhere.
+    """
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _rss_kb() -> int:
+        try:
+            with open("/proc/self/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        import resource
+        return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    def _run(self) -> None:
+        while True:
+            self.peak_kb = max(self.peak_kb, self._rss_kb())
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self) -> "RssSampler":
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+def merge_metrics(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combines the tenants' run metrics: counts, totals and counters add up, max is
+    the overall max, p50/p95 are the worst tenant's (exact with one tenant).
+    """
+    stages: Dict[str, Dict[str, float]] = {}
+    counters: Dict[str, int] = {}
+    for snap in snapshots:
+        for name, st in (snap.get("stages") or {}).items():
+            m = stages.setdefault(name, {"count": 0, "errors": 0, "total_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0})
+            m["count"] += st.get("count", 0)
+            m["errors"] += st.get("errors", 0)
+            m["total_ms"] = round(m["total_ms"] + st.get("total_ms", 0.0), 1)
+            for k in ("p50_ms", "p95_ms", "max_ms"):
+                m[k] = max(m[k], st.get(k, 0.0))
+        for name, n in (snap.get("counters") or {}).items():
+            counters[name] = counters.get(name, 0) + int(n)
+    return {"stages": stages, "counters": counters}
+
+# ---------- scenario ----------
+
+def setup_tenants(size: int, tenants: int, targets: int, run_id: str) -> List[str]:
+    from shared.blob_utils import write_json_blob
+    ids = []
+    for i in range(tenants):
+        tid = f"bench-{run_id}-{size}-{i}"
+        per_target = [size // targets + (1 if k < size % targets else 0) for k in range(targets)]
+        write_json_blob(tid, "upload_targets.json", [
+            {
+                "label": f"lib{k}",
+                "siteId": "site-bench",
+                "driveId": f"drv-n{n}-{tid}-{k}",
+                "folder": "Docs",
+                "enabled": True,
+            }
+            for k, n in enumerate(per_target)
+        ])
+        ids.append(tid)
+    return ids
+
+def drop_tenants(tenants: List[str]) -> None:
+    from shared.blob_utils import forget_container, get_container_client
+    for tid in tenants:
+        try:
+            get_container_client(tid).delete_container()
+        except Exception as e:
+            logging.warning("Could not delete benchmark container for %s: %s", tid, e)
+        forget_container(tid)
+
+def run_tick(root: str, tenants: List[str]) -> Dict[str, Any]:
+    from daemon_worker import run_daemon
+    from shared.blob_utils import load_json_blob
+    os.environ["DAEMON_TENANTS"] = ",".join(tenants)
+    _http(f"{root}/_reset", "POST")
+    with RssSampler() as rss:
+        t0 = time.perf_counter()
+        run_daemon()
+        wall = time.perf_counter() - t0
+    requests = _http(f"{root}/_stats")["requests"]
+    statuses = [load_json_blob(tid, "daemon_status.json") or {} for tid in tenants]
+    tagged = sum(int((s.get("totals") or {}).get("processed") or 0) for s in statuses)
+    failed = sum(int((s.get("totals") or {}).get("failed") or 0) for s in statuses)
+    metrics = merge_metrics([s.get("metrics") or {} for s in statuses])
+    http = {k.split(".", 1)[1]: v for k, v in requests.items() if k.startswith("http.")}
+    per_file = max(1, tagged)
+    return {
+        "wall_s": round(wall, 2),
+        "files_tagged": tagged,
+        "files_failed": failed,
+        "files_per_sec": round(tagged / wall, 2) if wall > 0 else 0.0,
+        "http_requests": http,
+        "requests_per_file": round(sum(http.values()) / per_file, 2),
+        "requests_per_file_by_service": {k: round(v / per_file, 2) for k, v in http.items()},
+        "calls": {k: v for k, v in requests.items() if k.startswith(("graph.", "openai."))},
+        "peak_rss_mb": round(rss.peak_kb / 1024, 1),
+        "stages": metrics["stages"],
+        "counters": metrics["counters"],
+    }
+
+# ---------- reporting ----------
+
+def print_result(row: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> None:
+    def delta(key: str) -> str:
+        if not base or not base.get(key):
+            return ""
+        return f" ({(row[key] - base[key]) / base[key] * 100:+.1f}%)"
+
+    print(f"\n== {row['files']} files x {row['tenants']} tenant(s), tick {row['tick']} ==")
+    print(f"  wall {row['wall_s']}s{delta('wall_s')}   tagged {row['files_tagged']}   failed {row['files_failed']}")
+    print(f"  files/sec {row['files_per_sec']}{delta('files_per_sec')}   "
+          f"requests/file {row['requests_per_file']}{delta('requests_per_file')} {row['requests_per_file_by_service']}")
+    print(f"  peak RSS {row['peak_rss_mb']} MB{delta('peak_rss_mb')}")
+    if row["stages"]:
+        print(f"  {'stage':<14}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}")
+        for name, st in sorted(row["stages"].items(), key=lambda kv: -kv[1]["total_ms"]):
+            p95 = f"{st['p95_ms']:.1f}"
+            old = ((base or {}).get("stages") or {}).get(name)
+            if old and old.get("p95_ms"):
+                p95 += f" ({(st['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100:+.0f}%)"
+            print(f"  {name:<14}{st['count']:>8}{st['total_ms'] / 1000:>10.1f}{st['p50_ms']:>10.1f}{p95:>10}{st['max_ms']:>10.1f}{st['errors']:>8}")
+    if row["counters"]:
+        print("  counters: " + ", ".join(f"{k}={v}" for k, v in sorted(row["counters"].items())))
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark run_daemon against local fake services")
+    ap.add_argument("--files", default="100,1000", help="comma-separated corpus sizes per tenant (e.g. 100,1000,50000)")
+    ap.add_argument("--tenants", type=int, default=1)
+    ap.add_argument("--targets", type=int, default=1, help="upload targets (libraries) per tenant")
+    ap.add_argument("--ticks", type=int, default=1, help="daemon runs per corpus; later ticks measure the delta crawl")
+    ap.add_argument("--blob-connection-string",
+                    default=os.getenv("AZURE_STORAGE_CONNECTION_STRING") or "UseDevelopmentStorage=true")
+    ap.add_argument("--port", type=int, default=0, help="port for the fakes (default: any free port)")
+    ap.add_argument("--json", dest="json_out", help="write results to this file")
+    ap.add_argument("--baseline", help="results file from an earlier run to compare against")
+    ap.add_argument("--keep", action="store_true", help="keep the benchmark containers")
+    ap.add_argument("--tagging-mode", choices=("sync", "batch"), default="sync")
+    ap.add_argument("--log-level", default="WARNING")
+    for name, value in asdict(FakeConfig()).items():
+        ap.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    cfg = FakeConfig(**{k: getattr(args, k) for k in asdict(FakeConfig())})
+    sizes = [int(s) for s in args.files.split(",") if s.strip()]
+
+    proc, root = start_fakes(cfg, args.port)
+    baseline: Dict[tuple, Dict[str, Any]] = {}
+    if args.baseline:
+        with open(args.baseline) as fh:
+            for r in json.load(fh).get("results", []):
+                baseline[(r["files"], r["tenants"], r["tick"])] = r
+
+    results: List[Dict[str, Any]] = []
+    try:
+        configure_env(root, args.blob_connection_string, args.tagging_mode)
+        run_id = uuid.uuid4().hex[:6]
+        for size in sizes:
+            tenants = setup_tenants(size, args.tenants, args.targets, run_id)
+            try:
+                for tick in range(1, args.ticks + 1):
+                    row = {"files": size, "tenants": args.tenants, "targets": args.targets, "tick": tick}
+                    row.update(run_tick(root, tenants))
+                    results.append(row)
+                    print_result(row, baseline.get((size, args.tenants, tick)))
+            finally:
+                if not args.keep:
+                    drop_tenants(tenants)
+    finally:
+        proc.terminate()
+        proc.join(timeout=5)
+
+    if args.json_out:
+        meta = {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "fakes": asdict(cfg),
+            "env": {k: v for k, v in sorted(os.environ.items())
+                    if k.startswith(("DAEMON_", "EXTRACT_", "HTTP_", "OPENAI_RPM", "OPENAI_TPM", "NEAR_DUP_", "TAG_CACHE"))},
+        }
+        with open(args.json_out, "w") as fh:
+            json.dump({"meta": meta, "results": results}, fh, indent=2)
+        print(f"\nwrote {args.json_out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,481 @@
+# benchmarks/fakes.py
+"""
+Local stand-ins for the services a daemon run talks to, on one HTTP port:
+
+  /graph/v1.0/...                      Graph: folder listings, delta, listItem fields, content, $batch
+  /login/<tenant>/oauth2/v2.0/token    Entra ID client-credentials token endpoint
+  /openai/v1/chat/completions          OpenAI chat completions
+  /openai/v1/files, /openai/v1/batches OpenAI Batch API: input/output files and batches
+
+Every drive is a synthetic library whose size is encoded in its id
+("<anything>-n<count>", e.g. "drv-n5000-run1"), so one server can host corpora of
+any size. File contents are deterministic pseudo-text; tags PATCHed onto files are
+kept in memory, so a second tick over the same drive sees them. A batch completes
+batch_complete_s seconds after it was created (0: by the first poll); its lines are
+answered like chat completions, batch_error_rate of them with a per-line error.
+
+Latency and 429 injection are configurable per service. GET /_stats returns
+counters: "http.<service>" per HTTP request received, and one per Graph call by
+kind ("graph.list", "graph.fields", ..., including $batch sub-requests) and per
+injected 429; POST /_reset clears them.
+
+Stdlib only. Run stand-alone with:  python -m benchmarks.fakes --port 8765
+"""
+from __future__ import annotations
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+@dataclass
+class FakeConfig:
+    graph_latency_ms: float = 20.0
+    token_latency_ms: float = 50.0
+    openai_latency_ms: float = 300.0
+    content_latency_ms: float = 30.0    # extra time for a file download
+    graph_429_rate: float = 0.0         # share of Graph calls (and $batch sub-requests) answered 429
+    openai_429_rate: float = 0.0
+    batch_complete_s: float = 0.0       # time before a submitted batch reports completed
+    batch_error_rate: float = 0.0       # share of batch lines answered with an error
+    retry_after: float = 1.0            # Retry-After seconds sent with an injected 429
+    page_size: int = 200                # items per listing / delta page
+    file_kb: int = 8                    # size of each synthetic file
+    seed: int = 1
+
+# ---------- synthetic corpus ----------
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vo", "zi", "pra", "sto", "gre", "fin", "dal", "mor", "qua"]
+
+def _vocabulary(seed: int, size: int = 4000) -> List[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)]
+
+_COUNT = re.compile(r"-n(\d+)")
+
+class Drive:
+    """
+    count files named doc-000000.txt ... in one folder. version is bumped by every
+    PATCH so delta queries return the files changed since a token.
+    """
+    def __init__(self, drive_id: str, count: int) -> None:
+        self.drive_id = drive_id
+        self.folder_id = f"folder-{drive_id}"
+        self.count = count
+        self.tags: Dict[int, str] = {}
+        self.versions: Dict[int, int] = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def item(self, n: int, cfg: FakeConfig, expand: bool) -> Dict[str, Any]:
+        with self.lock:
+            v = self.versions.get(n, 0)
+            tags = self.tags.get(n)
+        it = {
+            "id": f"item-{n}",
+            "name": f"doc-{n:06d}.txt",
+            "file": {"mimeType": "text/plain"},
+            "size": cfg.file_kb * 1024,
+            "cTag": f'"c:{{{n}}},1"',
+            "eTag": f'"{{{n}}},{v + 1}"',
+            "parentReference": {"id": self.folder_id, "driveId": self.drive_id},
+        }
+        if expand:
+            it["listItem"] = {"fields": {"DocTaggerTags": tags} if tags else {}}
+        return it
+
+class FakeCloud:
+    def __init__(self, cfg: FakeConfig) -> None:
+        self.cfg = cfg
+        self.vocab = _vocabulary(cfg.seed)
+        self.drives: Dict[str, Drive] = {}
+        self.stats: Counter = Counter()
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(cfg.seed)
+
+    def drive(self, drive_id: str) -> Drive:
+        with self._lock:
+            d = self.drives.get(drive_id)
+            if d is None:
+                m = _COUNT.search(drive_id)
+                d = self.drives[drive_id] = Drive(drive_id, int(m.group(1)) if m else 100)
+            return d
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def inject_429(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+
+    def content(self, drive_id: str, n: int) -> bytes:
+        rng = random.Random(f"{self.cfg.seed}:{drive_id}:{n}")
+        words: List[str] = []
+        size = 0
+        limit = self.cfg.file_kb * 1024
+        while size < limit:
+            w = rng.choice(self.vocab)
+            words.append(w)
+            size += len(w) + 1
+        return (" ".join(words)[:limit]).encode("ascii")
+
+    # ---- Graph ----
+
+    _DRIVE = re.compile(r"^/sites/([^/]+)/drives/([^/]+)(/.*)?$")
+
+    def graph(self, method: str, path: str, query: Dict[str, List[str]], body: Any) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        Returns (status, JSON body or bytes, headers) for one Graph call.
+        """
+        if self.inject_429(self.cfg.graph_429_rate):
+            self.count("graph.429")
+            return 429, {"error": {"code": "TooManyRequests"}}, {"Retry-After": str(self.cfg.retry_after)}
+        m = self._DRIVE.match(path)
+        if not m:
+            return 404, {"error": {"code": "itemNotFound", "message": path}}, {}
+        drive = self.drive(m.group(2))
+        rest = m.group(3) or ""
+        expand = "listItem" in ",".join(query.get("$expand", []))
+
+        if rest.endswith("/children") and (rest.startswith("/root") or rest == f"/items/{drive.folder_id}/children"):
+            self.count("graph.list")
+            return 200, self._page(drive, range(drive.count), query, path, expand), {}
+        if rest.startswith("/items/") and rest.endswith("/children"):
+            self.count("graph.list")
+            return 200, {"value": []}, {}
+        if rest == "/root/delta":
+            self.count("graph.delta")
+            token = (query.get("token") or ["latest"])[0]
+            if token == "latest":
+                return 200, {"value": [], "@odata.deltaLink": self._delta_link(path, drive.version)}, {}
+            since = int(token)
+            with drive.lock:
+                changed = sorted(n for n, v in drive.versions.items() if v > since)
+                now = drive.version
+            page = self._page(drive, changed, query, path, expand)
+            if "@odata.nextLink" not in page:
+                page["@odata.deltaLink"] = self._delta_link(path, now)
+            return 200, page, {}
+        if rest in ("/root", "") or (rest.startswith("/root:") and not rest.endswith(":/children")):
+            self.count("graph.folder")
+            return 200, {"id": drive.folder_id, "name": rest.rpartition("/")[2] or "root", "folder": {}}, {}
+
+        im = re.match(r"^/items/item-(\d+)(/.*)$", rest)
+        if not im or int(im.group(1)) >= drive.count:
+            return 404, {"error": {"code": "itemNotFound", "message": path}}, {}
+        n, sub = int(im.group(1)), im.group(2)
+        if sub == "/content" and method == "GET":
+            self.count("graph.content")
+            time.sleep(self.cfg.content_latency_ms / 1000.0)
+            return 200, self.content(drive.drive_id, n), {"Content-Type": "text/plain"}
+        if sub == "/listItem/fields" and method == "GET":
+            self.count("graph.fields")
+            with drive.lock:
+                tags = drive.tags.get(n)
+            return 200, {"DocTaggerTags": tags} if tags else {}, {}
+        if sub == "/listItem/fields" and method == "PATCH":
+            self.count("graph.patch")
+            with drive.lock:
+                drive.version += 1
+                drive.versions[n] = drive.version
+                drive.tags[n] = (body or {}).get("DocTaggerTags") or ""
+            return 200, dict(body or {}), {}
+        return 404, {"error": {"code": "itemNotFound", "message": path}}, {}
+
+    def _page(self, drive: Drive, numbers, query: Dict[str, List[str]], path: str, expand: bool) -> Dict[str, Any]:
+        numbers = list(numbers)
+        start = int((query.get("$skiptoken") or ["0"])[0])
+        end = start + self.cfg.page_size
+        page: Dict[str, Any] = {"value": [drive.item(n, self.cfg, expand) for n in numbers[start:end]]}
+        if end < len(numbers):
+            rest = {k: v[0] for k, v in query.items() if k != "$skiptoken"}
+            qs = "&".join(f"{k}={v}" for k, v in rest.items())
+            page["@odata.nextLink"] = f"{self.base}{path}?{qs + '&' if qs else ''}$skiptoken={end}"
+        return page
+
+    def _delta_link(self, path: str, version: int) -> str:
+        return f"{self.base}{path}?token={version}"
+
+    def graph_batch(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        responses = []
+        for sub in (body or {}).get("requests") or []:
+            parts = urlsplit(sub.get("url", ""))
+            status, payload, headers = self.graph(sub.get("method", "GET"), parts.path, parse_qs(parts.query), sub.get("body"))
+            responses.append({"id": sub.get("id"), "status": status, "headers": headers, "body": payload})
+        return {"responses": responses}
+
+    # ---- token / OpenAI ----
+
+    def token(self, tenant: str) -> Dict[str, Any]:
+        self.count("token")
+        return {"token_type": "Bearer", "expires_in": 3599, "access_token": f"fake-{tenant}"}
+
+    def chat(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        if self.inject_429(self.cfg.openai_429_rate):
+            self.count("openai.429")
+            return 429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}, {
+                "retry-after": str(self.cfg.retry_after),
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": f"{self.cfg.retry_after}s",
+            }
+        self.count("openai.chat")
+        return 200, self._completion(body), {"x-ratelimit-remaining-requests": "10000", "x-ratelimit-remaining-tokens": "10000000"}
+
+    def _completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        text = " ".join(str(m.get("content") or "") for m in body.get("messages") or [])
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        tags = [self.vocab[(digest[i] << 8 | digest[i + 1]) % len(self.vocab)] for i in range(0, 16, 2)]
+        prompt_tokens = len(text) // 4
+        return {
+            "id": f"chatcmpl-{digest.hex()[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or "fake",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": ", ".join(tags)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+        }
+
+    # ---- OpenAI Batch API ----
+
+    def _store_file(self, data: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        meta = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self._lock:
+            self.files[meta["id"]] = {"meta": meta, "data": data}
+        return meta
+
+    def upload_file(self, form: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self.count("openai.files")
+        upload = form.get("file")
+        if not isinstance(upload, tuple):
+            return 400, {"error": {"message": "missing 'file' part"}}
+        filename, data = upload
+        return 200, self._store_file(data, filename, str(form.get("purpose") or "batch"))
+
+    def file_content(self, file_id: str) -> Tuple[int, Any]:
+        with self._lock:
+            f = self.files.get(file_id)
+        if f is None:
+            return 404, {"error": {"message": f"No such File object: {file_id}"}}
+        return 200, f["data"]
+
+    def create_batch(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self.count("openai.batches")
+        with self._lock:
+            known = body.get("input_file_id") in self.files
+        if not known:
+            return 400, {"error": {"message": f"No such File object: {body.get('input_file_id')}"}}
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window") or "24h",
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "metadata": body.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self._lock:
+            self.batches[batch["id"]] = {"batch": batch, "due": time.monotonic() + self.cfg.batch_complete_s}
+        return 200, dict(batch)
+
+    def retrieve_batch(self, batch_id: str) -> Tuple[int, Dict[str, Any]]:
+        self.count("openai.batch_poll")
+        with self._lock:
+            entry = self.batches.get(batch_id)
+        if entry is None:
+            return 404, {"error": {"message": f"No such Batch object: {batch_id}"}}
+        if entry["batch"]["status"] == "in_progress" and time.monotonic() >= entry["due"]:
+            self._complete(entry["batch"])
+        return 200, dict(entry["batch"])
+
+    def _complete(self, batch: Dict[str, Any]) -> None:
+        with self._lock:
+            data = self.files[batch["input_file_id"]]["data"]
+        out: List[str] = []
+        err: List[str] = []
+        for raw in data.decode("utf-8").splitlines():
+            if not raw.strip():
+                continue
+            line = json.loads(raw)
+            cid = line.get("custom_id")
+            if self.inject_429(self.cfg.batch_error_rate):
+                err.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": cid, "response": None,
+                                       "error": {"code": "server_error", "message": "injected batch line error"}}))
+                continue
+            self.count("openai.batch_line")
+            out.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": cid, "error": None,
+                                   "response": {"status_code": 200, "request_id": uuid.uuid4().hex,
+                                                "body": self._completion(line.get("body") or {})}}))
+        if out:
+            batch["output_file_id"] = self._store_file(("\n".join(out) + "\n").encode("utf-8"), "output.jsonl", "batch_output")["id"]
+        if err:
+            batch["error_file_id"] = self._store_file(("\n".join(err) + "\n").encode("utf-8"), "errors.jsonl", "batch_output")["id"]
+        batch["request_counts"] = {"total": len(out) + len(err), "completed": len(out), "failed": len(err)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    # ---- server ----
+
+    base = ""
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        cloud = self
+
+        class Handler(_Handler):
+            pass
+        Handler.cloud = cloud
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        self.base = f"http://{host}:{server.server_address[1]}/graph/v1.0"
+        return server
+
+def _multipart(ctype: str, raw: bytes) -> Dict[str, Any]:
+    """
+    Form fields of a multipart/form-data body: file parts as (filename, bytes),
+    the others as text.
+    """
+    from email.parser import BytesParser
+    from email.policy import HTTP
+    msg = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + ctype.encode("latin-1") + b"\r\n\r\n" + raw)
+    form: Dict[str, Any] = {}
+    for part in msg.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        data = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        form[name] = (filename, data) if filename else data.decode("utf-8")
+    return form
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real services
+    cloud: FakeCloud
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _body(self) -> Any:
+        n = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        if not raw:
+            return None
+        ctype = self.headers.get("Content-Type") or ""
+        if "json" in ctype:
+            return json.loads(raw)
+        if ctype.startswith("multipart/form-data"):
+            return _multipart(ctype, raw)
+        return parse_qs(raw.decode("utf-8"))
+
+    def _send(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        if isinstance(payload, bytes):
+            data = payload
+            ctype = "application/octet-stream"
+        else:
+            data = json.dumps(payload).encode("utf-8")
+            ctype = "application/json"
+        self.send_response(status)
+        headers = dict(headers or {})
+        self.send_header("Content-Type", headers.pop("Content-Type", ctype))
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, method: str) -> None:
+        cloud, cfg = self.cloud, self.cloud.cfg
+        parts = urlsplit(self.path)
+        path, query = parts.path, parse_qs(parts.query)
+        body = self._body() if method in ("POST", "PATCH") else None
+
+        if path == "/_stats":
+            with cloud._lock:
+                stats = dict(cloud.stats)
+            return self._send(200, {"requests": stats, "config": asdict(cfg)})
+        if path == "/_reset":
+            with cloud._lock:
+                cloud.stats.clear()
+            return self._send(200, {})
+        if path.startswith("/login/") and path.endswith("/oauth2/v2.0/token"):
+            cloud.count("http.token")
+            time.sleep(cfg.token_latency_ms / 1000.0)
+            return self._send(200, cloud.token(path.split("/")[2]))
+        if path == "/openai/v1/chat/completions" and method == "POST":
+            cloud.count("http.openai")
+            time.sleep(cfg.openai_latency_ms / 1000.0)
+            return self._send(*cloud.chat(body or {}))
+        if path.startswith(("/openai/v1/files", "/openai/v1/batches")):
+            cloud.count("http.openai")
+            time.sleep(cfg.openai_latency_ms / 1000.0)
+            sub = path[len("/openai/v1"):]
+            if sub == "/files" and method == "POST":
+                return self._send(*cloud.upload_file(body or {}))
+            m = re.match(r"^/files/([^/]+)/content$", sub)
+            if m and method == "GET":
+                return self._send(*cloud.file_content(m.group(1)))
+            if sub == "/batches" and method == "POST":
+                return self._send(*cloud.create_batch(body or {}))
+            m = re.match(r"^/batches/([^/]+)$", sub)
+            if m and method == "GET":
+                return self._send(*cloud.retrieve_batch(m.group(1)))
+        if path.startswith("/graph/v1.0"):
+            cloud.count("http.graph")
+            time.sleep(cfg.graph_latency_ms / 1000.0)
+            sub = path[len("/graph/v1.0"):]
+            if sub == "/$batch" and method == "POST":
+                cloud.count("graph.batch")
+                return self._send(200, cloud.graph_batch(body or {}))
+            return self._send(*cloud.graph(method, sub, query, body))
+        self._send(404, {"error": {"message": f"no fake for {method} {path}"}})
+
+    def do_GET(self) -> None:
+        self._route("GET")
+
+    def do_POST(self) -> None:
+        self._route("POST")
+
+    def do_PATCH(self) -> None:
+        self._route("PATCH")
+
+def serve_forever(cfg: Dict[str, Any], host: str, port: int) -> None:
+    """
+    Process entry point used by the benchmark runner.
+    """
+    server = FakeCloud(FakeConfig(**cfg)).serve(host, port)
+    server.serve_forever()
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Fake Graph / token / OpenAI endpoints for daemon benchmarks")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    for name, value in asdict(FakeConfig()).items():
+        ap.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = vars(ap.parse_args())
+    host, port = args.pop("host"), args.pop("port")
+    print(f"fakes listening on http://{host}:{port}")
+    serve_forever(args, host, port)
+
+if __name__ == "__main__":
+    main()
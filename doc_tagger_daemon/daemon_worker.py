@@ -5,11 +5,33 @@ import io
 import os
 import json
 import time
+import queue
 import logging
+import functools
+import itertools
+import threading
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Callable
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Callable, Union
 from shared.secrets import get_secret
+from shared.settings import env_bool, env_float, env_int, env_str
+from shared.pipeline import FairScheduler, FilePipeline, StageLimits
+from shared.graph_batch import GRAPH_V1, GraphBatcher
+from shared.run_status import RunStatusBuffer
+from shared.run_metrics import RunMetrics, bind, call_bound, current as current_metrics, incr, timed
+from shared.rate_governor import BudgetExhausted
+from shared.http_client import get_http_client
+from shared.downloads import DownloadTooLarge, SpooledDownload
+from shared.tagging_utils import TAG_TEXT_CHARS
+from shared.openai_batch import (
+    BatchCollector, TERMINAL_STATES, custom_id_for, fetch_batch_results, load_batch_state,
+    pending_custom_ids, read_input_lines, save_batch_state, submit_batch,
+)
+
+if TYPE_CHECKING:
+    from shared.graph_auth import GraphToken  # imported lazily: it reads secrets at import
 
 @dataclass
 class Target:
@@ -19,20 +41,32 @@ class Target:
     folder: str
     enabled: bool = True
 
+class GraphRequestError(RuntimeError):
+    """
+    RuntimeError raised for failed Graph calls; keeps the HTTP status for callers
+    that need to react to specific codes (e.g. 410 on an expired delta link).
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+# A fixed bearer token, or a GraphToken resolved per request (and refreshed on 401).
+TokenSource = Union[str, "GraphToken"]
+
 def _utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
 def _retryable_request(fn, max_attempts: int = 5, base_sleep: float = 0.8, max_sleep: float = 10.0):
-    import requests
+    import httpx
     attempt = 0
-    resp: Optional[requests.Response] = None
+    resp: Optional[httpx.Response] = None
     while attempt < max_attempts:
         attempt += 1
         try:
             resp = fn()
             if resp.status_code < 400 or (400 <= resp.status_code < 500 and resp.status_code != 429):
                 return resp
-        except requests.RequestException:
+        except httpx.HTTPError:
             pass
         retry_after = 0.0
         if resp is not None:
@@ -42,63 +76,369 @@ def _retryable_request(fn, max_attempts: int = 5, base_sleep: float = 0.8, max_s
             except ValueError:
                 retry_after = 0.0
         sleep_s = max(retry_after, min(max_sleep, base_sleep * (2 ** (attempt - 1))))
+        if attempt < max_attempts:
+            incr("graph_retries")
+            if resp is not None and resp.status_code == 429:
+                incr("graph_429")
+        if resp is not None and attempt < max_attempts:
+            resp.close()  # hands a streamed response's connection back before retrying
         time.sleep(sleep_s)
     if resp is None:
         raise RuntimeError("Request failed after retries with no response object.")
     return resp
 
-def _graph_get(url: str, token: str) -> Dict[str, Any]:
-    import requests
-    def _do():
-        return requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    resp = _retryable_request(_do)
-    if not resp or resp.status_code >= 400:
-        raise RuntimeError(f"Graph GET failed {resp.status_code if resp else '??'}: {url} :: {getattr(resp, 'text', '')[:2000]}")
+def _authorized_request(fn: Callable[[str], Any], token: TokenSource):
+    """
+    _retryable_request for a Graph call made by fn(bearer). A GraphToken is resolved
+    for the call, and a 401 gets one more round with a freshly fetched token.
+    """
+    if isinstance(token, str):
+        return _retryable_request(lambda: fn(token))
+    bearer = token.get()
+    resp = _retryable_request(lambda: fn(bearer))
+    if resp.status_code == 401:
+        incr("graph_401")
+        resp.close()
+        bearer = token.refresh(bearer)
+        resp = _retryable_request(lambda: fn(bearer))
+    return resp
+
+def _graph_get(url: str, token: TokenSource) -> Dict[str, Any]:
+    def _do(bearer: str):
+        return get_http_client().get(url, headers={"Authorization": f"Bearer {bearer}"}, timeout=60)
+    resp = _authorized_request(_do, token)
+    if resp.status_code >= 400:
+        raise GraphRequestError(
+            f"Graph GET failed {resp.status_code}: {url} :: {resp.text[:2000]}",
+            status_code=resp.status_code,
+        )
     return resp.json()
 
-def _graph_get_bytes(url: str, token: str) -> bytes:
-    import requests
-    def _do():
-        return requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=300)
-    resp = _retryable_request(_do)
-    if not resp or resp.status_code >= 400:
-        raise RuntimeError(f"Graph GET(bytes) failed {resp.status_code if resp else '??'}: {url}")
-    return resp.content
-
-def _graph_patch(url: str, token: str, payload: Dict[str, Any]) -> None:
-    import requests
-    def _do():
-        return requests.patch(
+def _graph_download(url: str, token: TokenSource, max_bytes: Optional[int], memory_limit: int,
+                    spool_dir: Optional[str] = None, max_attempts: int = 3) -> SpooledDownload:
+    """
+    Streams a file into a SpooledDownload (memory up to memory_limit bytes, then a
+    temp file). Raises DownloadTooLarge as soon as the declared or received size
+    passes max_bytes, so an oversized file is never read to the end.
+    """
+    import httpx
+    client = get_http_client()
+
+    def _do(bearer: str):
+        req = client.build_request("GET", url, headers={"Authorization": f"Bearer {bearer}"}, timeout=300)
+        return client.send(req, stream=True)
+
+    for attempt in range(1, max_attempts + 1):
+        resp = _authorized_request(_do, token)
+        spool = SpooledDownload(memory_limit, max_bytes=max_bytes, spool_dir=spool_dir)
+        try:
+            if resp.status_code >= 400:
+                raise GraphRequestError(f"Graph GET(bytes) failed {resp.status_code}: {url}", status_code=resp.status_code)
+            declared = int(resp.headers.get("Content-Length") or 0)
+            if max_bytes is not None and declared > max_bytes:
+                raise DownloadTooLarge(f"download is {declared} bytes, limit {max_bytes}", size=declared)
+            received = 0
+            for chunk in resp.iter_bytes(1024 * 1024):
+                spool.write(chunk)
+                received += len(chunk)
+            incr("bytes_downloaded", received)
+            return spool.finish()
+        except httpx.TransportError:
+            # connection dropped mid-body: start over with a fresh request
+            spool.close()
+            if attempt == max_attempts:
+                raise
+            incr("graph_retries")
+            time.sleep(min(10.0, 0.8 * (2 ** (attempt - 1))))
+        except BaseException:
+            spool.close()
+            raise
+        finally:
+            resp.close()
+    raise RuntimeError("unreachable")
+
+def _graph_patch(url: str, token: TokenSource, payload: Dict[str, Any]) -> None:
+    def _do(bearer: str):
+        return get_http_client().patch(
             url,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-            data=json.dumps(payload).encode("utf-8"),
+            headers={"Authorization": f"Bearer {bearer}", "Content-Type": "application/json"},
+            content=json.dumps(payload).encode("utf-8"),
             timeout=60,
         )
-    resp = _retryable_request(_do)
-    if not resp or resp.status_code >= 400:
-        raise RuntimeError(f"Graph PATCH failed {resp.status_code if resp else '??'}: {url} :: {getattr(resp, 'text', '')[:2000]}")
+    resp = _authorized_request(_do, token)
+    if resp.status_code >= 400:
+        raise GraphRequestError(
+            f"Graph PATCH failed {resp.status_code}: {url} :: {resp.text[:2000]}",
+            status_code=resp.status_code,
+        )
+
+def _graph_post_json(url: str, token: TokenSource, payload: Dict[str, Any]) -> Dict[str, Any]:
+    def _do(bearer: str):
+        return get_http_client().post(
+            url,
+            headers={"Authorization": f"Bearer {bearer}", "Content-Type": "application/json"},
+            content=json.dumps(payload).encode("utf-8"),
+            timeout=120,
+        )
+    resp = _authorized_request(_do, token)
+    if resp.status_code >= 400:
+        raise GraphRequestError(
+            f"Graph POST failed {resp.status_code}: {url} :: {resp.text[:2000]}",
+            status_code=resp.status_code,
+        )
+    return resp.json()
 
-def _list_files(site_id: str, drive_id: str, folder: str, token: str) -> List[Dict[str, Any]]:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/root:/{folder}:/children"
+def _make_batcher(token: TokenSource) -> Optional[GraphBatcher]:
+    """
+    DAEMON_GRAPH_BATCH=0 disables $batch; DAEMON_GRAPH_BATCH_LINGER_MS is how long a
+    partial batch waits for more sub-requests (default 50 ms).
+    """
+    if not env_bool("DAEMON_GRAPH_BATCH", True):
+        return None
+    metrics = current_metrics()  # the sender thread records on the caller's scope
+
+    def _send(payload: Dict[str, Any]) -> Dict[str, Any]:
+        with bind(metrics), timed("graph_batch"):
+            return _graph_post_json(f"{GRAPH_V1}/$batch", token, payload)
+
+    def _on_retry(status: Optional[int]) -> None:
+        if metrics is not None:
+            metrics.add("graph_retries")
+            if status == 429:
+                metrics.add("graph_429")
+
+    return GraphBatcher(
+        _send,
+        linger=env_int("DAEMON_GRAPH_BATCH_LINGER_MS", 50, minimum=0) / 1000.0,
+        on_retry=_on_retry,
+    )
+
+# Projection used for folder listings: just what the daemon needs, plus the tag
+# column inline so already-tagged files can be dropped without a per-item GET.
+_LIST_SELECT = "id,name,file,folder,size,cTag,eTag,parentReference"
+_LIST_EXPAND = "listItem($expand=fields($select=DocTaggerTags))"
+
+def _children_query() -> str:
+    if not env_bool("DAEMON_LIST_EXPAND_FIELDS", True):
+        return ""
+    return f"?$select={_LIST_SELECT}&$expand={_LIST_EXPAND}"
+
+def _iter_children(site_id: str, drive_id: str, folder: str, token: TokenSource, recursive: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the items of a folder page by page, following @odata.nextLink.
+    With recursive=True sub-folders are walked depth-first as they are found.
+    Folder items themselves are yielded too; callers filter on the 'file' facet.
+    Unless DAEMON_LIST_EXPAND_FIELDS=0, items carry listItem.fields.DocTaggerTags.
+    """
+    base = f"{GRAPH_V1}/sites/{site_id}/drives/{drive_id}"
+    path = folder.strip("/")
+    query = _children_query()
+    pending = [f"{base}/root:/{path}:/children{query}" if path else f"{base}/root/children{query}"]
+    while pending:
+        url: Optional[str] = pending.pop()
+        while url:
+            with timed("list"):
+                data = _graph_get(url, token)
+            for it in data.get("value", []):
+                if recursive and it.get("folder") and it.get("id"):
+                    pending.append(f"{base}/items/{it['id']}/children{query}")
+                yield it
+            url = data.get("@odata.nextLink")
+
+def _get_folder_item(site_id: str, drive_id: str, folder: str, token: TokenSource) -> Dict[str, Any]:
+    path = folder.strip("/")
+    base = f"{GRAPH_V1}/sites/{site_id}/drives/{drive_id}"
+    url = f"{base}/root:/{path}" if path else f"{base}/root"
+    return _graph_get(url, token)
+
+def _latest_delta_link(site_id: str, drive_id: str, token: TokenSource) -> Optional[str]:
+    """
+    Returns a delta link pointing at "now" without enumerating the drive.
+    """
+    url = f"{GRAPH_V1}/sites/{site_id}/drives/{drive_id}/root/delta?token=latest"
     data = _graph_get(url, token)
-    return data.get("value", [])
+    return data.get("@odata.deltaLink")
+
+class _DeltaCursor:
+    """
+    Receives the new delta link once a change feed has been read to the end.
+    'complete' stays False if the consumer stopped early or enumeration failed.
+    failed_ids collects the files to retry by id on the next run, since the new
+    link no longer reports them.
+    """
+    def __init__(self, link: Optional[str] = None, complete: bool = False) -> None:
+        self.link = link
+        self.complete = complete
+        self.failed_ids: Set[str] = set()
+
+def _iter_items(site_id: str, drive_id: str, item_ids: Iterable[str], token: TokenSource,
+                cursor: _DeltaCursor) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the current listing entries of files that failed on an earlier run.
+    Deleted ones are dropped; ones that can't be read stay on the cursor's failed_ids.
+    """
+    base = f"{GRAPH_V1}/sites/{site_id}/drives/{drive_id}"
+    query = _children_query()
+    for item_id in item_ids:
+        try:
+            with timed("list"):
+                item = _graph_get(f"{base}/items/{item_id}{query}", token)
+        except Exception as e:
+            if not (isinstance(e, GraphRequestError) and e.status_code == 404):
+                logging.warning("Reading failed item %s for a retry failed: %s", item_id, e)
+                cursor.failed_ids.add(item_id)
+            continue
+        yield item
+
+def _iter_changes(site_id: str, drive_id: str, folder_id: str, delta_link: str, token: TokenSource,
+                  cursor: _DeltaCursor, recursive: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Follows a saved delta link page by page and yields changed items under folder_id.
+    SharePoint only supports delta on the drive root, so items are filtered by parent
+    here; with recursive=True, unknown parents are resolved by walking up the tree once.
+    """
+    inside: Dict[str, bool] = {folder_id: True}
+    base = f"{GRAPH_V1}/sites/{site_id}/drives/{drive_id}"
+
+    def _under_target(parent_id: Optional[str]) -> bool:
+        if not parent_id:
+            return False
+        if parent_id in inside or not recursive:
+            return inside.get(parent_id, False)
+        chain: List[str] = []
+        pid: Optional[str] = parent_id
+        while pid and pid not in inside:
+            chain.append(pid)
+            parent = _graph_get(f"{base}/items/{pid}?$select=id,parentReference", token)
+            pid = (parent.get("parentReference") or {}).get("id")
+        verdict = inside.get(pid, False) if pid else False
+        for c in chain:
+            inside[c] = verdict
+        return verdict
+
+    url: Optional[str] = delta_link
+    while url:
+        with timed("list"):
+            data = _graph_get(url, token)
+        for it in data.get("value", []):
+            if it.get("deleted"):
+                continue
+            if not _under_target((it.get("parentReference") or {}).get("id")):
+                continue
+            if it.get("folder") and it.get("id"):
+                inside[it["id"]] = True
+            yield it
+        url = data.get("@odata.nextLink")
+        cursor.link = data.get("@odata.deltaLink") or cursor.link
+    cursor.complete = True
+
+def _read_ahead(items: Iterable[Dict[str, Any]], max_items: int) -> Iterator[Dict[str, Any]]:
+    """
+    Pulls from 'items' on a background thread so the next listing pages are fetched
+    while the caller is still working on the current ones. At most max_items are
+    buffered; errors raised by the producer are re-raised in the consumer.
+    """
+    if max_items <= 0:
+        yield from items
+        return
+
+    buf: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=max_items)
+    stop = threading.Event()
+    metrics = current_metrics()
+
+    def _put(kind: str, value: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buf.put((kind, value), timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-def _get_file_fields(site_id: str, drive_id: str, file_id: str, token: str) -> Dict[str, Any]:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{file_id}/listItem/fields"
+    def _produce() -> None:
+        try:
+            for it in items:
+                if not _put("item", it):
+                    return
+            _put("done", None)
+        except BaseException as e:  # surfaced to the consumer
+            _put("error", e)
+
+    threading.Thread(target=call_bound, args=(metrics, _produce), name="daemon-list-readahead", daemon=True).start()
+    try:
+        while True:
+            kind, value = buf.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
+
+def _fields_url(site_id: str, drive_id: str, file_id: str) -> str:
+    return f"{GRAPH_V1}/sites/{site_id}/drives/{drive_id}/items/{file_id}/listItem/fields"
+
+def _get_file_fields(site_id: str, drive_id: str, file_id: str, token: TokenSource, batcher: Optional[GraphBatcher] = None) -> Dict[str, Any]:
+    url = _fields_url(site_id, drive_id, file_id)
+    if batcher is not None:
+        return batcher.get(url)
     return _graph_get(url, token)
 
-def _download_file(site_id: str, drive_id: str, file_id: str, token: str) -> bytes:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{file_id}/content"
-    return _graph_get_bytes(url, token)
+@dataclass
+class DownloadLimits:
+    max_bytes: Optional[int]
+    memory_bytes: int
+    oversize_policy: str
+    spool_dir: Optional[str]
+
+def _download_limits() -> DownloadLimits:
+    """
+    DAEMON_MAX_DOWNLOAD_MB: largest file the daemon downloads (default 200, 0 = no limit).
+    DAEMON_SPOOL_MEMORY_MB: downloads up to this size stay in memory, larger ones
+    spill to a temp file in DAEMON_SPOOL_DIR (default 8 MB, system temp dir).
+    DAEMON_OVERSIZE_POLICY: 'skip' (default) logs and passes over files above the
+    limit; 'fail' counts them as failures, which are retried on later runs.
+    """
+    max_mb = env_int("DAEMON_MAX_DOWNLOAD_MB", 200, minimum=0)
+    policy = env_str("DAEMON_OVERSIZE_POLICY", "skip").lower()
+    return DownloadLimits(
+        max_bytes=max_mb * 1024 * 1024 if max_mb else None,
+        memory_bytes=env_int("DAEMON_SPOOL_MEMORY_MB", 8, minimum=0) * 1024 * 1024,
+        oversize_policy=policy if policy in ("skip", "fail") else "skip",
+        spool_dir=env_str("DAEMON_SPOOL_DIR", "") or None,
+    )
+
+def _download_file(site_id: str, drive_id: str, file_id: str, token: TokenSource,
+                   limits: Optional[DownloadLimits] = None) -> SpooledDownload:
+    limits = limits or _download_limits()
+    url = f"{GRAPH_V1}/sites/{site_id}/drives/{drive_id}/items/{file_id}/content"
+    return _graph_download(url, token, limits.max_bytes, limits.memory_bytes, limits.spool_dir)
 
-def _patch_metadata(site_id: str, drive_id: str, file_id: str, tags_csv: str, token: str) -> None:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{file_id}/listItem/fields"
+def _patch_metadata(site_id: str, drive_id: str, file_id: str, tags_csv: str, token: TokenSource, batcher: Optional[GraphBatcher] = None) -> None:
+    url = _fields_url(site_id, drive_id, file_id)
+    if batcher is not None:
+        batcher.patch(url, {"DocTaggerTags": tags_csv})
+        return
     _graph_patch(url, token, {"DocTaggerTags": tags_csv})
 
 def _already_tagged(fields: Dict[str, Any]) -> bool:
     value = fields.get("DocTaggerTags")
     return value not in (None, "")
 
+def _inline_fields(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    listItem fields expanded into a listing entry, or None when the listing
+    did not include them (delta pages, or expansion turned off).
+    """
+    fields = (item.get("listItem") or {}).get("fields")
+    return fields if isinstance(fields, dict) else None
+
+def _resolved(value: Any) -> Future:
+    fut: Future = Future()
+    fut.set_result(value)
+    return fut
+
 def _load_targets_for_tenant(tenant_id: str) -> List[Target]:
     from shared.blob_utils import load_json_blob
     cfg = load_json_blob(tenant_id, "upload_targets.json") or []
@@ -132,153 +472,965 @@ def _make_openai_client():
     key = get_secret("OpenAI-ApiKey") or os.getenv("OPENAI_API_KEY")
     if not key:
         raise RuntimeError("OpenAI API key not set (neither OpenAI-ApiKey in Key Vault nor OPENAI_API_KEY env var)")
-    return OpenAI(api_key=key)
+    # Long-lived client on the shared connection pool; passed down to get_tags.
+    return OpenAI(api_key=key, http_client=get_http_client())
 
-def _get_graph_token_for_tenant(tenant_id: str) -> str:
-    from shared.graph_auth import get_graph_token
-    return get_graph_token(tenant_id)
+def _get_graph_token_for_tenant(tenant_id: str) -> "GraphToken":
+    """
+    The tenant's token source for a run. Requests resolve it as they go, so long
+    targets keep working across token expiry; the first token is fetched here so
+    bad credentials fail the target up front.
+    """
+    from shared.graph_auth import GraphToken
+    token = GraphToken(tenant_id)
+    token.get()
+    return token
+
+# Per-target status and upload log entries are buffered for the run and written
+# at target boundaries, every DAEMON_STATUS_FLUSH_SECONDS (default 30) and at the end.
+_run_status: Optional[RunStatusBuffer] = None
+_run_status_lock = threading.Lock()
+
+def _status_buffer() -> RunStatusBuffer:
+    global _run_status
+    with _run_status_lock:
+        if _run_status is None:
+            _run_status = RunStatusBuffer(
+                flush_interval=env_float("DAEMON_STATUS_FLUSH_SECONDS", 30.0, minimum=0),
+            ).start()
+        return _run_status
+
+def _close_status_buffer() -> None:
+    global _run_status
+    with _run_status_lock:
+        buf, _run_status = _run_status, None
+    if buf is not None:
+        buf.close()
 
 def _append_log(tenant_id: str, entry: Dict[str, Any]) -> None:
-    from shared.blob_utils import append_log_entry
-    _ = append_log_entry(tenant_id, entry)
+    _status_buffer().append_log(tenant_id, entry)
 
 def _update_status(tenant_id: str, label: str, patch: Dict[str, Any]) -> None:
-    from shared.blob_utils import update_daemon_status
-    update_daemon_status(tenant_id, label, patch)
+    _status_buffer().update_status(tenant_id, label, patch)
+
+def _load_delta_state(tenant_id: str, target: Target) -> Tuple[Optional[str], List[str]]:
+    """
+    Returns (delta link, ids of files that failed before it) for the target.
+    """
+    from shared.blob_utils import get_delta_state
+    state = get_delta_state(tenant_id, target.label)
+    # A target re-pointed at another site/drive/folder must start over.
+    if (state.get("siteId"), state.get("driveId"), state.get("folder")) != (target.site_id, target.drive_id, target.folder):
+        return None, []
+    return state.get("deltaLink"), [i for i in state.get("failedIds") or [] if isinstance(i, str)]
+
+def _save_delta_link(tenant_id: str, target: Target, delta_link: Optional[str],
+                     failed_ids: Iterable[str] = ()) -> None:
+    from shared.blob_utils import set_delta_state
+    set_delta_state(tenant_id, target.label, {
+        "siteId": target.site_id,
+        "driveId": target.drive_id,
+        "folder": target.folder,
+        "deltaLink": delta_link,
+        "failedIds": sorted(failed_ids),
+    })
 
-def _write_tenant_status(tenant_id: str, *, processed: int, tagged: int, failed: int, last_error: Optional[str]) -> None:
+def _max_retry_ids() -> int:
+    """
+    DAEMON_MAX_RETRY_IDS: most failed files a target carries over to be retried by
+    id (default 1000). With more failures than that its delta link stays where it
+    is, so the whole change feed is read again.
+    """
+    return env_int("DAEMON_MAX_RETRY_IDS", 1000, minimum=0)
+
+def _crawl_mode() -> str:
+    """
+    DAEMON_CRAWL_MODE: 'delta' (default) only looks at items changed since the last
+    successful run of a target; 'full' re-lists the whole folder every run.
+    """
+    mode = (os.getenv("DAEMON_CRAWL_MODE", "delta") or "delta").strip().lower()
+    return mode if mode in ("delta", "full") else "delta"
+
+def _enumerate_target(tenant_id: str, target: Target, token: TokenSource) -> Tuple[Iterator[Dict[str, Any]], _DeltaCursor]:
+    """
+    Returns (lazy stream of items to consider, cursor holding the delta link to save
+    once the target run succeeds). A delta crawl starts with the files that failed
+    on the previous run. Without a usable delta link this falls back to a full
+    listing, taking a 'latest' delta link first so nothing changed during the
+    listing is missed. DAEMON_RECURSIVE=1 includes sub-folders of the target folder.
+    """
+    recursive = env_bool("DAEMON_RECURSIVE", False)
+    readahead = env_int("DAEMON_LIST_READAHEAD", 500, minimum=0)
+
+    if _crawl_mode() != "delta":
+        items = _iter_children(target.site_id, target.drive_id, target.folder, token, recursive=recursive)
+        return _read_ahead(items, readahead), _DeltaCursor()
+
+    saved, retry_ids = _load_delta_state(tenant_id, target)
+    if saved:
+        try:
+            folder_id = _get_folder_item(target.site_id, target.drive_id, target.folder, token)["id"]
+            cursor = _DeltaCursor()
+            # Read the first page eagerly so an expired link is detected here.
+            changes = _iter_changes(target.site_id, target.drive_id, folder_id, saved, token, cursor, recursive=recursive)
+            first = next(changes, None)
+            head = [first] if first is not None else []
+            logging.info("[tenant=%s] Delta crawl of '%s' (%d failed files to retry)", tenant_id, target.label, len(retry_ids))
+            retries = set(retry_ids)
+            items = itertools.chain(
+                _iter_items(target.site_id, target.drive_id, retry_ids, token, cursor),
+                (it for it in itertools.chain(head, changes) if it.get("id") not in retries),
+            )
+            return _read_ahead(items, readahead), cursor
+        except GraphRequestError as e:
+            if e.status_code not in (400, 404, 410):
+                raise
+            logging.warning("[tenant=%s] Delta link for '%s' rejected (%s); doing a full resync", tenant_id, target.label, e.status_code)
+
+    cursor = _DeltaCursor(link=_latest_delta_link(target.site_id, target.drive_id, token))
+
+    def _full() -> Iterator[Dict[str, Any]]:
+        yield from _iter_children(target.site_id, target.drive_id, target.folder, token, recursive=recursive)
+        cursor.complete = True
+
+    return _read_ahead(_full(), readahead), cursor
+
+def _write_tenant_status(tenant_id: str, *, processed: int, tagged: int, failed: int, last_error: Optional[str],
+                         metrics: Optional[RunMetrics] = None) -> None:
     from shared.blob_utils import write_daemon_status
-    write_daemon_status(tenant_id, processed=processed, tagged=tagged, failed=failed, last_error=last_error)
-
-def _extract_and_tag(client, content_bytes: bytes, filename: str) -> List[str]:
-    from shared.tagging_utils import extract_text, get_tags, parse_tags
-    class _Dummy:
-        def __init__(self, name: str, data: bytes) -> None:
-            self.filename = name
-            self.file = io.BytesIO(data)
-    text = extract_text(_Dummy(filename, content_bytes))
-    raw = get_tags(text[:3000])
+    snapshot = metrics.emit("daemon.tenant.metrics", tenant=tenant_id) if metrics is not None else None
+    write_daemon_status(tenant_id, processed=processed, tagged=tagged, failed=failed, last_error=last_error,
+                        metrics=snapshot)
+
+def _extract(content: Union[bytes, SpooledDownload], filename: str, mime_type: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Extracts only as much text as tagging uses (TAG_TEXT_CHARS, at most
+    EXTRACT_MAX_PAGES pages of a PDF, default 50). Parsing runs in the shared
+    extraction process pool unless EXTRACT_PROCESSES=0; a download that spilled
+    to disk is handed to the pool by path rather than as bytes.
+    Returns (text, extractor engine used).
+    """
+    from shared.extractors import extract_document
+    from shared.extract_pool import get_extraction_pool
+    max_pages = env_int("EXTRACT_MAX_PAGES", 50, minimum=1)
+    pool = get_extraction_pool()
+    if isinstance(content, SpooledDownload):
+        if pool is not None:
+            source = content.path if content.path is not None else content.data
+            return pool.extract(source, filename, max_chars=TAG_TEXT_CHARS, max_pages=max_pages, mime_type=mime_type)
+        with content.open() as fh:
+            return extract_document(fh, filename, max_chars=TAG_TEXT_CHARS, max_pages=max_pages, mime_type=mime_type)
+    if pool is not None:
+        return pool.extract(content, filename, max_chars=TAG_TEXT_CHARS, max_pages=max_pages, mime_type=mime_type)
+    return extract_document(io.BytesIO(content), filename, max_chars=TAG_TEXT_CHARS, max_pages=max_pages, mime_type=mime_type)
+
+def _cached_tags(text: str, tenant_id: Optional[str] = None) -> Optional[List[str]]:
+    from shared.tag_cache import cache_key, get_tag_cache
+    cache = get_tag_cache(tenant_id or "global")
+    return cache.get(cache_key(text[:TAG_TEXT_CHARS])) if cache is not None else None
+
+def _remember_tags(text: str, tags: List[str], tenant_id: Optional[str] = None) -> None:
+    from shared.tag_cache import cache_key, get_tag_cache
+    cache = get_tag_cache(tenant_id or "global")
+    if cache is not None and tags:
+        cache.put(cache_key(text[:TAG_TEXT_CHARS]), tags)
+
+def _tag_text(client, text: str, tenant_id: Optional[str] = None) -> List[str]:
+    """
+    Tags the first TAG_TEXT_CHARS chars of text, consulting the content-hash tag cache first.
+    """
+    from shared.tagging_utils import get_tags, parse_tags
+    from shared.near_dup import get_near_dup_index
+    text = text[:TAG_TEXT_CHARS]
+    cached = _cached_tags(text, tenant_id)
+    if cached is not None:
+        incr("tag_cache_hits")
+        return cached
+    index = get_near_dup_index(tenant_id)
+    sig = index.signature(text) if index is not None else None
+    match = index.find(sig) if index is not None else None
+    if match is not None:
+        logging.info("[tenant=%s] Reusing tags of a near-duplicate (similarity %.2f)", tenant_id, match.similarity)
+        incr("near_dup_hits")
+        _remember_tags(text, match.tags, tenant_id)
+        return match.tags
+    with timed("openai"):
+        raw = get_tags(text, client=client, tenant_id=tenant_id)
     tags = parse_tags(raw)
+    _remember_tags(text, tags, tenant_id)
+    if index is not None:
+        index.add(index.doc_key(text), sig, tags)
     return tags
 
-def _process_target(tenant_id: str, target: Target, client) -> Tuple[int, int]:
+def _has_reusable_tags(text: str, tenant_id: Optional[str]) -> bool:
+    """
+    True when _tag_text would answer from the tag cache or a near-duplicate.
+    """
+    from shared.near_dup import get_near_dup_index
+    text = text[:TAG_TEXT_CHARS]
+    if _cached_tags(text, tenant_id) is not None:
+        return True
+    index = get_near_dup_index(tenant_id)
+    return index is not None and index.find(index.signature(text)) is not None
+
+def _budget_fallback() -> str:
+    """
+    DAEMON_BUDGET_FALLBACK: what to do when the OpenAI budget runs out mid-run.
+    'stop' (default) leaves the remaining files for the next tick; 'fast' tags them
+    with the local keyword extractor instead (logged as method "daemon-fast").
+    """
+    mode = env_str("DAEMON_BUDGET_FALLBACK", "stop").lower()
+    return mode if mode in ("stop", "fast") else "stop"
+
+def _fast_tags(text: str, tenant_id: Optional[str] = None) -> List[str]:
+    from shared.tagging_utils import get_tags, parse_tags
+    return parse_tags(get_tags(text[:TAG_TEXT_CHARS], mode="Fast", tenant_id=tenant_id))
+
+def _observe_keywords(text: str, tenant_id: Optional[str]) -> None:
+    # Feeds the tenant's document-frequency table used by Fast mode.
+    from shared.keyword_tagger import get_keyword_stats
+    stats = get_keyword_stats(tenant_id)
+    if stats is not None and text:
+        stats.observe(text)
+
+def _extract_and_tag(client, content_bytes: bytes, filename: str, tenant_id: Optional[str] = None) -> List[str]:
+    text, _ = _extract(content_bytes, filename)
+    return _tag_text(client, text, tenant_id)
+
+def _pipeline_settings() -> Tuple[int, Dict[str, int]]:
+    """
+    DAEMON_FILE_CONCURRENCY: files in flight per tenant (default 4).
+    DAEMON_{GRAPH,DOWNLOAD,EXTRACT,OPENAI}_CONCURRENCY: optional per-stage caps
+    below that; 0 or unset means only the in-flight limit applies. Extraction
+    defaults to the extraction pool size so jobs don't queue inside the pool
+    while holding downloaded bytes.
+    """
+    from shared.extract_pool import extraction_workers
+    in_flight = env_int("DAEMON_FILE_CONCURRENCY", 4, minimum=1)
+    limits = {
+        "graph": env_int("DAEMON_GRAPH_CONCURRENCY", 0, minimum=0),
+        "download": env_int("DAEMON_DOWNLOAD_CONCURRENCY", 0, minimum=0),
+        "extract": env_int("DAEMON_EXTRACT_CONCURRENCY", extraction_workers(), minimum=0),
+        "openai": env_int("DAEMON_OPENAI_CONCURRENCY", 0, minimum=0),
+    }
+    return in_flight, limits
+
+def _process_file(tenant_id: str, target: Target, f: Dict[str, Any], token: TokenSource, client, stages: StageLimits,
+                  batcher: Optional[GraphBatcher] = None, fields_future: Optional[Future] = None,
+                  collector: Optional[BatchCollector] = None) -> Tuple[int, int]:
+    """
+    Runs one file through fields -> download -> extract -> OpenAI -> patch -> log.
+    Returns the (processed, failed) increments for this file. fields_future is a
+    listItem/fields lookup the caller already queued on the batcher. With a
+    collector (batch mode), cache misses are queued for the OpenAI Batch API
+    instead of being tagged now.
+    """
+    name = f.get("name", "")
+    fid = f.get("id")
+
+    try:
+        with timed("fields"):
+            if fields_future is not None:
+                fields = fields_future.result() or {}
+            else:
+                with stages.stage("graph"):
+                    fields = _get_file_fields(target.site_id, target.drive_id, fid, token, batcher)
+    except Exception as e:
+        logging.warning("[tenant=%s] Get fields failed for %s: %s", tenant_id, name, e)
+        return 0, 1
+
+    if _already_tagged(fields):
+        logging.info("[tenant=%s] SKIP already tagged: %s", tenant_id, name)
+        incr("files_skipped")
+        return 0, 0
+
+    limits = _download_limits()
+    try:
+        # The listing's size lets oversized files be passed over without a request.
+        if limits.max_bytes is not None and int(f.get("size") or 0) > limits.max_bytes:
+            raise DownloadTooLarge(f"file is {f.get('size')} bytes, limit {limits.max_bytes}", size=int(f.get("size") or 0))
+        with stages.stage("download"), timed("download"):
+            download = _download_file(target.site_id, target.drive_id, fid, token, limits)
+    except DownloadTooLarge as e:
+        logging.warning("[tenant=%s] %s too large to tag (%s); policy=%s", tenant_id, name, e, limits.oversize_policy)
+        incr("files_oversize")
+        if limits.oversize_policy == "fail":
+            _update_status(tenant_id, target.label, {"last_error": f"{name}: {e}"})
+            return 0, 1
+        return 0, 0
+    except Exception as e:
+        logging.warning("[tenant=%s] Download failed for %s: %s", tenant_id, name, e)
+        return 0, 1
+
+    processed = 0
+    try:
+        with download, stages.stage("extract"), timed("extract"):
+            text, engine = _extract(download, name, (f.get("file") or {}).get("mimeType"))
+        incr("chars_extracted", len(text))
+        logging.debug("[tenant=%s] Extracted %d chars from %s with %s", tenant_id, len(text), name, engine)
+        if collector is not None and not _has_reusable_tags(text, tenant_id):
+            _queue_for_batch(collector, target, f, text, tenant_id)
+            logging.info("[tenant=%s] QUEUED for OpenAI batch: %s", tenant_id, name)
+            incr("files_batched")
+            return 0, 0
+        _observe_keywords(text, tenant_id)
+        method = "daemon"
+        with stages.stage("openai"):
+            try:
+                tags = _tag_text(client, text, tenant_id)
+            except BudgetExhausted:
+                if _budget_fallback() != "fast":
+                    raise
+                tags = _fast_tags(text, tenant_id)
+                method = "daemon-fast"
+                incr("fast_fallbacks")
+        tags_csv = ", ".join(tags)
+        with stages.stage("graph"), timed("patch"):
+            _patch_metadata(target.site_id, target.drive_id, fid, tags_csv, token, batcher)
+        processed = 1
+        _append_log(tenant_id, {
+            "ts": _utc_now_iso(),
+            "filename": name,
+            "folder": target.folder,
+            "tags": tags,
+            "user": "daemon@doctagger",
+            "status": "success",
+            "method": method,
+            "engine": engine,
+        })
+        logging.info("[tenant=%s] OK tagged %s -> %s (extractor=%s)", tenant_id, name, tags, engine)
+        return processed, 0
+    except BudgetExhausted:
+        raise  # the target stops for this tick; see _process_target
+    except Exception as e:
+        logging.exception("[tenant=%s] Tagging/patch failed for %s: %s", tenant_id, name, e)
+        _update_status(tenant_id, target.label, {"last_error": str(e)})
+        return processed, 1
+
+def _process_target(tenant_id: str, target: Target, client, collector: Optional[BatchCollector] = None,
+                    scheduler: Optional[FairScheduler] = None,
+                    batch_state: Optional[Dict[str, Any]] = None,
+                    lock_lost: Optional[threading.Event] = None) -> Tuple[int, int]:
     """
     Returns (processed_ok, failed_count) for this target.
+    Files are worked on concurrently; see _pipeline_settings for the limits. With a
+    scheduler they run on the tenant's lane of the shared worker pool, otherwise on
+    a pipeline of the target's own. In batch mode the files this target queued are
+    submitted (and recorded in batch_state) before its delta link moves on.
+    Once lock_lost is set (the tenant's run lock lease expired) no more files are
+    started and the delta link stays where it is.
     """
     token = _get_graph_token_for_tenant(tenant_id)
     logging.info("[tenant=%s] Auth OK for target '%s'", tenant_id, target.label)
 
-    files = _list_files(target.site_id, target.drive_id, target.folder, token)
-    logging.info("[tenant=%s] Found %d files in '%s'", tenant_id, len(files), target.folder)
+    metrics = current_metrics()
+    files, cursor = _enumerate_target(tenant_id, target, token)
 
-    processed = 0
-    failed = 0
+    totals = [0, 0]  # processed, failed
+    totals_lock = threading.Lock()
+    seen = 0
+    skipped_inline = 0
 
-    for f in files:
-        if not f.get("file"):
-            continue
+    budget_spent = threading.Event()
+    lock_lost = lock_lost or threading.Event()
 
-        name = f.get("name", "")
-        fid = f.get("id")
-        if not fid:
-            continue
+    def _tally(file_id: str, fut) -> None:
+        try:
+            ok, bad = fut.result()
+        except BudgetExhausted as e:
+            if not budget_spent.is_set():
+                logging.warning("[tenant=%s] %s; stopping '%s' until the next run", tenant_id, e, target.label)
+            budget_spent.set()
+            ok, bad = 0, 1  # the target stops early, so its delta link stays where it is
+        except Exception as e:  # _process_file handles its own errors; this is a safety net
+            logging.exception("[tenant=%s] Unexpected worker error in '%s': %s", tenant_id, target.label, e)
+            ok, bad = 0, 1
+        with totals_lock:
+            totals[0] += ok
+            totals[1] += bad
+            if bad:
+                cursor.failed_ids.add(file_id)
+        if metrics is not None:
+            metrics.add("files_tagged", ok)
+            metrics.add("files_failed", bad)
+
+    def _candidates() -> Iterator[Dict[str, Any]]:
+        nonlocal seen, skipped_inline
+        for f in files:
+            if budget_spent.is_set():
+                return
+            if lock_lost.is_set():
+                logging.error("[tenant=%s] Run lock lost; stopping '%s' until the next run", tenant_id, target.label)
+                return
+            seen += 1
+            if not (f.get("file") and f.get("id")):
+                continue
+            inline = _inline_fields(f)
+            if inline is not None and _already_tagged(inline):
+                skipped_inline += 1
+                logging.debug("[tenant=%s] SKIP already tagged: %s", tenant_id, f.get("name", ""))
+                continue
+            if collector is not None and collector.is_pending(custom_id_for(target.site_id, target.drive_id, f["id"])):
+                logging.debug("[tenant=%s] SKIP awaiting OpenAI batch: %s", tenant_id, f.get("name", ""))
+                continue
+            yield f
+
+    if _dispatch_mode() == "queue":
+        enqueued, failed = _enqueue_files(tenant_id, target, _candidates(), cursor.failed_ids)
+        logging.info("[tenant=%s] Enumerated %d items in '%s', enqueued %d jobs", tenant_id, seen, target.folder, enqueued)
+        _update_status(tenant_id, target.label, {"files_enqueued": enqueued})
+        if cursor.complete and cursor.link and len(cursor.failed_ids) <= _max_retry_ids() and not lock_lost.is_set():
+            _save_delta_link(tenant_id, target, cursor.link, cursor.failed_ids)
+        return 0, failed
+
+    in_flight, limits = _pipeline_settings()
+    batcher = _make_batcher(token)
+    if scheduler is not None:
+        pipeline = scheduler.lane(tenant_id, in_flight)
+    else:
+        pipeline = FilePipeline(in_flight, limits, name=f"daemon-{target.label}"[:40])
+    with (batcher or contextlib.nullcontext()), pipeline as pipe:
+        # Queue field lookups a batch at a time so they fill whole $batch calls
+        # even when fewer files than that are in flight.
+        chunk_size = batcher.max_batch if batcher is not None else 1
+        candidates = _candidates()
+        while True:
+            chunk = list(itertools.islice(candidates, chunk_size))
+            if not chunk:
+                break
+            futs: List[Optional[Future]] = []
+            for f in chunk:
+                inline = _inline_fields(f)
+                if inline is not None:
+                    futs.append(_resolved(inline))
+                elif batcher is not None:
+                    futs.append(batcher.submit("GET", _fields_url(target.site_id, target.drive_id, f["id"])))
+                else:
+                    futs.append(None)
+            for f, fut in zip(chunk, futs):
+                pipe.submit(call_bound, metrics, _process_file, tenant_id, target, f, token, client, pipe.stages,
+                            batcher, fut, collector).add_done_callback(functools.partial(_tally, f["id"]))
+
+    processed, failed = totals
+    logging.info("[tenant=%s] Enumerated %d items in '%s' (%d already tagged per listing)", tenant_id, seen, target.folder, skipped_inline)
+
+    # Another run owns the tenant once the lock is lost, batch state included.
+    unsubmitted = 0
+    if collector is not None and batch_state is not None and len(collector) and not lock_lost.is_set():
+        with timed("openai_batch"):
+            _, unsubmitted = _submit_openai_batches(tenant_id, client, collector, batch_state)
+        if unsubmitted:
+            _update_status(tenant_id, target.label, {"last_error": f"OpenAI batch submission failed for {unsubmitted} files"})
+            failed += unsubmitted
+
+    # Failed files are saved with the new delta link and retried by id next run,
+    # so one file that keeps failing doesn't hold the whole target back. Unsubmitted
+    # batch lines (not tracked by id) and too many failures keep the old link.
+    if lock_lost.is_set():
+        _update_status(tenant_id, target.label, {"last_error": "run lock lost; remaining files left for the next run"})
+    elif cursor.complete and cursor.link and not unsubmitted:
+        if len(cursor.failed_ids) > _max_retry_ids():
+            logging.warning("[tenant=%s] %d files failed in '%s'; keeping its delta link", tenant_id, len(cursor.failed_ids), target.label)
+        else:
+            with timed("blob"):
+                _save_delta_link(tenant_id, target, cursor.link, cursor.failed_ids)
+
+    return processed, failed
+
+# ---------- queue fan-out mode ----------
+
+def _dispatch_mode() -> str:
+    """
+    DAEMON_DISPATCH_MODE: 'inline' (default) tags files inside the timer run;
+    'queue' makes the timer only enumerate and enqueue one job per file on the
+    storage queue (shared.job_queue) for tag_file_job instances to process, so
+    throughput scales out with the Function App. Queue jobs are tagged synchronously.
+    """
+    mode = env_str("DAEMON_DISPATCH_MODE", "inline").lower()
+    return mode if mode in ("inline", "queue") else "inline"
+
+# Listing fields a queued job carries; the worker re-reads the tag column itself.
+_JOB_ITEM_FIELDS = ("id", "name", "size", "cTag", "eTag", "file")
+
+def _file_job(tenant_id: str, target: Target, f: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "v": 1,
+        "tenant": tenant_id,
+        "target": {"label": target.label, "siteId": target.site_id, "driveId": target.drive_id, "folder": target.folder},
+        "item": {k: f[k] for k in _JOB_ITEM_FIELDS if k in f},
+        "enqueued": _utc_now_iso(),
+    }
 
+def _enqueue_files(tenant_id: str, target: Target, files: Iterable[Dict[str, Any]],
+                   failed_ids: Optional[Set[str]] = None) -> Tuple[int, int]:
+    """
+    Sends a job per file, skipping (item id, cTag) pairs enqueued within the last
+    DAEMON_JOB_DEDUP_TTL_HOURS (default 24). Returns (enqueued, failed); the ids
+    of files that couldn't be enqueued are added to failed_ids.
+    """
+    from shared.job_queue import JobDedup, get_job_queue, job_key
+    jq = get_job_queue()
+    dedup = JobDedup(tenant_id, ttl=env_int("DAEMON_JOB_DEDUP_TTL_HOURS", 24, minimum=1) * 3600.0)
+    enqueued = failed = duplicates = 0
+    while True:
+        chunk = list(itertools.islice(files, 32))
+        if not chunk:
+            break
+        fresh = [f for f in chunk if not dedup.seen(job_key(target.drive_id, f["id"]), f.get("cTag"))]
+        duplicates += len(chunk) - len(fresh)
+        if not fresh:
+            continue
         try:
-            fields = _get_file_fields(target.site_id, target.drive_id, fid, token)
+            jq.send(_file_job(tenant_id, target, f) for f in fresh)
         except Exception as e:
-            logging.warning("[tenant=%s] Get fields failed for %s: %s", tenant_id, name, e)
-            failed += 1
+            logging.warning("[tenant=%s] Enqueue failed for %d files in '%s': %s", tenant_id, len(fresh), target.label, e)
+            failed += len(fresh)
+            if failed_ids is not None:
+                failed_ids.update(f["id"] for f in fresh)
             continue
+        for f in fresh:
+            dedup.add(job_key(target.drive_id, f["id"]), f.get("cTag"))
+        enqueued += len(fresh)
+    try:
+        dedup.save()
+    except Exception as e:
+        logging.warning("[tenant=%s] Saving job dedup state failed: %s", tenant_id, e)
+    if duplicates:
+        logging.info("[tenant=%s] %d files in '%s' already have a pending job", tenant_id, duplicates, target.label)
+    return enqueued, failed
 
-        if _already_tagged(fields):
-            logging.info("[tenant=%s] SKIP already tagged: %s", tenant_id, name)
-            continue
+# Shared by every job this process runs (queue batches, drain workers), so the
+# DAEMON_*_CONCURRENCY caps hold across jobs as they do within a pipeline.
+_job_client = None
+_job_stages: Optional[StageLimits] = None
+_job_client_lock = threading.Lock()
 
+def handle_file_job(job: Dict[str, Any], dequeue_count: int = 1) -> None:
+    """
+    Processes one queued file job (the queue trigger's entry point). Raises when the
+    file failed so the message becomes visible again after the visibility timeout;
+    the runtime moves it to the poison queue after maxDequeueCount attempts.
+    Delivery is at-least-once: a duplicate finds the tag column set and is skipped.
+    A job that runs out of OpenAI budget is sent again with a delay instead, so
+    it does not use up attempts. The tenant's buffered status and log entries are
+    written before returning.
+    """
+    global _job_client, _job_stages
+    tenant_id = job["tenant"]
+    t = job["target"]
+    target = Target(label=t["label"], site_id=t["siteId"], drive_id=t["driveId"], folder=t.get("folder", ""))
+    item = job["item"]
+    with _job_client_lock:
+        if _job_client is None:
+            _job_client = _make_openai_client()
+        if _job_stages is None:
+            _job_stages = StageLimits(_pipeline_settings()[1])
+    try:
+        token = _get_graph_token_for_tenant(tenant_id)
+        metrics = RunMetrics(tenant_id).child(target.label)
+        with bind(metrics):
+            try:
+                processed, failed = _process_file(tenant_id, target, item, token, _job_client, _job_stages)
+            except BudgetExhausted as e:
+                _requeue_job(job, e)
+                return
+        metrics.add("files_tagged", processed)
+        metrics.add("files_failed", failed)
+        metrics.emit("daemon.job.metrics", tenant=tenant_id, target=target.label, attempt=dequeue_count)
+        if failed:
+            raise RuntimeError(f"tagging job failed for {item.get('name')} (attempt {dequeue_count})")
+        if processed:
+            _update_status(tenant_id, target.label, {"last_success": _utc_now_iso()})
+    finally:
         try:
-            blob = _download_file(target.site_id, target.drive_id, fid, token)
+            _status_buffer().flush(tenant_id)
         except Exception as e:
-            logging.warning("[tenant=%s] Download failed for %s: %s", tenant_id, name, e)
-            failed += 1
-            continue
+            logging.warning("[tenant=%s] Writing job status failed: %s", tenant_id, e)
+
+def _requeue_job(job: Dict[str, Any], e: BudgetExhausted) -> None:
+    # A new message starts with a dequeue count of 1. If the send fails the
+    # error propagates and the message is retried like any other failure.
+    from shared.job_queue import get_job_queue
+    delay = max(e.retry_after, env_float("DAEMON_JOB_BUDGET_DELAY_SECONDS", 60.0, minimum=1.0))
+    get_job_queue().send([job], delay=delay)
+    logging.warning("[tenant=%s] %s; %s requeued for %.0fs", job["tenant"], e, (job.get("item") or {}).get("name"), delay)
+    incr("jobs_requeued")
+
+def handle_poison_job(job: Dict[str, Any]) -> None:
+    """
+    Records a job that exhausted its retries on the target's status and drops the
+    target's delta link: the file was passed in the change feed when it was
+    enqueued, so only a full listing brings it back.
+    """
+    item = job.get("item") or {}
+    target = job.get("target") or {}
+    label = target.get("label", "")
+    logging.error("[tenant=%s] Giving up on %s in '%s' after repeated failures", job.get("tenant"), item.get("name"), label)
+    if job.get("tenant") and label:
+        _update_status(job["tenant"], label, {"last_error": f"{item.get('name')}: gave up after repeated failures"})
+        _rewind_targets(job["tenant"], [target], "failed queue jobs")
+        _status_buffer().flush(job["tenant"])
+
+def _drain_memory_queue() -> None:
+    # Local stand-in for the queue trigger (DAEMON_JOB_QUEUE_BACKEND=memory).
+    from shared.job_queue import InMemoryJobQueue, get_job_queue
+    jq = get_job_queue()
+    if isinstance(jq, InMemoryJobQueue) and len(jq):
+        done = jq.drain(handle_file_job, workers=env_int("DAEMON_WORKERS", 8, minimum=1))
+        for job in jq.poison:
+            handle_poison_job(job)
+        jq.poison.clear()
+        logging.info("Drained %d in-memory jobs", done)
 
+# ---------- OpenAI Batch API mode ----------
+
+def _tagging_mode() -> str:
+    """
+    DAEMON_TAGGING_MODE: 'sync' (default) tags each file with a chat completion as it
+    goes; 'batch' queues cache misses into OpenAI Batch API jobs that are submitted at
+    the end of each target's run and applied on a later tick. The Batch API is priced
+    lower but may take up to 24h. OPENAI_BASE_URL points the client at a fake server
+    such as benchmarks/fakes.py.
+    """
+    mode = (os.getenv("DAEMON_TAGGING_MODE", "sync") or "sync").strip().lower()
+    return mode if mode in ("sync", "batch") else "sync"
+
+def _queue_for_batch(collector: BatchCollector, target: Target, f: Dict[str, Any], text: str,
+                     tenant_id: Optional[str] = None) -> None:
+    from shared.tagging_utils import build_tag_request
+    from shared.tag_cache import cache_key
+    from shared.near_dup import get_near_dup_index
+    text = text[:TAG_TEXT_CHARS]
+    meta = {
+        "label": target.label,
+        "siteId": target.site_id,
+        "driveId": target.drive_id,
+        "folder": target.folder,
+        "itemId": f["id"],
+        "name": f.get("name", ""),
+        "cacheKey": cache_key(text),
+    }
+    # Keep the MinHash so the batch result can be added to the near-dup index.
+    index = get_near_dup_index(tenant_id)
+    sig = index.signature(text) if index is not None else None
+    if sig is not None:
+        meta["docKey"] = index.doc_key(text)
+        meta["minhash"] = index.encode_signature(sig)
+    collector.add(custom_id_for(target.site_id, target.drive_id, f["id"]), build_tag_request(text), meta)
+
+def _apply_openai_batches(tenant_id: str, client, state: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Polls the tenant's submitted batches. Finished ones are applied: tags are parsed
+    with parse_tags and written with _patch_metadata. Lines that errored, or batches
+    that failed or expired, are resubmitted from the original input file up to
+    DAEMON_BATCH_MAX_ATTEMPTS times. Returns (tagged, failed); 'state' is updated
+    and saved in place.
+    """
+    from shared.tagging_utils import parse_tags
+    from shared.tag_cache import get_tag_cache
+    from shared.near_dup import get_near_dup_index
+    if not state["batches"]:
+        return 0, 0
+    max_attempts = env_int("DAEMON_BATCH_MAX_ATTEMPTS", 3, minimum=1)
+    token = _get_graph_token_for_tenant(tenant_id)
+    tagged = failed = 0
+    lost: List[Dict[str, Any]] = []  # items given up on; see _rewind_targets
+
+    for batch_id, entry in list(state["batches"].items()):
         try:
-            tags = _extract_and_tag(client, blob, name)
-            tags_csv = ", ".join(tags)
-            _patch_metadata(target.site_id, target.drive_id, fid, tags_csv, token)
-            processed += 1
+            status, contents, errors, _ = fetch_batch_results(client, batch_id)
+        except Exception as e:
+            logging.warning("[tenant=%s] Polling OpenAI batch %s failed: %s", tenant_id, batch_id, e)
+            continue
+        if status not in TERMINAL_STATES:
+            logging.info("[tenant=%s] OpenAI batch %s is %s", tenant_id, batch_id, status)
+            continue
+
+        items: Dict[str, Dict[str, Any]] = entry.get("items") or {}
+        retry_ids: List[str] = []
+        for cid, meta in items.items():
+            if cid not in contents:
+                retry_ids.append(cid)
+                continue
+            tags = parse_tags(contents[cid])
+            try:
+                _patch_metadata(meta["siteId"], meta["driveId"], meta["itemId"], ", ".join(tags), token)
+            except Exception as e:
+                logging.warning("[tenant=%s] Patch from OpenAI batch failed for %s: %s", tenant_id, meta.get("name"), e)
+                failed += 1
+                lost.append(meta)
+                continue
+            tagged += 1
+            cache = get_tag_cache(tenant_id)
+            if cache is not None and tags and meta.get("cacheKey"):
+                cache.put(meta["cacheKey"], tags)
+            index = get_near_dup_index(tenant_id)
+            if index is not None and meta.get("minhash"):
+                index.add(meta.get("docKey") or meta["minhash"], index.decode_signature(meta["minhash"]), tags)
             _append_log(tenant_id, {
                 "ts": _utc_now_iso(),
-                "filename": name,
-                "folder": target.folder,
+                "filename": meta.get("name", ""),
+                "folder": meta.get("folder", ""),
                 "tags": tags,
                 "user": "daemon@doctagger",
                 "status": "success",
-                "method": "daemon",
+                "method": "daemon-batch",
             })
-            logging.info("[tenant=%s] OK tagged %s -> %s", tenant_id, name, tags)
+            logging.info("[tenant=%s] OK tagged (batch) %s -> %s", tenant_id, meta.get("name"), tags)
+
+        del state["batches"][batch_id]
+        attempt = int(entry.get("attempt", 1))
+        if retry_ids and attempt < max_attempts and entry.get("inputFileId"):
+            try:
+                lines = read_input_lines(client, entry["inputFileId"], retry_ids)
+                new_id, input_id = submit_batch(client, lines, metadata={"tenant": tenant_id})
+                state["batches"][new_id] = {
+                    "submitted": _utc_now_iso(),
+                    "inputFileId": input_id,
+                    "attempt": attempt + 1,
+                    "items": {cid: items[cid] for cid in retry_ids},
+                }
+                logging.info("[tenant=%s] Resubmitted %d lines of batch %s as %s", tenant_id, len(lines), batch_id, new_id)
+            except Exception as e:
+                logging.warning("[tenant=%s] Resubmitting batch %s failed: %s", tenant_id, batch_id, e)
+                failed += len(retry_ids)
+                lost.extend(items[cid] for cid in retry_ids)
+        elif retry_ids:
+            logging.warning("[tenant=%s] Giving up on %d lines of batch %s (%s): %s", tenant_id, len(retry_ids),
+                            batch_id, status, next(iter(errors.values()), "no output"))
+            failed += len(retry_ids)
+            lost.extend(items[cid] for cid in retry_ids)
+        save_batch_state(tenant_id, state)
+
+    if lost:
+        _rewind_targets(tenant_id, lost)
+    return tagged, failed
+
+def _rewind_targets(tenant_id: str, metas: Iterable[Dict[str, Any]], source: str = "OpenAI batches") -> None:
+    """
+    Drops the saved delta links of the targets these batch items (or queue jobs)
+    came from. Their files were passed in the change feed when they were queued,
+    so only a full listing brings back the ones left untagged; it skips files
+    already tagged.
+    """
+    seen = set()
+    for meta in metas:
+        key = (meta.get("label"), meta.get("siteId"), meta.get("driveId"), meta.get("folder", ""))
+        if not key[0] or key in seen:
+            continue
+        seen.add(key)
+        logging.warning("[tenant=%s] Untagged files from %s in '%s'; next run of it is a full listing", tenant_id, source, key[0])
+        try:
+            _save_delta_link(tenant_id, Target(label=key[0], site_id=key[1], drive_id=key[2], folder=key[3]), None)
         except Exception as e:
-            logging.exception("[tenant=%s] Tagging/patch failed for %s: %s", tenant_id, name, e)
-            failed += 1
-            _update_status(tenant_id, target.label, {"last_error": str(e)})
+            logging.warning("[tenant=%s] Resetting delta link of '%s' failed: %s", tenant_id, key[0], e)
 
-    return processed, failed
+def _submit_openai_batches(tenant_id: str, client, collector: BatchCollector, state: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Submits everything the collector gathered, DAEMON_BATCH_MAX_LINES lines per batch.
+    Returns (submitted, unsubmitted) line counts. The first failure drops the lines
+    still queued; the caller keeps its delta link so those files come back.
+    """
+    max_lines = env_int("DAEMON_BATCH_MAX_LINES", 5000, minimum=1)
+    submitted = 0
+    while len(collector):
+        lines, items = collector.drain(max_lines)
+        try:
+            batch_id, input_id = submit_batch(client, lines, metadata={"tenant": tenant_id})
+            state["batches"][batch_id] = {
+                "submitted": _utc_now_iso(),
+                "inputFileId": input_id,
+                "attempt": 1,
+                "items": items,
+            }
+            save_batch_state(tenant_id, state)
+        except Exception as e:
+            unsubmitted = len(lines) + len(collector.drain(len(collector))[0])
+            logging.exception("[tenant=%s] Submitting OpenAI batch failed; %d files left for the next run: %s",
+                              tenant_id, unsubmitted, e)
+            return submitted, unsubmitted
+        submitted += len(lines)
+        logging.info("[tenant=%s] Submitted OpenAI batch %s with %d files", tenant_id, batch_id, len(lines))
+    return submitted, 0
 
-def run_daemon() -> None:
+def _lock_settings() -> Tuple[bool, str, int]:
     """
-    Main entrypoint called by the timer trigger. Safe to import.
+    DAEMON_RUN_LOCK=0 disables the per-tenant run lock. DAEMON_LOCK_POLICY: 'skip'
+    (default) leaves a tenant another run is working on; 'wait' waits up to
+    DAEMON_LOCK_WAIT_SECONDS (default 300) for it first.
     """
-    logging.info("daemon run start")
-    tenants = _get_tenant_ids()
-    if not tenants:
-        logging.warning("No tenants configured (DAEMON_TENANTS / tenants.json).")
+    policy = env_str("DAEMON_LOCK_POLICY", "skip").lower()
+    return (
+        env_bool("DAEMON_RUN_LOCK", True),
+        policy if policy in ("skip", "wait") else "skip",
+        env_int("DAEMON_LOCK_WAIT_SECONDS", 300, minimum=0),
+    )
+
+def _run_tenant(tid: str, client, batch_mode: bool, scheduler: Optional[FairScheduler] = None) -> None:
+    """
+    Runs a tenant under its blob-lease run lock, so overlapping ticks (or a manual
+    /run-daemon) don't process the same files twice. Stage timings and counters of
+    the run are collected on a RunMetrics bound to this thread.
+    """
+    from shared.blob_utils import update_daemon_lock_status
+    from shared.run_lock import RunLock
+    enabled, policy, wait = _lock_settings()
+    metrics = RunMetrics(tid)
+    if not enabled:
+        call_bound(metrics, _run_tenant_locked, tid, client, batch_mode, scheduler)
         return
+    lock = RunLock(tid)
+    if not lock.acquire(wait=wait if policy == "wait" else 0):
+        other = lock.current_holder()
+        logging.warning("[tenant=%s] SKIP tenant: run lock held by %s since %s", tid, other.get("holder"), other.get("since"))
+        update_daemon_lock_status(tid, {
+            "holder": other.get("holder"),
+            "since": other.get("since"),
+            "skippedBy": lock.holder,
+            "skippedAt": _utc_now_iso(),
+        })
+        return
+    with lock, bind(metrics):
+        update_daemon_lock_status(tid, {"holder": lock.holder, "since": lock.since})
+        _run_tenant_locked(tid, client, batch_mode, scheduler, lock)
 
-    client = _make_openai_client()
+def _run_tenant_locked(tid: str, client, batch_mode: bool, scheduler: Optional[FairScheduler] = None,
+                       lock=None) -> None:
+    """
+    One tenant's share of a daemon run: pending OpenAI batches, every enabled
+    target, then the tenant-level status blob. Each target's metrics go into its
+    entry in daemon_targets_status.json, the tenant's into daemon_status.json.
+    """
+    metrics = current_metrics()
+    last_err: Optional[str] = None
+    processed_total = 0
+    failed_total = 0
+    collector: Optional[BatchCollector] = None
+    batch_state: Dict[str, Any] = {}
 
-    for tid in tenants:
-        last_err: Optional[str] = None
-        processed_total = 0
-        failed_total = 0
+    if env_bool("UPLOAD_LOG_MIGRATE", True):
+        # One-time move of the legacy upload_log.json array into the partitioned
+        # log; a no-op (one HEAD request) once it's gone.
+        try:
+            from shared.upload_log import migrate_legacy_upload_log
+            migrate_legacy_upload_log(tid)
+        except Exception as e:
+            logging.warning("[tenant=%s] Upload log migration failed: %s", tid, e)
 
+    if batch_mode:
         try:
-            targets = _load_targets_for_tenant(tid)
+            batch_state = load_batch_state(tid)
+            with timed("openai_batch"):
+                ok, failed = _apply_openai_batches(tid, client, batch_state)
+            incr("files_tagged", ok)
+            incr("files_failed", failed)
+            processed_total += ok
+            failed_total += failed
+            collector = BatchCollector(pending=pending_custom_ids(batch_state))
         except Exception as e:
-            logging.exception("[tenant=%s] Failed to load targets: %s", tid, e)
+            logging.exception("[tenant=%s] Applying OpenAI batches failed: %s", tid, e)
             last_err = str(e)
-            _write_tenant_status(tid, processed=0, tagged=0, failed=1, last_error=last_err)
-            continue
 
-        if not targets:
-            logging.info("[tenant=%s] No upload targets.", tid)
-            _write_tenant_status(tid, processed=0, tagged=0, failed=0, last_error=None)
+    try:
+        targets = _load_targets_for_tenant(tid)
+    except Exception as e:
+        logging.exception("[tenant=%s] Failed to load targets: %s", tid, e)
+        last_err = str(e)
+        _write_tenant_status(tid, processed=processed_total, tagged=processed_total, failed=failed_total + 1,
+                             last_error=last_err, metrics=metrics)
+        return
+
+    if not targets:
+        logging.info("[tenant=%s] No upload targets.", tid)
+        _write_tenant_status(tid, processed=processed_total, tagged=processed_total, failed=failed_total,
+                             last_error=last_err, metrics=metrics)
+        return
+
+    for t in targets:
+        if not t.enabled:
+            logging.info("[tenant=%s] SKIP disabled target '%s'", tid, t.label)
             continue
+        if lock is not None and lock.lost.is_set():
+            last_err = "run lock lost; remaining targets left for the next run"
+            logging.error("[tenant=%s] %s", tid, last_err)
+            break
 
-        for t in targets:
-            if not t.enabled:
-                logging.info("[tenant=%s] SKIP disabled target '%s'", tid, t.label)
-                continue
+        _update_status(tid, t.label, {
+            "last_run": _utc_now_iso(),
+            "files_processed": 0,
+            "last_error": None,
+        })
 
+        target_metrics = metrics.child(t.label) if metrics is not None else None
+        try:
+            with bind(target_metrics):
+                ok, failed = _process_target(tid, t, client, collector, scheduler, batch_state,
+                                             lock.lost if lock is not None else None)
+            processed_total += ok
+            failed_total += failed
             _update_status(tid, t.label, {
-                "last_run": _utc_now_iso(),
-                "files_processed": 0,
-                "last_error": None,
+                "last_success": _utc_now_iso(),
+                "files_processed": ok,
             })
+        except Exception as e:
+            logging.exception("[tenant=%s] Target '%s' failed: %s", tid, t.label, e)
+            last_err = str(e)
+            failed_total += 1
+            _update_status(tid, t.label, {"last_error": last_err})
+        if target_metrics is not None:
+            _update_status(tid, t.label, {
+                "metrics": target_metrics.emit("daemon.target.metrics", tenant=tid, target=t.label),
+            })
+        with timed("blob"):
+            _status_buffer().flush(tid)
 
-            try:
-                ok, failed = _process_target(tid, t, client)
-                processed_total += ok
-                failed_total += failed
-                _update_status(tid, t.label, {
-                    "last_success": _utc_now_iso(),
-                    "files_processed": ok,
-                })
-            except Exception as e:
-                logging.exception("[tenant=%s] Target '%s' failed: %s", tid, t.label, e)
-                last_err = str(e)
-                failed_total += 1
-                _update_status(tid, t.label, {"last_error": last_err})
+    # Write simple tenant-level status for dashboard
+    _write_tenant_status(tid, processed=processed_total, tagged=processed_total, failed=failed_total,
+                         last_error=last_err, metrics=metrics)
 
-        # Write simple tenant-level status for dashboard
-        _write_tenant_status(tid, processed=processed_total, tagged=processed_total, failed=failed_total, last_error=last_err)
+def run_daemon() -> None:
+    """
+    Main entrypoint called by the timer trigger. Safe to import.
+
+    Every tenant runs on a thread of its own and they share one pool of
+    DAEMON_WORKERS file workers (default 8), handed out round-robin across tenants
+    so a large backlog doesn't hold up other tenants' new files. Each tenant has at
+    most DAEMON_FILE_CONCURRENCY files in flight. Tenant threads mostly wait on
+    Graph and on their lane, so they are cheap; DAEMON_TENANT_CONCURRENCY can cap
+    them, but tenants beyond the cap then wait for a whole tenant run to finish and
+    lose that guarantee.
+    """
+    logging.info("daemon run start")
+    tenants = _get_tenant_ids()
+    if not tenants:
+        logging.warning("No tenants configured (DAEMON_TENANTS / tenants.json).")
+        return
+
+    client = _make_openai_client()
+
+    batch_mode = _tagging_mode() == "batch"
+
+    workers = env_int("DAEMON_WORKERS", 8, minimum=1)
+    tenant_threads = env_int("DAEMON_TENANT_CONCURRENCY", len(tenants), minimum=1)
+    _, limits = _pipeline_settings()
+    try:
+        with FairScheduler(workers, limits, name="daemon-file") as scheduler, \
+                ThreadPoolExecutor(max_workers=tenant_threads, thread_name_prefix="daemon-tenant") as tenant_pool:
+            futures = {tenant_pool.submit(_run_tenant, tid, client, batch_mode, scheduler): tid for tid in tenants}
+            for fut in as_completed(futures):
+                try:
+                    fut.result()
+                except Exception as e:
+                    logging.exception("[tenant=%s] Tenant run failed: %s", futures[fut], e)
+        if _dispatch_mode() == "queue":
+            _drain_memory_queue()
+    finally:
+        _close_status_buffer()
 
+    from shared.tag_cache import flush_tag_caches
+    from shared.keyword_tagger import flush_keyword_stats
+    from shared.near_dup import flush_near_dup_indexes
+    flush_tag_caches()
+    flush_keyword_stats()
+    flush_near_dup_indexes()
     logging.info("daemon run end")
@@ -1,4 +1,5 @@
 # function_app.py
+import json
 import logging
 import azure.functions as func
 
@@ -31,3 +32,21 @@ def daemon_tick(mytimer: func.TimerRequest):
         logging.info("daemon run completed")
     except Exception:
         logging.exception("daemon run failed")
+
+# --- QUEUE (per-file jobs; fed by daemon_tick when DAEMON_DISPATCH_MODE=queue) ---
+# Queue name must match shared.job_queue.JOB_QUEUE_NAME. Retries, visibility
+# timeout and maxDequeueCount are configured under extensions.queues in host.json.
+@app.queue_trigger(arg_name="msg", queue_name="doctagger-jobs", connection="AzureWebJobsStorage")
+def tag_file_job(msg: func.QueueMessage):
+    from daemon_worker import handle_file_job  # import INSIDE
+    job = json.loads(msg.get_body().decode("utf-8"))
+    # Let failures propagate: the message is retried and eventually poisoned.
+    handle_file_job(job, msg.dequeue_count or 1)
+
+@app.queue_trigger(arg_name="msg", queue_name="doctagger-jobs-poison", connection="AzureWebJobsStorage")
+def tag_file_job_poison(msg: func.QueueMessage):
+    try:
+        from daemon_worker import handle_poison_job
+        handle_poison_job(json.loads(msg.get_body().decode("utf-8")))
+    except Exception:
+        logging.exception("poison job handling failed")
@@ -2,9 +2,12 @@
 from __future__ import annotations
 import os
 import json
+import time
+import threading
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 from .secrets import get_secret
+from .settings import env_float
 
 def _conn_str() -> str:
     """
@@ -14,19 +17,76 @@ def _conn_str() -> str:
     """
     return get_secret("AzureStorage-ConnectionString", default=os.getenv("AZURE_STORAGE_CONNECTION_STRING")) or ""
 
+# Process-wide clients: the service client (and its connection pool) is built once
+# per connection string, container clients once per container, and a container is
+# only created the first time it's used. The connection string itself may come from
+# Key Vault, so it's re-resolved only every BLOB_CLIENT_REFRESH_SECONDS (default 3600,
+# read once at import) to pick up rotation.
+_REFRESH_SECONDS = env_float("BLOB_CLIENT_REFRESH_SECONDS", 3600.0, minimum=0.0)
+_clients_lock = threading.Lock()
+_service: Any = None
+_service_conn: Optional[str] = None
+_service_checked_at = 0.0
+_containers: Dict[str, Any] = {}
+_known_containers: Set[str] = set()
+
 def _service_client():
     """
-    Create a BlobServiceClient on demand. Import lazily.
+    Returns the shared BlobServiceClient, built on first use. Import lazily.
     """
-    from azure.storage.blob import BlobServiceClient
+    global _service, _service_conn, _service_checked_at
+    with _clients_lock:
+        if _service is not None and time.monotonic() - _service_checked_at < _REFRESH_SECONDS:
+            return _service
     conn = _conn_str()
     if not conn:
         raise RuntimeError("Azure Storage connection string not set (Key Vault 'AzureStorage-ConnectionString' or env 'AZURE_STORAGE_CONNECTION_STRING').")
-    return BlobServiceClient.from_connection_string(conn)
+    with _clients_lock:
+        if _service is None or conn != _service_conn:
+            from azure.storage.blob import BlobServiceClient
+            _service = BlobServiceClient.from_connection_string(conn)
+            _service_conn = conn
+            _containers.clear()
+            _known_containers.clear()
+        _service_checked_at = time.monotonic()
+        return _service
 
 def _container_name(tenant_id: str) -> str:
     return tenant_id.lower().replace("@", "_").replace(".", "_")
 
+def get_container_client(tenant_id: str):
+    """
+    Returns the container client for 'tenant_id'.
+    Creates the container if it doesn't exist (checked once per process).
+    """
+    if not tenant_id:
+        raise ValueError("Missing tenant_id")
+    from azure.core.exceptions import ResourceExistsError
+    service = _service_client()
+    name = _container_name(tenant_id)
+    with _clients_lock:
+        container = _containers.get(name)
+        if container is None:
+            container = _containers[name] = service.get_container_client(name)
+        if name in _known_containers:
+            return container
+    try:
+        container.create_container()
+    except ResourceExistsError:
+        pass
+    except Exception:
+        return container  # not remembered, so the next call tries again
+    with _clients_lock:
+        _known_containers.add(name)
+    return container
+
+def forget_container(tenant_id: str) -> None:
+    """
+    Drops the existence memo for a tenant's container (e.g. after it was deleted).
+    """
+    with _clients_lock:
+        _known_containers.discard(_container_name(tenant_id))
+
 def get_blob_client(tenant_id: str, blob_name: str):
     """
     Returns a blob client for 'tenant_id' and 'blob_name'.
@@ -34,13 +94,7 @@ def get_blob_client(tenant_id: str, blob_name: str):
     """
     if not tenant_id or not blob_name:
         raise ValueError(f"Missing tenant_id or blob_name → tenant_id={tenant_id}, blob_name={blob_name}")
-    service = _service_client()
-    container = service.get_container_client(_container_name(tenant_id))
-    try:
-        container.create_container()
-    except Exception:
-        pass
-    return container.get_blob_client(blob_name)
+    return get_container_client(tenant_id).get_blob_client(blob_name)
 
 def load_json_blob(tenant_id: str, blob_name: str):
     """
@@ -59,26 +113,71 @@ def write_json_blob(tenant_id: str, blob_name: str, data):
     blob = get_blob_client(tenant_id, blob_name)
     blob.upload_blob(json.dumps(data, indent=2, ensure_ascii=False), overwrite=True)
 
-def append_log_entry(tenant_id: str, entry: dict, blob_name: str = "upload_log.json"):
-    logs = load_json_blob(tenant_id, blob_name) or []
-    if not isinstance(logs, list):
-        logs = []
-    logs.append(entry)
-    write_json_blob(tenant_id, blob_name, logs)
+def load_json_blob_with_etag(tenant_id: str, blob_name: str) -> Tuple[Any, Optional[str]]:
+    """
+    Loads a JSON blob together with its ETag; returns (None, None) if it doesn't exist.
+    Pair with write_json_blob_if_match for optimistic read-modify-write.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    blob = get_blob_client(tenant_id, blob_name)
+    try:
+        downloader = blob.download_blob()
+    except ResourceNotFoundError:
+        return None, None
+    raw = downloader.readall()
+    txt = raw.decode("utf-8") if isinstance(raw, (bytes, bytearray)) else raw
+    try:
+        data = json.loads(txt) if txt else None
+    except ValueError:
+        data = None
+    return data, downloader.properties.etag
+
+def write_json_blob_if_match(tenant_id: str, blob_name: str, data, etag: Optional[str], *, compact: bool = False) -> bool:
+    """
+    Uploads only if the blob still has 'etag' (or, with etag=None, does not exist yet).
+    Returns False when another writer got there first; the caller should reload and merge.
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError
+    blob = get_blob_client(tenant_id, blob_name)
+    body = json.dumps(data, separators=(",", ":"), ensure_ascii=False) if compact else json.dumps(data, indent=2, ensure_ascii=False)
+    try:
+        if etag:
+            blob.upload_blob(body, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+        else:
+            blob.upload_blob(body, overwrite=False)
+        return True
+    except (ResourceModifiedError, ResourceExistsError):
+        return False
+    except HttpResponseError as e:
+        if getattr(e, "status_code", None) in (409, 412):
+            return False
+        raise
+
+def append_log_entry(tenant_id: str, entry: dict):
+    """
+    Appends one entry to the tenant's upload log (partitioned JSONL Append Blobs,
+    see shared.upload_log). The legacy upload_log.json array is no longer written.
+    """
+    from .upload_log import append_upload_log
+    append_upload_log(tenant_id, [entry])
 
 # ---------- NEW: simple, tenant-level status (for dashboard cards) ----------
 
 def _now_utc_iso_z() -> str:
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
-def write_daemon_status(tenant_id: str, *, processed: int, tagged: int, failed: int, last_error: Optional[str]):
+def write_daemon_status(tenant_id: str, *, processed: int, tagged: int, failed: int, last_error: Optional[str],
+                        lock: Optional[dict] = None, metrics: Optional[dict] = None):
     """
     Overwrites daemon_status.json at tenant root with the simple shape:
     {
       "lastRunUtc": "...",
       "heartbeatUtc": "...",
       "totals": { "processed": X, "tagged": Y, "failed": Z },
-      "lastError": "..." | null
+      "lastError": "..." | null,
+      "lock": { "holder": "...", "since": "...", ... } | null,
+      "metrics": { "stages": {...}, "counters": {...}, ... } | null
     }
     """
     status = {
@@ -86,9 +185,25 @@ def write_daemon_status(tenant_id: str, *, processed: int, tagged: int, failed:
         "heartbeatUtc": _now_utc_iso_z(),
         "totals": {"processed": int(processed), "tagged": int(tagged), "failed": int(failed)},
         "lastError": (last_error[:2000] if isinstance(last_error, str) else None),
+        "lock": lock,
+        "metrics": metrics,
     }
     write_json_blob(tenant_id, "daemon_status.json", status)
 
+def update_daemon_lock_status(tenant_id: str, lock: Optional[dict], attempts: int = 5) -> bool:
+    """
+    Sets only the "lock" entry of daemon_status.json (who runs the tenant, since
+    when), leaving the last run's totals in place.
+    """
+    for _ in range(attempts):
+        data, etag = load_json_blob_with_etag(tenant_id, "daemon_status.json")
+        data = data if isinstance(data, dict) else {}
+        data["lock"] = lock
+        data["heartbeatUtc"] = _now_utc_iso_z()
+        if write_json_blob_if_match(tenant_id, "daemon_status.json", data, etag):
+            return True
+    return False
+
 # ---------- Existing per-target status (moved to a separate file) -----------
 
 def update_daemon_status(tenant_id: str, label: str, update: dict):
@@ -96,12 +211,44 @@ def update_daemon_status(tenant_id: str, label: str, update: dict):
     Maintains per-target status in daemon_targets_status.json.
     (Kept for compatibility with current caller sites.)
     """
+    update_daemon_statuses(tenant_id, {label: dict(update or {}, last_updated=_now_utc_iso_z())})
+
+def update_daemon_statuses(tenant_id: str, updates: Dict[str, dict], attempts: int = 5) -> bool:
+    """
+    Merges several per-target patches ({label: fields}) into daemon_targets_status.json
+    in one ETag-conditional write, retrying from a fresh read when another writer
+    got in between. Returns False if every attempt lost that race.
+    """
     filename = "daemon_targets_status.json"
+    for _ in range(attempts):
+        data, etag = load_json_blob_with_etag(tenant_id, filename)
+        data = data if isinstance(data, dict) else {}
+        per_target = data.setdefault(tenant_id, {})
+        for label, patch in updates.items():
+            entry = per_target.setdefault(label, {})
+            entry.update(patch or {})
+            if "last_updated" not in (patch or {}):
+                entry["last_updated"] = _now_utc_iso_z()
+        if write_json_blob_if_match(tenant_id, filename, data, etag):
+            return True
+    return False
+
+# ---------- Per-target delta links (incremental crawl) ----------------------
+
+def get_delta_state(tenant_id: str, label: str) -> dict:
+    """
+    Returns the saved delta-crawl state for a target from daemon_delta_links.json,
+    or {} if there is none.
+    """
+    data = load_json_blob(tenant_id, "daemon_delta_links.json") or {}
+    state = data.get(label)
+    return state if isinstance(state, dict) else {}
+
+def set_delta_state(tenant_id: str, label: str, state: dict):
+    """
+    Stores the delta-crawl state for a target next to daemon_targets_status.json.
+    """
+    filename = "daemon_delta_links.json"
     data = load_json_blob(tenant_id, filename) or {}
-    if tenant_id not in data:
-        data[tenant_id] = {}
-    if label not in data[tenant_id]:
-        data[tenant_id][label] = {}
-    data[tenant_id][label].update(update or {})
-    data[tenant_id][label]["last_updated"] = _now_utc_iso_z()
+    data[label] = dict(state or {}, updated=_now_utc_iso_z())
     write_json_blob(tenant_id, filename, data)
@@ -0,0 +1,92 @@
+# shared/downloads.py
+from __future__ import annotations
+import io
+import os
+import tempfile
+from typing import BinaryIO, List, Optional
+
+class DownloadTooLarge(RuntimeError):
+    """
+    The file is bigger than the configured download ceiling.
+    """
+    def __init__(self, message: str, size: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.size = size
+
+class SpooledDownload:
+    """
+    Receives a download chunk by chunk. Small files stay in memory; once
+    memory_limit bytes have arrived the data moves to a named temp file so a
+    large document never sits in RAM (and worker processes can open it by path).
+    Writing past max_bytes raises DownloadTooLarge. Use as a context manager so
+    the temp file is always removed.
+    """
+    def __init__(self, memory_limit: int, max_bytes: Optional[int] = None, spool_dir: Optional[str] = None) -> None:
+        self.memory_limit = memory_limit
+        self.max_bytes = max_bytes
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.path: Optional[str] = None
+        self._chunks: List[bytes] = []
+        self._file: Optional[BinaryIO] = None
+        self._data: Optional[bytes] = None
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise DownloadTooLarge(f"download exceeds {self.max_bytes} bytes", size=self.size)
+        if self._file is None and self.size > self.memory_limit:
+            fd, self.path = tempfile.mkstemp(prefix="doctagger-", suffix=".part", dir=self.spool_dir)
+            self._file = os.fdopen(fd, "wb")
+            for c in self._chunks:
+                self._file.write(c)
+            self._chunks = []
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+
+    def finish(self) -> "SpooledDownload":
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._data is None:
+            self._data = b"".join(self._chunks)
+            self._chunks = []
+        return self
+
+    @property
+    def data(self) -> Optional[bytes]:
+        """
+        The bytes when the download stayed in memory, else None (read from .path).
+        """
+        return self._data
+
+    def open(self) -> BinaryIO:
+        """
+        A fresh binary reader over the content; BytesIO shares the buffer, no copy.
+        """
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(self._data or b"")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+        self._chunks = []
+        self._data = None
+
+    def __enter__(self) -> "SpooledDownload":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,150 @@
+# shared/extract_pool.py
+from __future__ import annotations
+import io
+import os
+import sys
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple, Union
+from .settings import env_int, env_str
+
+class ExtractionError(RuntimeError):
+    """
+    Extraction did not produce text: the job timed out, hit the memory cap, or
+    its worker process died.
+    """
+
+def _init_worker(memory_mb: int) -> None:
+    # Cap the address space of each worker so one pathological document gets a
+    # MemoryError instead of taking the whole host down. Linux/macOS only.
+    if memory_mb <= 0:
+        return
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def _extract_job(source: Union[bytes, str], filename: str, max_chars: Optional[int], max_pages: Optional[int],
+                 mime_type: Optional[str]) -> Tuple[str, Optional[str]]:
+    # 'source' is either the document bytes or the path of a spooled download;
+    # a path keeps large files out of the pickle sent to the worker.
+    from .extractors import extract_document
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return extract_document(f, filename, max_chars=max_chars, max_pages=max_pages, mime_type=mime_type)
+    return extract_document(io.BytesIO(source), filename, max_chars=max_chars, max_pages=max_pages, mime_type=mime_type)
+
+class ExtractionPool:
+    """
+    Runs document extraction in worker processes so CPU-bound PDF/DOCX parsing neither
+    holds the GIL against network threads nor shares their memory.
+
+    Each job gets 'timeout' seconds. A job that overruns, or a worker that dies,
+    causes the pool to be torn down and rebuilt; jobs caught in that restart are
+    retried once on the new pool.
+    """
+    def __init__(self, workers: int, timeout: float, memory_mb: int, mp_context: Optional[str] = None) -> None:
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self._ctx = multiprocessing.get_context(mp_context) if mp_context else None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._ctx,
+                                   initializer=_init_worker, initargs=(self.memory_mb,))
+
+    def _restart(self, generation: int) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return  # someone else already rebuilt it
+            old, self._pool = self._pool, self._new_pool()
+            self._generation += 1
+        # No public API kills a busy worker; terminate them so a stuck parse is freed.
+        for proc in list(getattr(old, "_processes", {}).values()):
+            try:
+                proc.kill()
+            except Exception:
+                pass
+        old.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, source: Union[bytes, str], filename: str, max_chars: Optional[int] = None,
+                max_pages: Optional[int] = None, mime_type: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        Returns (text, engine name) as shared.extractors.extract_document does.
+        'source' is the document bytes or a path to a local file holding them.
+        """
+        for attempt in (1, 2):
+            with self._lock:
+                pool, generation = self._pool, self._generation
+            try:
+                fut = pool.submit(_extract_job, source, filename, max_chars, max_pages, mime_type)
+            except (BrokenProcessPool, RuntimeError):
+                self._restart(generation)
+                continue
+            try:
+                return fut.result(timeout=self.timeout)
+            except FutureTimeout:
+                self._restart(generation)
+                raise ExtractionError(f"extraction of {filename} timed out after {self.timeout:.0f}s")
+            except BrokenProcessPool:
+                self._restart(generation)
+                if attempt == 2:
+                    raise ExtractionError(f"extraction worker died on {filename}")
+            except MemoryError:
+                raise ExtractionError(f"extraction of {filename} exceeded {self.memory_mb} MB")
+        raise ExtractionError(f"extraction pool unavailable for {filename}")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+# ---------- process-wide pool ----------
+
+_pool: Optional[ExtractionPool] = None
+_pool_lock = threading.Lock()
+
+def extraction_workers() -> int:
+    """
+    EXTRACT_PROCESSES: worker processes for text extraction (default: CPUs, max 4).
+    0 keeps extraction inline on the calling thread.
+    """
+    return env_int("EXTRACT_PROCESSES", min(4, os.cpu_count() or 1), minimum=0)
+
+def get_extraction_pool() -> Optional[ExtractionPool]:
+    """
+    Shared pool configured from EXTRACT_PROCESSES, EXTRACT_TIMEOUT_SECONDS (default 120)
+    and EXTRACT_MEMORY_MB (default 1024, 0 = no cap); None when extraction runs inline.
+    Workers start with 'forkserver' on Linux so they don't inherit the parent's threads.
+    """
+    global _pool
+    workers = extraction_workers()
+    if workers <= 0:
+        return None
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            default_ctx = "forkserver" if sys.platform.startswith("linux") else "spawn"
+            _pool = ExtractionPool(
+                workers,
+                timeout=float(env_int("EXTRACT_TIMEOUT_SECONDS", 120, minimum=1)),
+                memory_mb=env_int("EXTRACT_MEMORY_MB", 1024, minimum=0),
+                mp_context=env_str("EXTRACT_MP_CONTEXT", default_ctx),
+            )
+            logging.info("Extraction pool started with %d processes", workers)
+    return _pool
+
+def shutdown_extraction_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
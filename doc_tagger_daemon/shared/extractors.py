@@ -0,0 +1,164 @@
+# shared/extractors.py
+from __future__ import annotations
+import os
+import logging
+import threading
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+from .settings import env_str
+
+# An engine reads a seekable binary file and returns text, stopping early once
+# max_chars characters or max_pages pages are reached (None = no limit).
+Engine = Callable[[BinaryIO, Optional[int], Optional[int]], str]
+
+_ENGINES: Dict[str, Engine] = {}
+
+# Fastest engine first; later ones are fallbacks. Override with EXTRACTOR_ENGINES.
+DEFAULT_ENGINES: Dict[str, List[str]] = {
+    ".pdf": ["pypdfium2", "pdfplumber", "pdfminer", "pypdf2"],
+    ".docx": ["python-docx"],
+    ".txt": ["text"],
+}
+
+MIME_EXTENSIONS = {
+    "application/pdf": ".pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "text/plain": ".txt",
+}
+
+def register_engine(name: str, fn: Engine) -> None:
+    _ENGINES[name] = fn
+
+def _budget_met(parts: List[str], max_chars: Optional[int]) -> bool:
+    return max_chars is not None and sum(len(p) + 1 for p in parts) >= max_chars
+
+def _cut(text: str, max_chars: Optional[int]) -> str:
+    return text[:max_chars] if max_chars is not None else text
+
+# ---------- engines ----------
+
+def _text_engine(f: BinaryIO, max_chars: Optional[int], max_pages: Optional[int]) -> str:
+    # UTF-8 needs at most 4 bytes per character
+    data = f.read(max_chars * 4) if max_chars is not None else f.read()
+    return _cut(data.decode("utf-8", errors="ignore"), max_chars)
+
+def _docx_engine(f: BinaryIO, max_chars: Optional[int], max_pages: Optional[int]) -> str:
+    from docx import Document
+    doc = Document(f)
+    out: List[str] = []
+    for para in doc.paragraphs:
+        if _budget_met(out, max_chars):
+            break
+        t = para.text.strip()
+        if t:
+            out.append(t)
+    for table in doc.tables:
+        if _budget_met(out, max_chars):
+            break
+        for row in table.rows:
+            row_text = [c.text.strip() for c in row.cells if c.text.strip()]
+            if row_text:
+                out.append(" | ".join(row_text))
+    return _cut("\n".join(out), max_chars)
+
+# pdfium is not thread-safe; serialize it when extraction runs on threads.
+_pdfium_lock = threading.Lock()
+
+def _pypdfium2_engine(f: BinaryIO, max_chars: Optional[int], max_pages: Optional[int]) -> str:
+    import pypdfium2 as pdfium
+    pages: List[str] = []
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(f)
+        try:
+            for i in range(len(pdf)):
+                if (max_pages is not None and i >= max_pages) or _budget_met(pages, max_chars):
+                    break
+                page = pdf[i]
+                textpage = page.get_textpage()
+                try:
+                    t = textpage.get_text_range()
+                finally:
+                    textpage.close()
+                    page.close()
+                if t and t.strip():
+                    pages.append(t.replace("\r\n", "\n"))
+        finally:
+            pdf.close()
+    return _cut("".join(p + "\n" for p in pages), max_chars)
+
+def _pdfplumber_engine(f: BinaryIO, max_chars: Optional[int], max_pages: Optional[int]) -> str:
+    import pdfplumber
+    pages: List[str] = []
+    with pdfplumber.open(f) as pdf:
+        for i, page in enumerate(pdf.pages):
+            if (max_pages is not None and i >= max_pages) or _budget_met(pages, max_chars):
+                break
+            t = page.extract_text()
+            if t:
+                pages.append(t)
+            # pdfplumber caches parsed layout per page; drop it as we go
+            page.flush_cache()
+    return _cut("".join(p + "\n" for p in pages), max_chars)
+
+def _pdfminer_engine(f: BinaryIO, max_chars: Optional[int], max_pages: Optional[int]) -> str:
+    from pdfminer.high_level import extract_text as pdfminer_extract_text
+    return _cut(pdfminer_extract_text(f, maxpages=max_pages or 0), max_chars)
+
+def _pypdf2_engine(f: BinaryIO, max_chars: Optional[int], max_pages: Optional[int]) -> str:
+    from PyPDF2 import PdfReader
+    pages: List[str] = []
+    for i, page in enumerate(PdfReader(f).pages):
+        if (max_pages is not None and i >= max_pages) or _budget_met(pages, max_chars):
+            break
+        t = page.extract_text()
+        if t:
+            pages.append(t)
+    return _cut("".join(p + "\n" for p in pages), max_chars)
+
+register_engine("text", _text_engine)
+register_engine("python-docx", _docx_engine)
+register_engine("pypdfium2", _pypdfium2_engine)
+register_engine("pdfplumber", _pdfplumber_engine)
+register_engine("pdfminer", _pdfminer_engine)
+register_engine("pypdf2", _pypdf2_engine)
+
+# ---------- selection ----------
+
+def engines_for(ext: str) -> List[str]:
+    """
+    Engine chain for an extension. EXTRACTOR_ENGINES overrides it per type, e.g.
+    "pdf=pdfplumber,pypdfium2;docx=python-docx".
+    """
+    ext = ext.lower() if ext.startswith(".") else f".{ext.lower()}"
+    override = env_str("EXTRACTOR_ENGINES", "")
+    for part in override.split(";"):
+        key, _, names = part.partition("=")
+        key = key.strip().lower()
+        if key and (key if key.startswith(".") else f".{key}") == ext:
+            chain = [n.strip() for n in names.split(",") if n.strip() in _ENGINES]
+            if chain:
+                return chain
+    return list(DEFAULT_ENGINES.get(ext, []))
+
+def extract_document(f: BinaryIO, filename: str, max_chars: Optional[int] = None, max_pages: Optional[int] = None,
+                     mime_type: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Extracts text with the first engine in the chain that returns some.
+    Returns (text, engine name); engine is None if nothing produced text.
+    An engine that raises (or isn't installed) or returns only whitespace falls
+    through to the next one.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in DEFAULT_ENGINES and mime_type:
+        ext = MIME_EXTENSIONS.get(mime_type.split(";")[0].strip().lower(), ext)
+    start = f.tell() if f.seekable() else 0
+    for name in engines_for(ext):
+        try:
+            if f.seekable():
+                f.seek(start)
+            text = _ENGINES[name](f, max_chars, max_pages)
+        except Exception as e:
+            logging.debug("Extractor %s failed on %s: %s", name, filename, e)
+            continue
+        if text and text.strip():
+            return text, name
+    return "", None
@@ -1,20 +1,83 @@
 # shared/graph_auth.py
-import os, httpx
+import os, time, threading, httpx
+from typing import Dict, Optional, Tuple
 from .secrets import get_secret
+from .settings import GRAPH_SCOPE, LOGIN_BASE_URL
 
 DAEMON_CLIENT_ID = get_secret("Graph-ClientId") or os.getenv("DAEMON_CLIENT_ID")
 DAEMON_CLIENT_SECRET = get_secret("Graph-ClientSecret") or os.getenv("DAEMON_CLIENT_SECRET")
 
-def get_graph_token(tenant_id: str) -> str:
+# Tokens are reused until this many seconds before they expire.
+REFRESH_SKEW_SECONDS = 300
+
+_token_cache: Dict[str, Tuple[str, float]] = {}  # tenant_id -> (token, refresh_at monotonic)
+_tenant_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+def _tenant_lock(tenant_id: str) -> threading.Lock:
+    with _locks_guard:
+        lock = _tenant_locks.get(tenant_id)
+        if lock is None:
+            lock = _tenant_locks[tenant_id] = threading.Lock()
+        return lock
+
+def _fetch_graph_token(tenant_id: str) -> Tuple[str, int]:
     if not (DAEMON_CLIENT_ID and DAEMON_CLIENT_SECRET):
         raise RuntimeError("Daemon credentials missing (Graph-ClientId/Graph-ClientSecret).")
-    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
+    token_url = f"{LOGIN_BASE_URL}/{tenant_id}/oauth2/v2.0/token"
     data = {
         "client_id": DAEMON_CLIENT_ID,
         "client_secret": DAEMON_CLIENT_SECRET,
         "grant_type": "client_credentials",
-        "scope": "https://graph.microsoft.com/.default",
+        "scope": GRAPH_SCOPE,
     }
     resp = httpx.post(token_url, data=data, timeout=15)
     resp.raise_for_status()
-    return resp.json()["access_token"]
+    body = resp.json()
+    return body["access_token"], int(body.get("expires_in") or 0)
+
+def get_graph_token(tenant_id: str, force_refresh: bool = False) -> str:
+    """
+    Returns an app-only Graph token for the tenant, cached per tenant until
+    REFRESH_SKEW_SECONDS before expiry. Concurrent callers for the same tenant
+    wait on a single refresh instead of each hitting the token endpoint.
+    """
+    cached = _token_cache.get(tenant_id)
+    if cached and not force_refresh and time.monotonic() < cached[1]:
+        return cached[0]
+
+    with _tenant_lock(tenant_id):
+        cached = _token_cache.get(tenant_id)
+        if cached and not force_refresh and time.monotonic() < cached[1]:
+            return cached[0]
+        fetched_at = time.monotonic()
+        token, expires_in = _fetch_graph_token(tenant_id)
+        _token_cache[tenant_id] = (token, fetched_at + max(0, expires_in - REFRESH_SKEW_SECONDS))
+        return token
+
+def invalidate_graph_token(tenant_id: str, token: Optional[str] = None) -> None:
+    """
+    Drops the cached token, e.g. after Graph answered 401 with it. With 'token',
+    only if that is still the cached one, so callers that all saw the same token
+    fail cause a single refresh.
+    """
+    with _tenant_lock(tenant_id):
+        cached = _token_cache.get(tenant_id)
+        if cached and (token is None or cached[0] == token):
+            del _token_cache[tenant_id]
+
+class GraphToken:
+    """
+    A tenant's Graph token for long-running work. get() goes through the cache on
+    every request, so a run that outlives one token picks up the next; refresh()
+    replaces a token Graph rejected with 401.
+    """
+    def __init__(self, tenant_id: str) -> None:
+        self.tenant_id = tenant_id
+
+    def get(self) -> str:
+        return get_graph_token(self.tenant_id)
+
+    def refresh(self, rejected: str) -> str:
+        invalidate_graph_token(self.tenant_id, rejected)
+        return get_graph_token(self.tenant_id)
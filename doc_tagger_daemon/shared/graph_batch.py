@@ -0,0 +1,180 @@
+# shared/graph_batch.py
+from __future__ import annotations
+import time
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from .settings import GRAPH_BASE_URL
+
+GRAPH_V1 = GRAPH_BASE_URL
+
+# Graph rejects JSON batches with more than 20 sub-requests.
+MAX_BATCH_SIZE = 20
+
+class BatchRequestError(RuntimeError):
+    """
+    A sub-request of a $batch call failed (after retries, for retryable codes).
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+@dataclass
+class _SubRequest:
+    method: str
+    url: str
+    body: Optional[Dict[str, Any]]
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.monotonic)
+    not_before: float = 0.0
+    attempts: int = 0
+
+def _relative(url: str) -> str:
+    if url.startswith(GRAPH_V1):
+        return url[len(GRAPH_V1):] or "/"
+    return url
+
+def _retry_after(headers: Optional[Dict[str, Any]]) -> float:
+    for k, v in (headers or {}).items():
+        if str(k).lower() == "retry-after":
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return 0.0
+    return 0.0
+
+class GraphBatcher:
+    """
+    Coalesces individual Graph calls into JSON $batch requests.
+
+    Callers submit sub-requests from any thread and get a Future back. A background
+    thread sends a batch as soon as MAX_BATCH_SIZE requests are ready, or once the
+    oldest ready request has waited 'linger' seconds. Sub-requests answered with 429
+    or 5xx are re-queued on their own (honouring Retry-After) until max_attempts;
+    other failures resolve their Future with BatchRequestError.
+
+    'send' POSTs one $batch payload and returns the parsed JSON response; transport
+    level retries are its responsibility. 'on_retry' is told the status code of
+    every sub-request that gets re-queued.
+    """
+    def __init__(self, send: Callable[[Dict[str, Any]], Dict[str, Any]], *, max_batch: int = MAX_BATCH_SIZE,
+                 linger: float = 0.05, max_attempts: int = 5, base_sleep: float = 0.8, max_sleep: float = 10.0,
+                 on_retry: Optional[Callable[[Optional[int]], None]] = None) -> None:
+        self.max_batch = max(1, min(MAX_BATCH_SIZE, int(max_batch)))
+        self._send_fn = send
+        self._linger = max(0.0, linger)
+        self._max_attempts = max(1, max_attempts)
+        self._base_sleep = base_sleep
+        self._max_sleep = max_sleep
+        self._on_retry = on_retry
+        self._pending: List[_SubRequest] = []
+        self._cv = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="graph-batch", daemon=True)
+        self._thread.start()
+
+    # ---- public API ----
+
+    def submit(self, method: str, url: str, body: Optional[Dict[str, Any]] = None) -> Future:
+        req = _SubRequest(method=method.upper(), url=_relative(url), body=body)
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("GraphBatcher is closed")
+            self._pending.append(req)
+            self._cv.notify()
+        return req.future
+
+    def get(self, url: str) -> Dict[str, Any]:
+        return self.submit("GET", url).result() or {}
+
+    def patch(self, url: str, payload: Dict[str, Any]) -> None:
+        self.submit("PATCH", url, payload).result()
+
+    def close(self) -> None:
+        """
+        Sends everything still queued (including pending retries) and stops the sender.
+        """
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+        self._thread.join()
+
+    def __enter__(self) -> "GraphBatcher":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    # ---- sender ----
+
+    def _next_batch(self) -> Optional[List[_SubRequest]]:
+        with self._cv:
+            while True:
+                if self._closed and not self._pending:
+                    return None
+                now = time.monotonic()
+                ready = [r for r in self._pending if r.not_before <= now]
+                if ready and (len(ready) >= self.max_batch or self._closed
+                              or now - min(r.enqueued for r in ready) >= self._linger):
+                    batch = ready[: self.max_batch]
+                    ids = {id(r) for r in batch}
+                    self._pending = [r for r in self._pending if id(r) not in ids]
+                    return batch
+                wakeups = [r.not_before for r in self._pending if r.not_before > now]
+                wakeups += [r.enqueued + self._linger for r in ready]
+                self._cv.wait(timeout=(max(0.0, min(wakeups) - now) if wakeups else None))
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._send(batch)
+
+    def _send(self, batch: List[_SubRequest]) -> None:
+        subs = []
+        for i, r in enumerate(batch):
+            r.attempts += 1
+            sub: Dict[str, Any] = {"id": str(i), "method": r.method, "url": r.url}
+            if r.body is not None:
+                sub["body"] = r.body
+                sub["headers"] = {"Content-Type": "application/json"}
+            subs.append(sub)
+
+        try:
+            data = self._send_fn({"requests": subs}) or {}
+        except Exception as e:
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+            return
+
+        by_id = {str(x.get("id")): x for x in data.get("responses", []) if isinstance(x, dict)}
+        for i, r in enumerate(batch):
+            resp = by_id.get(str(i))
+            if resp is None:
+                self._retry_or_fail(r, None, 0.0, "missing from $batch response")
+                continue
+            status = int(resp.get("status") or 0)
+            if 200 <= status < 400:
+                r.future.set_result(resp.get("body"))
+            elif status == 429 or status >= 500:
+                self._retry_or_fail(r, status, _retry_after(resp.get("headers")), str(resp.get("body"))[:2000])
+            else:
+                r.future.set_exception(BatchRequestError(
+                    f"Graph {r.method} failed {status}: {r.url} :: {str(resp.get('body'))[:2000]}", status_code=status))
+
+    def _retry_or_fail(self, r: _SubRequest, status: Optional[int], retry_after: float, detail: str) -> None:
+        if r.attempts >= self._max_attempts:
+            r.future.set_exception(BatchRequestError(
+                f"Graph {r.method} failed {status if status is not None else '??'} after {r.attempts} attempts: {r.url} :: {detail}",
+                status_code=status))
+            return
+        if self._on_retry is not None:
+            self._on_retry(status)
+        backoff = min(self._max_sleep, self._base_sleep * (2 ** (r.attempts - 1)))
+        r.not_before = time.monotonic() + max(retry_after, backoff)
+        with self._cv:
+            self._pending.append(r)
+            self._cv.notify()
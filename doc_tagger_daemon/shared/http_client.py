@@ -0,0 +1,51 @@
+# shared/http_client.py
+from __future__ import annotations
+import logging
+import threading
+from typing import Optional
+from .settings import env_bool, env_int
+
+_client = None
+_client_lock = threading.Lock()
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (installed via httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+def get_http_client():
+    """
+    Process-wide pooled httpx.Client with keep-alive, shared by Graph calls and the
+    OpenAI SDK so a daemon run reuses connections instead of a TLS handshake per call.
+
+      HTTP_POOL_SIZE   max connections (default 32; keep-alive pool is the same size)
+      HTTP2_ENABLED    1 to negotiate HTTP/2 (needs the 'h2' package, httpx[http2])
+    """
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            import httpx
+            size = env_int("HTTP_POOL_SIZE", 32, minimum=1)
+            http2 = env_bool("HTTP2_ENABLED", False)
+            if http2 and not _http2_available():
+                logging.warning("HTTP2_ENABLED is set but the 'h2' package is missing; using HTTP/1.1")
+                http2 = False
+            _client = httpx.Client(
+                http2=http2,
+                limits=httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=60.0),
+                timeout=httpx.Timeout(60.0, connect=15.0),
+                # Graph answers /content with a 302 to a pre-authenticated download URL.
+                follow_redirects=True,
+            )
+    return _client
+
+def close_http_client() -> None:
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
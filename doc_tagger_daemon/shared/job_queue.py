@@ -0,0 +1,201 @@
+# shared/job_queue.py
+from __future__ import annotations
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from .settings import env_int, env_str
+
+# Queue the timer fans per-file jobs out to. function_app.py binds the queue
+# trigger to this name; the runtime moves messages that fail maxDequeueCount
+# times (host.json) to "<name>-poison".
+JOB_QUEUE_NAME = "doctagger-jobs"
+POISON_QUEUE_NAME = f"{JOB_QUEUE_NAME}-poison"
+
+DEDUP_BLOB = "daemon_job_dedup.json"
+
+def job_key(drive_id: str, item_id: str) -> str:
+    return f"{drive_id}:{item_id}"
+
+def _encode(job: Dict[str, Any]) -> str:
+    return json.dumps(job, separators=(",", ":"), ensure_ascii=False)
+
+class AzureJobQueue:
+    """
+    Storage-queue sender used by the timer. Messages are base64 encoded, which is
+    what the Functions queue trigger expects by default. Works against Azurite with
+    AzureWebJobsStorage=UseDevelopmentStorage=true.
+    """
+    def __init__(self, conn_str: str, queue_name: str = JOB_QUEUE_NAME) -> None:
+        from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+        self.queue_name = queue_name
+        self._client = QueueClient.from_connection_string(
+            conn_str, queue_name, message_encode_policy=TextBase64EncodePolicy()
+        )
+        self._created = False
+        self._lock = threading.Lock()
+
+    def _ensure_queue(self) -> None:
+        from azure.core.exceptions import ResourceExistsError
+        with self._lock:
+            if self._created:
+                return
+            try:
+                self._client.create_queue()
+            except ResourceExistsError:
+                pass
+            self._created = True
+
+    def send(self, jobs: Iterable[Dict[str, Any]], delay: float = 0) -> int:
+        """
+        Jobs sent with a delay stay invisible to the trigger for that many seconds.
+        """
+        self._ensure_queue()
+        sent = 0
+        for job in jobs:
+            self._client.send_message(_encode(job), visibility_timeout=int(delay) or None)
+            sent += 1
+        return sent
+
+class InMemoryJobQueue:
+    """
+    In-process stand-in for local runs and tests. Jobs are queued in memory and
+    processed by drain() with the same retry / poison semantics as the queue
+    trigger: a job whose handler raises is retried until max_dequeue attempts,
+    then moved to .poison. Jobs sent with a delay are left for a drain() that
+    starts after the delay.
+    """
+    def __init__(self, queue_name: str = JOB_QUEUE_NAME, max_dequeue: int = 5) -> None:
+        self.queue_name = queue_name
+        self.max_dequeue = max(1, max_dequeue)
+        self._q: "queue.Queue[Tuple[str, int]]" = queue.Queue()
+        self._delayed: List[Tuple[float, str]] = []
+        self._delayed_lock = threading.Lock()
+        self.poison: List[Dict[str, Any]] = []
+
+    def send(self, jobs: Iterable[Dict[str, Any]], delay: float = 0) -> int:
+        sent = 0
+        for job in jobs:
+            if delay > 0:
+                with self._delayed_lock:
+                    self._delayed.append((time.time() + delay, _encode(job)))
+            else:
+                self._q.put((_encode(job), 0))
+            sent += 1
+        return sent
+
+    def _release_delayed(self) -> None:
+        now = time.time()
+        with self._delayed_lock:
+            due = [body for at, body in self._delayed if at <= now]
+            self._delayed = [(at, body) for at, body in self._delayed if at > now]
+        for body in due:
+            self._q.put((body, 0))
+
+    def __len__(self) -> int:
+        with self._delayed_lock:
+            return self._q.qsize() + len(self._delayed)
+
+    def drain(self, handler: Callable[[Dict[str, Any], int], Any], workers: int = 4) -> int:
+        """
+        Runs handler(job, dequeue_count) for queued jobs until the queue is empty.
+        Returns the number of jobs that completed.
+        """
+        self._release_delayed()
+        done = 0
+        lock = threading.Lock()
+
+        def _worker() -> None:
+            nonlocal done
+            while True:
+                try:
+                    body, count = self._q.get_nowait()
+                except queue.Empty:
+                    return
+                job = json.loads(body)
+                try:
+                    handler(job, count + 1)
+                except Exception as e:
+                    if count + 1 >= self.max_dequeue:
+                        logging.error("Job moved to %s-poison after %d attempts: %s", self.queue_name, count + 1, e)
+                        self.poison.append(job)
+                    else:
+                        self._q.put((body, count + 1))
+                    continue
+                with lock:
+                    done += 1
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job-queue") as pool:
+            for _ in range(max(1, workers)):
+                pool.submit(_worker)
+        return done
+
+_memory_queue: Optional[InMemoryJobQueue] = None
+_azure_queue: Optional[AzureJobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """
+    DAEMON_JOB_QUEUE_BACKEND: 'azure' (default) sends to the storage queue named
+    JOB_QUEUE_NAME on AzureWebJobsStorage (falling back to AZURE_STORAGE_CONNECTION_STRING);
+    'memory' keeps jobs in this process for the daemon to drain itself.
+    """
+    global _memory_queue, _azure_queue
+    backend = env_str("DAEMON_JOB_QUEUE_BACKEND", "azure").lower()
+    with _queue_lock:
+        if backend == "memory":
+            if _memory_queue is None:
+                _memory_queue = InMemoryJobQueue(max_dequeue=env_int("DAEMON_JOB_MAX_DEQUEUE", 5, minimum=1))
+            return _memory_queue
+        if _azure_queue is None:
+            conn = os.getenv("AzureWebJobsStorage") or os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+            if not conn:
+                raise RuntimeError("Queue connection string not set (AzureWebJobsStorage or AZURE_STORAGE_CONNECTION_STRING).")
+            _azure_queue = AzureJobQueue(conn)
+        return _azure_queue
+
+# ---------- enqueue dedup (per tenant) ----------
+
+class JobDedup:
+    """
+    Remembers which (item id, cTag) pairs were enqueued recently so a file whose
+    job is still waiting isn't enqueued again by the next tick. Entries expire after
+    ttl seconds, after which a lost job is re-enqueued. A new cTag (content change)
+    always gets a new job. Stored compactly in daemon_job_dedup.json and merged with
+    ETag-conditional writes.
+    """
+    def __init__(self, tenant_id: str, ttl: float) -> None:
+        from .blob_utils import load_json_blob_with_etag
+        self.tenant_id = tenant_id
+        self.ttl = ttl
+        data, _ = load_json_blob_with_etag(tenant_id, DEDUP_BLOB)
+        self._items: Dict[str, List[Any]] = self._live((data or {}).get("items") or {})
+        self._new: Dict[str, List[Any]] = {}
+
+    def _live(self, items: Dict[str, Any]) -> Dict[str, List[Any]]:
+        cutoff = time.time() - self.ttl
+        return {k: v for k, v in items.items() if isinstance(v, list) and len(v) == 2 and float(v[1]) >= cutoff}
+
+    def seen(self, key: str, ctag: Optional[str]) -> bool:
+        hit = self._new.get(key) or self._items.get(key)
+        return hit is not None and hit[0] == (ctag or "")
+
+    def add(self, key: str, ctag: Optional[str]) -> None:
+        self._new[key] = [ctag or "", round(time.time())]
+
+    def save(self, attempts: int = 5) -> None:
+        from .blob_utils import load_json_blob_with_etag, write_json_blob_if_match
+        if not self._new:
+            return
+        for _ in range(attempts):
+            data, etag = load_json_blob_with_etag(self.tenant_id, DEDUP_BLOB)
+            items = self._live((data or {}).get("items") or {})
+            items.update(self._new)
+            if write_json_blob_if_match(self.tenant_id, DEDUP_BLOB, {"items": items}, etag, compact=True):
+                self._items, self._new = items, {}
+                return
+        logging.warning("[tenant=%s] Job dedup state not saved; jobs may be enqueued twice", self.tenant_id)
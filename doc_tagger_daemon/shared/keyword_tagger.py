@@ -0,0 +1,227 @@
+# shared/keyword_tagger.py
+from __future__ import annotations
+import re
+import math
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from .settings import env_bool, env_float, env_int
+
+# get_tags mode served by this module instead of OpenAI.
+FAST_MODE = "Fast"
+
+IDF_BLOB = "keyword_idf.json"
+
+_STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each either etc few for from further had has
+have having he her here hers herself him himself his how however i if in into is it its itself just may me
+might more most must my myself no nor not now of off on once only or other our ours ourselves out over own
+per please same she should so some such than that the their theirs them themselves then there these they
+this those through to too under until up upon us very via was we were what when where whether which while
+who whom why will with within without would yes yet you your yours yourself yourselves page pages shall
+""".split())
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9\-']*[A-Za-z0-9]|[A-Za-z]")
+# Anything that isn't part of a word or plain spacing ends a candidate phrase.
+_BREAK = re.compile(r"[^\w\s\-']+|\s{2,}|\n")
+
+_MAX_PHRASE_WORDS = 3
+
+def _phrases(text: str) -> List[List[str]]:
+    """
+    RAKE candidates: runs of up to _MAX_PHRASE_WORDS content words between
+    stopwords and punctuation.
+    """
+    out: List[List[str]] = []
+    for segment in _BREAK.split(text):
+        run: List[str] = []
+        for word in _WORD.findall(segment):
+            low = word.lower()
+            if low in _STOPWORDS or len(low) < 3:
+                if run:
+                    out.append(run)
+                run = []
+                continue
+            run.append(word)
+            if len(run) == _MAX_PHRASE_WORDS:
+                out.append(run)
+                run = []
+        if run:
+            out.append(run)
+    return out
+
+def terms(text: str) -> Set[str]:
+    """
+    Distinct lower-cased content words of a document (what the IDF table counts).
+    """
+    return {w.lower() for run in _phrases(text) for w in run}
+
+def extract_keywords(text: str, num_tags: int = 8, idf: Optional["KeywordStats"] = None) -> List[str]:
+    """
+    Scores candidate phrases RAKE-style (word degree / frequency, summed per phrase),
+    optionally weighting each word by its inverse document frequency in the tenant's
+    corpus, and returns the best num_tags phrases, skipping ones whose words are
+    already covered by a better phrase.
+    """
+    runs = _phrases(text)
+    if not runs:
+        return []
+    freq: Counter = Counter()
+    degree: Counter = Counter()
+    for run in runs:
+        for w in run:
+            low = w.lower()
+            freq[low] += 1
+            degree[low] += len(run)
+    word_score = {w: degree[w] / freq[w] * (idf.idf(w) if idf is not None else 1.0) for w in freq}
+
+    best: Dict[Tuple[str, ...], Tuple[float, str]] = {}
+    counts: Counter = Counter()
+    for run in runs:
+        key = tuple(w.lower() for w in run)
+        counts[key] += 1
+        if key not in best:
+            best[key] = (sum(word_score[w] for w in key), " ".join(run))
+    # Repeated phrases are a stronger signal than a single long one.
+    ranked = sorted(best.items(), key=lambda kv: kv[1][0] * (1.0 + math.log(counts[kv[0]])), reverse=True)
+
+    out: List[str] = []
+    covered: Set[str] = set()
+    for key, (_, label) in ranked:
+        if set(key) <= covered:
+            continue
+        out.append(label)
+        covered.update(key)
+        if len(out) >= num_tags:
+            break
+    return out
+
+class KeywordStats:
+    """
+    Per-tenant document frequencies for IDF weighting, loaded from one compact blob
+    ({"docs": N, "df": {term: count}}). observe() counts a document; flush() adds
+    the new counts to the blob with an ETag-conditional merge and keeps only the
+    max_terms most frequent terms. It runs every flush_every documents or
+    flush_interval seconds and at the end of a daemon run, outside the lock that
+    observe() and idf() take, on a snapshot of the new counts.
+    """
+    def __init__(self, container: str, max_terms: int = 50000, flush_every: int = 2000,
+                 flush_interval: float = 300.0) -> None:
+        self.container = container
+        self.max_terms = max(1, max_terms)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self._docs = 0
+        self._df: Dict[str, int] = {}
+        self._new_docs = 0
+        self._new_df: Dict[str, int] = defaultdict(int)
+        self._loaded = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        from .blob_utils import load_json_blob_with_etag
+        try:
+            data, _ = load_json_blob_with_etag(self.container, IDF_BLOB)
+        except Exception as e:
+            logging.warning("Keyword stats load failed for '%s': %s", self.container, e)
+            data = None
+        data = data if isinstance(data, dict) else {}
+        self._docs = int(data.get("docs") or 0)
+        self._df = dict(data.get("df") or {})
+        self._loaded = True
+
+    def idf(self, term: str) -> float:
+        with self._lock:
+            self._ensure_loaded()
+            docs = self._docs + self._new_docs
+            df = self._df.get(term, 0) + self._new_df.get(term, 0)
+        return math.log((docs + 1) / (df + 1)) + 1.0
+
+    def observe(self, text: str) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            self._new_docs += 1
+            for t in terms(text):
+                self._new_df[t] += 1
+            due = self._new_docs >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval
+        # A flush already in progress will be followed by the next due one.
+        if due and self._flush_lock.acquire(blocking=False):
+            try:
+                self._flush()
+            except Exception as e:
+                logging.warning("Keyword stats flush failed for '%s': %s", self.container, e)
+            finally:
+                self._flush_lock.release()
+
+    def flush(self, attempts: int = 5) -> None:
+        with self._flush_lock:
+            self._flush(attempts)
+
+    def _flush(self, attempts: int = 5) -> None:
+        from .blob_utils import load_json_blob_with_etag, write_json_blob_if_match
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._new_docs:
+                return
+            new_docs, new_df = self._new_docs, dict(self._new_df)
+        for _ in range(attempts):
+            data, etag = load_json_blob_with_etag(self.container, IDF_BLOB)
+            data = data if isinstance(data, dict) else {}
+            df = dict(data.get("df") or {})
+            for t, n in new_df.items():
+                df[t] = df.get(t, 0) + n
+            if len(df) > self.max_terms:
+                df = dict(sorted(df.items(), key=lambda kv: kv[1], reverse=True)[:self.max_terms])
+            docs = int(data.get("docs") or 0) + new_docs
+            if write_json_blob_if_match(self.container, IDF_BLOB, {"docs": docs, "df": df}, etag, compact=True):
+                with self._lock:
+                    # Documents observed while the blob was written stay for the next flush.
+                    self._docs, self._df = docs, df
+                    self._new_docs -= new_docs
+                    for t, n in new_df.items():
+                        left = self._new_df[t] - n
+                        if left:
+                            self._new_df[t] = left
+                        else:
+                            del self._new_df[t]
+                return
+        logging.warning("Keyword stats flush for '%s' lost to concurrent writers; retrying next time", self.container)
+
+_stats: Dict[str, KeywordStats] = {}
+_stats_lock = threading.Lock()
+
+def get_keyword_stats(tenant_id: Optional[str]) -> Optional[KeywordStats]:
+    """
+    The tenant's IDF table, or None without a tenant or when KEYWORD_IDF_ENABLED=0.
+    KEYWORD_IDF_MAX_TERMS bounds its size (default 50000).
+    KEYWORD_IDF_FLUSH_EVERY / KEYWORD_IDF_FLUSH_SECONDS: documents / seconds
+    between blob writes (default 2000 / 300).
+    """
+    if not tenant_id or not env_bool("KEYWORD_IDF_ENABLED", True):
+        return None
+    with _stats_lock:
+        stats = _stats.get(tenant_id)
+        if stats is None:
+            stats = _stats[tenant_id] = KeywordStats(
+                tenant_id,
+                max_terms=env_int("KEYWORD_IDF_MAX_TERMS", 50000, minimum=1),
+                flush_every=env_int("KEYWORD_IDF_FLUSH_EVERY", 2000, minimum=1),
+                flush_interval=env_float("KEYWORD_IDF_FLUSH_SECONDS", 300.0, minimum=0.0),
+            )
+        return stats
+
+def flush_keyword_stats() -> None:
+    with _stats_lock:
+        stats = list(_stats.values())
+    for s in stats:
+        try:
+            s.flush()
+        except Exception as e:
+            logging.warning("Keyword stats flush failed for '%s': %s", s.container, e)
@@ -0,0 +1,268 @@
+# shared/near_dup.py
+from __future__ import annotations
+import re
+import time
+import zlib
+import base64
+import random
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from .settings import env_bool, env_float, env_int
+
+INDEX_BLOB = "near_dup_index.json"
+
+_MERSENNE = (1 << 61) - 1
+_MASK32 = (1 << 32) - 1
+_WORD = re.compile(r"\w+")
+
+class NearDupMatch:
+    def __init__(self, key: str, similarity: float, tags: List[str]) -> None:
+        self.key = key
+        self.similarity = similarity
+        self.tags = tags
+
+class NearDupIndex:
+    """
+    MinHash signatures of tagged documents with LSH banding, so a new document can
+    find an already-tagged near-duplicate (a revision, a templated monthly report,
+    the PDF of a DOCX) and reuse its tags instead of calling OpenAI.
+
+    Documents are shingled into word 5-grams; a signature is num_perm 32-bit
+    minimums, split into 'bands' bands for candidate lookup. A candidate is only
+    accepted when the estimated Jaccard similarity reaches 'threshold'.
+
+    Persisted per tenant in one compact blob, merged with ETag-conditional writes:
+      {"perm": P, "bands": B, "entries": {key: [base64 signature, tags, last_used_epoch]}}
+    The blob is rewritten after flush_every changed entries, flush_interval seconds,
+    or an explicit flush() at the end of a run; the write runs outside the lock that
+    find() takes, on a snapshot of the changes.
+    """
+    def __init__(self, container: str, *, num_perm: int = 64, bands: int = 16, threshold: float = 0.85,
+                 max_entries: int = 20000, shingle: int = 5, flush_every: int = 2000,
+                 flush_interval: float = 300.0) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.container = container
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.shingle = max(1, shingle)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        rng = random.Random(0x5EED)  # fixed, so signatures stay comparable across processes
+        self._perms = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, ...], List[str], float]]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, int], Set[str]] = {}
+        self._dirty: Dict[str, Tuple[Tuple[int, ...], List[str], float]] = {}
+        self._loaded = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+    # ---- signatures ----
+
+    def signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        """
+        MinHash of the text's word shingles, or None for text too short to compare.
+        """
+        words = _WORD.findall(text.lower())
+        if len(words) < self.shingle:
+            return None
+        shingles = {
+            zlib.crc32(" ".join(words[i:i + self.shingle]).encode("utf-8"))
+            for i in range(len(words) - self.shingle + 1)
+        }
+        return tuple(
+            min(((a * x + b) % _MERSENNE) & _MASK32 for x in shingles)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, sig: Tuple[int, ...]) -> List[Tuple[int, int]]:
+        return [(i, hash(sig[i * self.rows:(i + 1) * self.rows])) for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+        return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+    @staticmethod
+    def doc_key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+    # ---- lookups ----
+
+    def find(self, sig: Optional[Tuple[int, ...]]) -> Optional[NearDupMatch]:
+        if sig is None:
+            return None
+        with self._lock:
+            self._ensure_loaded()
+            candidates: Set[str] = set()
+            for bk in self._band_keys(sig):
+                candidates |= self._buckets.get(bk, set())
+            best: Optional[NearDupMatch] = None
+            for key in candidates:
+                other, tags, _ = self._entries[key]
+                sim = self.similarity(sig, other)
+                if sim >= self.threshold and (best is None or sim > best.similarity):
+                    best = NearDupMatch(key, sim, list(tags))
+            if best is not None:
+                other, tags, _ = self._entries[best.key]
+                self._store(best.key, other, tags, dirty=True)
+            return best
+
+    def add(self, key: str, sig: Optional[Tuple[int, ...]], tags: List[str]) -> None:
+        if sig is None or not tags:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            self._store(key, sig, list(tags), dirty=True)
+            self._trim()
+            due = len(self._dirty) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval
+        # A flush already in progress will be followed by the next due one.
+        if due and self._flush_lock.acquire(blocking=False):
+            try:
+                self._flush()
+            except Exception as e:
+                logging.warning("Near-dup index flush failed for '%s': %s", self.container, e)
+            finally:
+                self._flush_lock.release()
+
+    def _store(self, key: str, sig: Tuple[int, ...], tags: List[str], *, dirty: bool, ts: Optional[float] = None) -> None:
+        entry = (sig, tags, ts if ts is not None else time.time())
+        if key not in self._entries:
+            for bk in self._band_keys(sig):
+                self._buckets.setdefault(bk, set()).add(key)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if dirty:
+            self._dirty[key] = entry
+
+    def _drop(self, key: str) -> None:
+        sig, _, _ = self._entries.pop(key)
+        for bk in self._band_keys(sig):
+            bucket = self._buckets.get(bk)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[bk]
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    # ---- persistence ----
+
+    def encode_signature(self, sig: Tuple[int, ...]) -> str:
+        return base64.b64encode(struct.pack(f"<{len(sig)}I", *sig)).decode("ascii")
+
+    def decode_signature(self, raw: str) -> Optional[Tuple[int, ...]]:
+        try:
+            data = base64.b64decode(raw)
+        except (ValueError, TypeError):
+            return None
+        if len(data) != 4 * self.num_perm:
+            return None
+        return struct.unpack(f"<{self.num_perm}I", data)
+
+    def _load_remote(self, data) -> Dict[str, Tuple[Tuple[int, ...], List[str], float]]:
+        data = data if isinstance(data, dict) else {}
+        if data.get("perm") not in (None, self.num_perm):
+            return {}  # built with other settings; start over
+        out = {}
+        for k, v in (data.get("entries") or {}).items():
+            if isinstance(v, list) and len(v) == 3:
+                sig = self.decode_signature(v[0])
+                if sig is not None:
+                    out[k] = (sig, list(v[1]), float(v[2]))
+        return out
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        from .blob_utils import load_json_blob_with_etag
+        try:
+            data, _ = load_json_blob_with_etag(self.container, INDEX_BLOB)
+        except Exception as e:
+            logging.warning("Near-dup index load failed for '%s': %s", self.container, e)
+            data = None
+        for k, (sig, tags, ts) in sorted(self._load_remote(data).items(), key=lambda kv: kv[1][2]):
+            self._store(k, sig, tags, dirty=False, ts=ts)
+        self._trim()
+        self._loaded = True
+
+    def flush(self, attempts: int = 5) -> None:
+        with self._flush_lock:
+            self._flush(attempts)
+
+    def _flush(self, attempts: int = 5) -> None:
+        from .blob_utils import load_json_blob_with_etag, write_json_blob_if_match
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._dirty:
+                return
+            dirty = dict(self._dirty)
+        for _ in range(attempts):
+            data, etag = load_json_blob_with_etag(self.container, INDEX_BLOB)
+            merged = self._load_remote(data)
+            for k, v in dirty.items():
+                if k not in merged or merged[k][2] < v[2]:
+                    merged[k] = v
+            keep = sorted(merged.items(), key=lambda kv: kv[1][2])[-self.max_entries:]
+            payload = {
+                "perm": self.num_perm,
+                "bands": self.bands,
+                "entries": {k: [self.encode_signature(sig), tags, round(ts)] for k, (sig, tags, ts) in keep},
+            }
+            if write_json_blob_if_match(self.container, INDEX_BLOB, payload, etag, compact=True):
+                with self._lock:
+                    # Entries changed while the blob was written stay dirty for the next flush.
+                    for k, v in dirty.items():
+                        if self._dirty.get(k) is v:
+                            del self._dirty[k]
+                    for k, (sig, tags, ts) in keep:
+                        if k not in self._entries:
+                            self._store(k, sig, tags, dirty=False, ts=ts)
+                    self._trim()
+                return
+        logging.warning("Near-dup index flush for '%s' lost to concurrent writers; retrying next time", self.container)
+
+# ---------- process-wide instances ----------
+
+_indexes: Dict[str, NearDupIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_near_dup_index(tenant_id: Optional[str]) -> Optional[NearDupIndex]:
+    """
+    The tenant's index, or None without a tenant or when NEAR_DUP_ENABLED=0.
+    NEAR_DUP_THRESHOLD: estimated Jaccard similarity needed to reuse tags (default 0.85).
+    NEAR_DUP_MAX_ENTRIES: documents kept per tenant (default 20000).
+    NEAR_DUP_FLUSH_EVERY / NEAR_DUP_FLUSH_SECONDS: changed entries / seconds between
+    blob writes (default 2000 / 300).
+    """
+    if not tenant_id or not env_bool("NEAR_DUP_ENABLED", True):
+        return None
+    with _indexes_lock:
+        index = _indexes.get(tenant_id)
+        if index is None:
+            index = _indexes[tenant_id] = NearDupIndex(
+                tenant_id,
+                threshold=env_float("NEAR_DUP_THRESHOLD", 0.85, minimum=0.0),
+                max_entries=env_int("NEAR_DUP_MAX_ENTRIES", 20000, minimum=1),
+                flush_every=env_int("NEAR_DUP_FLUSH_EVERY", 2000, minimum=1),
+                flush_interval=env_float("NEAR_DUP_FLUSH_SECONDS", 300.0, minimum=0.0),
+            )
+        return index
+
+def flush_near_dup_indexes() -> None:
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        try:
+            index.flush()
+        except Exception as e:
+            logging.warning("Near-dup index flush failed for '%s': %s", index.container, e)
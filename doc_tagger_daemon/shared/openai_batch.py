@@ -0,0 +1,141 @@
+# shared/openai_batch.py
+from __future__ import annotations
+import io
+import json
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Batch endpoint the tagging requests are sent to (same body as get_tags).
+BATCH_ENDPOINT = "/v1/chat/completions"
+STATE_BLOB = "daemon_openai_batches.json"
+
+# Batch states after which OpenAI will not produce more output.
+TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+def custom_id_for(site_id: str, drive_id: str, item_id: str) -> str:
+    """
+    Stable per-file id for a batch line (OpenAI caps custom_id length, drive ids are long).
+    """
+    return hashlib.sha1(f"{site_id}|{drive_id}|{item_id}".encode("utf-8")).hexdigest()
+
+def batch_line(custom_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+def submit_batch(client, lines: Iterable[Dict[str, Any]], metadata: Optional[Dict[str, str]] = None) -> Tuple[str, str]:
+    """
+    Uploads the lines as a JSONL batch input file and starts a 24h batch.
+    Returns (batch_id, input_file_id).
+    """
+    buf = io.BytesIO()
+    for line in lines:
+        buf.write(json.dumps(line, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+        buf.write(b"\n")
+    uploaded = client.files.create(file=("doctagger_batch.jsonl", buf.getvalue()), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata=metadata or None,
+    )
+    return batch.id, uploaded.id
+
+def _jsonl(text: str) -> List[Dict[str, Any]]:
+    out = []
+    for raw in (text or "").splitlines():
+        raw = raw.strip()
+        if raw:
+            try:
+                out.append(json.loads(raw))
+            except ValueError:
+                continue
+    return out
+
+def read_input_lines(client, input_file_id: str, custom_ids: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Returns the original request lines for 'custom_ids', used to resubmit failed parts.
+    """
+    wanted = set(custom_ids)
+    return [ln for ln in _jsonl(client.files.content(input_file_id).text) if ln.get("custom_id") in wanted]
+
+def fetch_batch_results(client, batch_id: str) -> Tuple[str, Dict[str, str], Dict[str, str], Any]:
+    """
+    Polls a batch. Returns (status, contents, errors, batch) where contents maps
+    custom_id -> assistant message text for successful lines and errors maps
+    custom_id -> error text. Results are only read once the batch is terminal.
+    """
+    batch = client.batches.retrieve(batch_id)
+    status = getattr(batch, "status", "") or ""
+    contents: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    if status not in TERMINAL_STATES:
+        return status, contents, errors, batch
+
+    for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+        if not file_id:
+            continue
+        for ln in _jsonl(client.files.content(file_id).text):
+            cid = ln.get("custom_id")
+            if not cid:
+                continue
+            resp = ln.get("response") or {}
+            body = resp.get("body") or {}
+            if ln.get("error") or int(resp.get("status_code") or 0) >= 400:
+                errors[cid] = json.dumps(ln.get("error") or body.get("error") or body)[:2000]
+                continue
+            try:
+                contents[cid] = body["choices"][0]["message"]["content"].strip()
+            except (KeyError, IndexError, TypeError, AttributeError):
+                errors[cid] = "malformed batch output line"
+    return status, contents, errors, batch
+
+class BatchCollector:
+    """
+    Thread-safe buffer of pending batch lines plus the per-file metadata needed to
+    apply their results later (target, item id, file name, cache key).
+    """
+    def __init__(self, pending: Optional[Iterable[str]] = None) -> None:
+        self._lock = threading.Lock()
+        self.lines: List[Dict[str, Any]] = []
+        self.items: Dict[str, Dict[str, Any]] = {}
+        # custom_ids already sitting in a submitted batch
+        self.pending = set(pending or ())
+
+    def is_pending(self, custom_id: str) -> bool:
+        return custom_id in self.pending
+
+    def add(self, custom_id: str, body: Dict[str, Any], meta: Dict[str, Any]) -> None:
+        with self._lock:
+            if custom_id in self.items or custom_id in self.pending:
+                return
+            self.lines.append(batch_line(custom_id, body))
+            self.items[custom_id] = meta
+
+    def drain(self, max_lines: int) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        with self._lock:
+            lines, self.lines = self.lines[:max_lines], self.lines[max_lines:]
+            items = {ln["custom_id"]: self.items.pop(ln["custom_id"]) for ln in lines}
+            return lines, items
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.lines)
+
+# ---------- persisted state (per tenant) ----------
+
+def load_batch_state(tenant_id: str) -> Dict[str, Any]:
+    """
+    { "batches": { batch_id: { "submitted", "inputFileId", "attempt", "items": {custom_id: meta} } } }
+    """
+    from .blob_utils import load_json_blob
+    data = load_json_blob(tenant_id, STATE_BLOB) or {}
+    if not isinstance(data.get("batches"), dict):
+        data["batches"] = {}
+    return data
+
+def save_batch_state(tenant_id: str, state: Dict[str, Any]) -> None:
+    from .blob_utils import write_json_blob
+    write_json_blob(tenant_id, STATE_BLOB, state)
+
+def pending_custom_ids(state: Dict[str, Any]) -> set:
+    return {cid for b in state.get("batches", {}).values() for cid in (b.get("items") or {})}
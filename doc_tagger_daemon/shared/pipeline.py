@@ -0,0 +1,194 @@
+# shared/pipeline.py
+from __future__ import annotations
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+class StageLimits:
+    """
+    Per-stage concurrency caps shared by all workers of a pipeline.
+    Stages without a configured limit are not throttled.
+    """
+    def __init__(self, limits: Optional[Dict[str, int]] = None) -> None:
+        self._sems = {
+            name: threading.BoundedSemaphore(max(1, int(n)))
+            for name, n in (limits or {}).items()
+            if n
+        }
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        sem = self._sems.get(name)
+        if sem is None:
+            yield
+            return
+        with sem:
+            yield
+
+class FilePipeline:
+    """
+    Runs per-file jobs on a thread pool with at most max_in_flight jobs outstanding.
+    submit() blocks while the pipeline is full, which pushes back on the listing
+    instead of queueing the whole folder in memory. Leaving the 'with' block waits
+    for every submitted job.
+    """
+    def __init__(self, max_in_flight: int, stage_limits: Optional[Dict[str, int]] = None, name: str = "daemon-file") -> None:
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.stages = StageLimits(stage_limits)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix=name)
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        self._slots.acquire()
+        try:
+            fut = self._pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _f: self._slots.release())
+        return fut
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "FilePipeline":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+# (future, fn, args, kwargs, called once the future is resolved)
+_Job = Tuple[Future, Callable[..., Any], tuple, dict, Optional[Callable[[], None]]]
+
+class FairScheduler:
+    """
+    One bounded worker pool shared by all tenants of a run. Each tenant submits
+    through its own lane (see lane()); idle workers take the next job round-robin
+    across lanes, so a tenant with a huge backlog can't starve the others, and each
+    lane caps how many of its jobs are queued or running at once. stage_limits are
+    enforced across all tenants.
+    """
+    def __init__(self, workers: int, stage_limits: Optional[Dict[str, int]] = None, name: str = "daemon-worker") -> None:
+        self.workers = max(1, int(workers))
+        self.stages = StageLimits(stage_limits)
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def lane(self, key: str, max_in_flight: int) -> "SchedulerLane":
+        return SchedulerLane(self, key, max_in_flight)
+
+    def _enqueue(self, key: str, fut: Future, fn: Callable[..., Any], args: tuple, kwargs: dict,
+                 finished: Optional[Callable[[], None]] = None) -> None:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is closed")
+            self._queues.setdefault(key, deque()).append((fut, fn, args, kwargs, finished))
+            self._cond.notify()
+
+    def _next(self) -> Optional[_Job]:
+        with self._cond:
+            while True:
+                for key in list(self._queues):
+                    q = self._queues[key]
+                    if q:
+                        job = q.popleft()
+                        # rotate: this lane goes to the back of the line
+                        self._queues.move_to_end(key)
+                        return job
+                    del self._queues[key]
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+    def _work(self) -> None:
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            fut, fn, args, kwargs, finished = job
+            try:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    fut.set_exception(e)
+                else:
+                    fut.set_result(result)
+            finally:
+                # After set_result/set_exception, i.e. after the future's done
+                # callbacks have run, so a lane's close() also waits for those.
+                if finished is not None:
+                    finished()
+
+    def close(self) -> None:
+        """
+        Lets queued jobs finish, then stops the workers.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+
+    def __enter__(self) -> "FairScheduler":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+class SchedulerLane:
+    """
+    A tenant's (or target's) view of a FairScheduler with the FilePipeline API:
+    submit() blocks while max_in_flight of this lane's jobs are queued or running,
+    and leaving the 'with' block waits for this lane's jobs only, including the
+    done callbacks the caller added to their futures.
+    """
+    def __init__(self, scheduler: FairScheduler, key: str, max_in_flight: int) -> None:
+        self.scheduler = scheduler
+        self.key = key
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.stages = scheduler.stages
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._idle = threading.Condition()
+        self._outstanding = 0
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        self._slots.acquire()
+        fut: Future = Future()
+        with self._idle:
+            self._outstanding += 1
+        try:
+            self.scheduler._enqueue(self.key, fut, fn, args, kwargs, finished=self._done)
+        except BaseException as e:
+            fut.set_exception(e)
+            self._done()
+            raise
+        return fut
+
+    def _done(self) -> None:
+        self._slots.release()
+        with self._idle:
+            self._outstanding -= 1
+            if self._outstanding == 0:
+                self._idle.notify_all()
+
+    def close(self) -> None:
+        with self._idle:
+            while self._outstanding:
+                self._idle.wait()
+
+    def __enter__(self) -> "SchedulerLane":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
@@ -0,0 +1,216 @@
+# shared/rate_governor.py
+from __future__ import annotations
+import re
+import json
+import time
+import threading
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from .settings import env_float, env_int, env_str
+
+class BudgetExhausted(RuntimeError):
+    """
+    The OpenAI budget can't serve this call within the allowed wait. The daemon
+    treats it as "stop for this tick"; the API answers 429.
+    """
+    def __init__(self, message: str, retry_after: float = 0.0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Continuous-refill bucket of 'per_minute' units (requests or tokens) that may
+    hold up to one minute's worth. take() always succeeds but can drive the
+    balance negative; later callers then see a longer wait_for(), which queues
+    them in arrival order instead of having them all retry at once.
+    """
+    def __init__(self, per_minute: float) -> None:
+        self.per_minute = float(per_minute)
+        self.capacity = float(per_minute)
+        self._level = float(per_minute)
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._level = min(self.capacity, self._level + (now - self._stamp) * self.per_minute / 60.0)
+        self._stamp = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        self._refill(now)
+        short = amount - self._level
+        return max(0.0, short * 60.0 / self.per_minute) if short > 0 else 0.0
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self._level -= amount
+
+    def cap(self, remaining: float, now: float) -> None:
+        """
+        Aligns with the server's view: never more than 'remaining' available now.
+        """
+        self._refill(now)
+        self._level = min(self._level, float(remaining))
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+def parse_reset(value: Optional[str]) -> float:
+    """
+    Parses x-ratelimit-reset-* durations such as "20ms", "1s", "6m0s" into seconds.
+    """
+    if not value:
+        return 0.0
+    total = 0.0
+    for num, unit in _DURATION.findall(value):
+        total += float(num) * {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}[unit]
+    return total
+
+class Ticket:
+    def __init__(self, buckets: List[Tuple[TokenBucket, TokenBucket]], estimate: int) -> None:
+        self.buckets = buckets
+        self.estimate = estimate
+
+class RateGovernor:
+    """
+    Request (RPM) and token (TPM) budgets for OpenAI calls: one global pair plus
+    optional per-tenant pairs. acquire() reserves one request and the estimated
+    tokens on every applicable bucket and sleeps until they're available; settle()
+    corrects the token estimate with the real usage and release() gives
+    back the reservation of a call that failed; observe() tightens the global
+    buckets from the x-ratelimit-* headers, which also reflect other processes
+    sharing the organisation's limits. A limit of 0 means unlimited.
+    """
+    def __init__(self, rpm: int, tpm: int, *, tenant_rpm: int = 0, tenant_tpm: int = 0,
+                 tenant_overrides: Optional[Dict[str, Dict[str, int]]] = None, max_wait: float = 60.0) -> None:
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._global = self._pair(rpm, tpm)
+        self._tenant_defaults = (tenant_rpm, tenant_tpm)
+        self._tenant_overrides = tenant_overrides or {}
+        self._tenants: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._blocked_until = 0.0
+
+    @staticmethod
+    def _pair(rpm: int, tpm: int) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        return (TokenBucket(rpm) if rpm > 0 else None, TokenBucket(tpm) if tpm > 0 else None)
+
+    def _tenant_pair(self, tenant_id: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        pair = self._tenants.get(tenant_id)
+        if pair is None:
+            o = self._tenant_overrides.get(tenant_id) or {}
+            pair = self._tenants[tenant_id] = self._pair(
+                int(o.get("rpm", self._tenant_defaults[0])), int(o.get("tpm", self._tenant_defaults[1]))
+            )
+        return pair
+
+    def acquire(self, estimate: int, tenant_id: Optional[str] = None, max_wait: Optional[float] = None) -> Ticket:
+        ticket, wait = self.reserve(estimate, tenant_id, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        return ticket
+
+    def reserve(self, estimate: int, tenant_id: Optional[str] = None,
+                max_wait: Optional[float] = None) -> Tuple[Ticket, float]:
+        """
+        Like acquire() but doesn't sleep: returns the ticket and how long the caller
+        must wait before using it (for async callers, which await the delay instead).
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self._lock:
+            now = time.monotonic()
+            pairs = [self._global] + ([self._tenant_pair(tenant_id)] if tenant_id else [])
+            wait = max(0.0, self._blocked_until - now)
+            for req, tok in pairs:
+                if req is not None:
+                    wait = max(wait, req.wait_for(1, now))
+                if tok is not None:
+                    wait = max(wait, tok.wait_for(estimate, now))
+            if wait > max_wait:
+                raise BudgetExhausted(f"OpenAI budget exhausted (next slot in {wait:.0f}s)", retry_after=wait)
+            for req, tok in pairs:
+                if req is not None:
+                    req.take(1, now)
+                if tok is not None:
+                    tok.take(estimate, now)
+        return Ticket(pairs, estimate), wait
+
+    def settle(self, ticket: Ticket, actual_tokens: Optional[int]) -> None:
+        if actual_tokens is None:
+            return
+        delta = actual_tokens - ticket.estimate
+        with self._lock:
+            now = time.monotonic()
+            for _, tok in ticket.buckets:
+                if tok is not None:
+                    tok.take(delta, now)
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        Gives back a ticket whose call failed without being served.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for req, tok in ticket.buckets:
+                if req is not None:
+                    req.take(-1, now)
+                if tok is not None:
+                    tok.take(-ticket.estimate, now)
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        def _num(name: str) -> Optional[float]:
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+        req, tok = self._global
+        with self._lock:
+            now = time.monotonic()
+            rem_req = _num("x-ratelimit-remaining-requests")
+            if req is not None and rem_req is not None:
+                req.cap(rem_req, now)
+            rem_tok = _num("x-ratelimit-remaining-tokens")
+            if tok is not None and rem_tok is not None:
+                tok.cap(rem_tok, now)
+
+    def backoff(self, seconds: float) -> None:
+        """
+        After a 429, holds every caller back for 'seconds' instead of letting them retry at once.
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + max(0.0, seconds))
+
+def estimate_tokens(body: Dict[str, Any], completion_tokens: int = 100) -> int:
+    """
+    Rough prompt size (about 4 characters per token plus per-message overhead)
+    plus an allowance for the reply.
+    """
+    chars = sum(len(str(m.get("content") or "")) for m in body.get("messages") or [])
+    return chars // 4 + 4 * len(body.get("messages") or []) + completion_tokens
+
+_governor: Optional[RateGovernor] = None
+_governor_lock = threading.Lock()
+
+def get_rate_governor() -> Optional[RateGovernor]:
+    """
+    Process-wide governor, or None when no budget is configured.
+    OPENAI_RPM / OPENAI_TPM: organisation limits shared by this process (0 = none).
+    OPENAI_TENANT_RPM / OPENAI_TENANT_TPM: default per-tenant share (0 = none);
+    OPENAI_TENANT_BUDGETS: JSON overrides, e.g. {"<tid>": {"rpm": 60, "tpm": 40000}}.
+    OPENAI_MAX_WAIT_SECONDS: longest a caller queues before BudgetExhausted (default 60).
+    """
+    global _governor
+    if _governor is not None:
+        return _governor
+    with _governor_lock:
+        if _governor is None:
+            try:
+                overrides = json.loads(env_str("OPENAI_TENANT_BUDGETS", "{}"))
+            except ValueError:
+                overrides = {}
+            rpm, tpm = env_int("OPENAI_RPM", 0, minimum=0), env_int("OPENAI_TPM", 0, minimum=0)
+            t_rpm, t_tpm = env_int("OPENAI_TENANT_RPM", 0, minimum=0), env_int("OPENAI_TENANT_TPM", 0, minimum=0)
+            if not (rpm or tpm or t_rpm or t_tpm or overrides):
+                return None
+            _governor = RateGovernor(
+                rpm, tpm, tenant_rpm=t_rpm, tenant_tpm=t_tpm,
+                tenant_overrides=overrides if isinstance(overrides, dict) else {},
+                max_wait=env_float("OPENAI_MAX_WAIT_SECONDS", 60.0, minimum=0.0),
+            )
+    return _governor
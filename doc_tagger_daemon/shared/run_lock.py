@@ -0,0 +1,132 @@
+# shared/run_lock.py
+from __future__ import annotations
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+LOCK_BLOB = "daemon_run.lock"
+
+def _now_utc_iso_z() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def default_holder() -> str:
+    """
+    Identifies this process: Functions instance id (or host name) and pid.
+    """
+    instance = os.getenv("WEBSITE_INSTANCE_ID", "")[:12] or socket.gethostname()
+    return f"{instance}:{os.getpid()}"
+
+class RunLock:
+    """
+    Exclusive lock on a tenant's daemon run, held as a lease on a small blob in the
+    tenant container. The lease lasts 'duration' seconds (15-60, Azure's range) and
+    a background thread renews it every duration/3 while the run is active, so a
+    crashed run frees the tenant within one lease period.
+
+    The holder id and start time are stored as blob metadata so a second invocation
+    can report who it is waiting on. If renewal fails, .lost is set and the run
+    should stop at the next convenient point.
+    """
+    def __init__(self, tenant_id: str, *, name: str = LOCK_BLOB, duration: int = 60, holder: Optional[str] = None) -> None:
+        self.tenant_id = tenant_id
+        self.name = name
+        self.duration = min(60, max(15, int(duration)))
+        self.holder = holder or default_holder()
+        self.since: Optional[str] = None
+        self.lost = threading.Event()
+        self._lease = None
+        self._stop = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+
+    def _blob(self):
+        from .blob_utils import get_blob_client
+        return get_blob_client(self.tenant_id, self.name)
+
+    def current_holder(self) -> Dict[str, Any]:
+        """
+        {"holder", "since", "leased"} as recorded on the lock blob ({} if it doesn't exist).
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            props = self._blob().get_blob_properties()
+        except ResourceNotFoundError:
+            return {}
+        meta = props.metadata or {}
+        return {
+            "holder": meta.get("holder"),
+            "since": meta.get("since"),
+            "leased": getattr(props.lease, "state", None) == "leased",
+        }
+
+    def try_acquire(self) -> bool:
+        from azure.core.exceptions import HttpResponseError, ResourceExistsError
+        blob = self._blob()
+        try:
+            blob.upload_blob(b"", overwrite=False)
+        except ResourceExistsError:
+            pass
+        except HttpResponseError as e:
+            # 412 when another run holds the lease on an existing blob
+            if getattr(e, "status_code", None) not in (409, 412):
+                raise
+        try:
+            lease = blob.acquire_lease(lease_duration=self.duration)
+        except HttpResponseError as e:
+            if getattr(e, "status_code", None) == 409:  # LeaseAlreadyPresent
+                return False
+            raise
+        self._lease = lease
+        self.since = _now_utc_iso_z()
+        blob.set_blob_metadata({"holder": self.holder, "since": self.since}, lease=lease)
+        self._stop.clear()
+        self.lost.clear()
+        self._renewer = threading.Thread(target=self._renew, name=f"run-lock-{self.tenant_id}"[:40], daemon=True)
+        self._renewer.start()
+        return True
+
+    def acquire(self, wait: float = 0.0, poll: float = 5.0) -> bool:
+        """
+        Tries to take the lock, retrying for up to 'wait' seconds. Returns False if
+        another run still holds it.
+        """
+        deadline = time.monotonic() + max(0.0, wait)
+        while True:
+            if self.try_acquire():
+                return True
+            if time.monotonic() + poll > deadline:
+                return False
+            time.sleep(poll)
+
+    def _renew(self) -> None:
+        while not self._stop.wait(self.duration / 3.0):
+            try:
+                self._lease.renew()
+            except Exception as e:
+                logging.error("[tenant=%s] Lost run lock %s: %s", self.tenant_id, self.name, e)
+                self.lost.set()
+                return
+
+    def release(self) -> None:
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join(timeout=5)
+            self._renewer = None
+        lease, self._lease = self._lease, None
+        if lease is None:
+            return
+        try:
+            self._blob().set_blob_metadata({}, lease=lease)
+            lease.release()
+        except Exception as e:
+            # The lease expires by itself within 'duration' seconds.
+            logging.warning("[tenant=%s] Releasing run lock failed: %s", self.tenant_id, e)
+
+    def __enter__(self) -> "RunLock":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
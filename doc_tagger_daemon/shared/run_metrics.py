@@ -0,0 +1,173 @@
+# shared/run_metrics.py
+from __future__ import annotations
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Latency samples kept per stage for percentiles (reservoir sampled beyond this).
+_SAMPLES = 512
+
+_events = logging.getLogger("doctagger.metrics")
+
+def _now_utc_iso_z() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def _pct(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+class StageStats:
+    """
+    Latency of one pipeline stage: count, failures, total and max, plus a bounded
+    reservoir sample for p50/p95.
+    """
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples: List[float] = []
+        self._rng = random.Random()
+
+    def add(self, seconds: float, ok: bool = True) -> None:
+        self.count += 1
+        self.errors += 0 if ok else 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self._samples) < _SAMPLES:
+            self._samples.append(seconds)
+        else:
+            j = self._rng.randrange(self.count)
+            if j < _SAMPLES:
+                self._samples[j] = seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = sorted(self._samples)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total * 1000, 1),
+            "p50_ms": round(_pct(s, 0.50) * 1000, 1),
+            "p95_ms": round(_pct(s, 0.95) * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+class RunMetrics:
+    """
+    Stage timers and counters for one scope of a daemon run (a tenant, or one of
+    its targets via child()). Everything recorded on a child is also recorded on
+    its parent, so the tenant figures are the sum of its targets plus tenant-level
+    work such as OpenAI batch handling.
+
+    Code deep in the pipeline (HTTP retries, OpenAI usage) records through the
+    module-level timed()/incr() helpers, which go to the metrics bound to the
+    current thread with bind(); outside a daemon run they do nothing.
+    """
+    def __init__(self, scope: str, parent: Optional["RunMetrics"] = None) -> None:
+        self.scope = scope
+        self.parent = parent
+        self.started = _now_utc_iso_z()
+        self._t0 = time.monotonic()
+        self._stages: Dict[str, StageStats] = {}
+        self._counters: Dict[str, int] = {}
+        self._children: Dict[str, RunMetrics] = {}
+        self._lock = threading.Lock()
+
+    def child(self, scope: str) -> "RunMetrics":
+        with self._lock:
+            c = self._children.get(scope)
+            if c is None:
+                c = self._children[scope] = RunMetrics(scope, parent=self)
+            return c
+
+    def record(self, stage: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            st = self._stages.get(stage)
+            if st is None:
+                st = self._stages[stage] = StageStats()
+            st.add(seconds, ok)
+        if self.parent is not None:
+            self.parent.record(stage, seconds, ok)
+
+    def add(self, counter: str, n: int = 1) -> None:
+        if not n:
+            return
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + int(n)
+        if self.parent is not None:
+            self.parent.add(counter, n)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(name, time.perf_counter() - t0, ok)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        {"started", "elapsed_s", "stages": {name: {count, errors, total_ms, p50_ms,
+        p95_ms, max_ms}}, "counters": {name: n}}
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed_s": round(time.monotonic() - self._t0, 2),
+                "stages": {name: st.snapshot() for name, st in self._stages.items()},
+                "counters": dict(self._counters),
+            }
+
+    def emit(self, event: str, **fields: Any) -> Dict[str, Any]:
+        """
+        Logs the snapshot as one structured event ("<event> {json}") on the
+        'doctagger.metrics' logger and returns it.
+        """
+        snap = self.snapshot()
+        _events.info("%s %s", event, json.dumps({**fields, **snap}, separators=(",", ":"), default=str))
+        return snap
+
+# ---------- per-thread binding ----------
+
+_local = threading.local()
+
+def current() -> Optional[RunMetrics]:
+    return getattr(_local, "metrics", None)
+
+@contextmanager
+def bind(metrics: Optional[RunMetrics]) -> Iterator[Optional[RunMetrics]]:
+    prev = current()
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _local.metrics = prev
+
+def call_bound(metrics: Optional[RunMetrics], fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs fn with metrics bound, for work handed to another thread.
+    """
+    with bind(metrics):
+        return fn(*args, **kwargs)
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    m = current()
+    if m is None:
+        yield
+        return
+    with m.stage(stage):
+        yield
+
+def incr(counter: str, n: int = 1) -> None:
+    m = current()
+    if m is not None:
+        m.add(counter, n)
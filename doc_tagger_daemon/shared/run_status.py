@@ -0,0 +1,123 @@
+# shared/run_status.py
+from __future__ import annotations
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+def _now_utc_iso_z() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+class RunStatusBuffer:
+    """
+    Write-behind buffer for a daemon run's per-target status patches and upload log
+    entries. Updates are merged in memory and written out by flush(): status goes
+    to daemon_targets_status.json in one ETag-conditional merge per tenant and log
+    entries go to the upload log in one append per partition.
+
+    The daemon flushes at target boundaries; a background timer also flushes every
+    flush_interval seconds, and the log is flushed early once max_log_entries pile up.
+    Anything that fails to write stays buffered for the next flush.
+    """
+    def __init__(self, flush_interval: float = 30.0, max_log_entries: int = 500) -> None:
+        self.flush_interval = flush_interval
+        self.max_log_entries = max(1, max_log_entries)
+        self._status: Dict[str, Dict[str, Dict[str, Any]]] = {}  # tenant -> label -> merged patch
+        self._logs: Dict[str, List[Dict[str, Any]]] = {}         # tenant -> entries
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+
+    # ---- producers ----
+
+    def update_status(self, tenant_id: str, label: str, patch: Dict[str, Any]) -> None:
+        with self._lock:
+            merged = self._status.setdefault(tenant_id, {}).setdefault(label, {})
+            merged.update(patch or {})
+            merged["last_updated"] = _now_utc_iso_z()
+
+    def append_log(self, tenant_id: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            entries = self._logs.setdefault(tenant_id, [])
+            entries.append(entry)
+            due = len(entries) >= self.max_log_entries
+        if due:
+            self._flush_logs(tenant_id)
+
+    # ---- flushing ----
+
+    def flush(self, tenant_id: Optional[str] = None) -> None:
+        """
+        Writes pending status and log entries for one tenant, or all of them.
+        """
+        with self._lock:
+            tenants = [tenant_id] if tenant_id else sorted(set(self._status) | set(self._logs))
+        for tid in tenants:
+            self._flush_logs(tid)
+            self._flush_status(tid)
+
+    def _flush_status(self, tenant_id: str) -> None:
+        from .blob_utils import update_daemon_statuses
+        with self._flush_lock:
+            with self._lock:
+                updates = self._status.pop(tenant_id, None)
+            if not updates:
+                return
+            try:
+                ok = update_daemon_statuses(tenant_id, updates)
+            except Exception as e:
+                logging.warning("[tenant=%s] Status flush failed: %s", tenant_id, e)
+                ok = False
+            if not ok:
+                self._requeue_status(tenant_id, updates)
+
+    def _flush_logs(self, tenant_id: str) -> None:
+        from .upload_log import append_upload_log
+        with self._flush_lock:
+            with self._lock:
+                entries = self._logs.pop(tenant_id, None)
+            if not entries:
+                return
+            try:
+                append_upload_log(tenant_id, entries)
+            except Exception as e:
+                logging.warning("[tenant=%s] Upload log flush of %d entries failed: %s", tenant_id, len(entries), e)
+                with self._lock:
+                    self._logs[tenant_id] = entries + self._logs.get(tenant_id, [])
+
+    def _requeue_status(self, tenant_id: str, updates: Dict[str, Dict[str, Any]]) -> None:
+        # Patches that arrived meanwhile are newer and win over the unwritten ones.
+        with self._lock:
+            current = self._status.setdefault(tenant_id, {})
+            for label, patch in updates.items():
+                current[label] = {**patch, **current.get(label, {})}
+
+    # ---- lifecycle ----
+
+    def start(self) -> "RunStatusBuffer":
+        if self._timer is None and self.flush_interval > 0:
+            self._stop.clear()
+            self._timer = threading.Thread(target=self._run_timer, name="run-status-flush", daemon=True)
+            self._timer.start()
+        return self
+
+    def _run_timer(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning("Timed status flush failed: %s", e)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join(timeout=5)
+            self._timer = None
+        self.flush()
+
+    def __enter__(self) -> "RunStatusBuffer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,41 @@
+# shared/settings.py
+from __future__ import annotations
+import os
+from typing import Optional
+
+def env_str(name: str, default: str = "") -> str:
+    v = os.getenv(name)
+    return v.strip() if v not in (None, "") and v.strip() else default
+
+def env_bool(name: str, default: bool = False) -> bool:
+    v = os.getenv(name)
+    if v in (None, ""):
+        return default
+    return v.strip().lower() in ("1", "true", "yes", "on")
+
+def env_int(name: str, default: int, minimum: Optional[int] = None) -> int:
+    """
+    Reads an integer env var; falls back to default when unset or malformed.
+    """
+    try:
+        v = int(os.getenv(name, "").strip())
+    except ValueError:
+        v = default
+    if minimum is not None and v < minimum:
+        v = minimum
+    return v
+
+def env_float(name: str, default: float, minimum: Optional[float] = None) -> float:
+    try:
+        v = float(os.getenv(name, "").strip())
+    except ValueError:
+        v = default
+    if minimum is not None and v < minimum:
+        v = minimum
+    return v
+
+# Service endpoints. Overridable for national clouds and for the local fakes in
+# benchmarks/; read once at import.
+GRAPH_BASE_URL = env_str("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0").rstrip("/")
+LOGIN_BASE_URL = env_str("AAD_LOGIN_BASE_URL", "https://login.microsoftonline.com").rstrip("/")
+GRAPH_SCOPE = env_str("GRAPH_SCOPE", "https://graph.microsoft.com/.default")
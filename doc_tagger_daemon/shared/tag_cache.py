@@ -0,0 +1,201 @@
+# shared/tag_cache.py
+from __future__ import annotations
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from .settings import env_bool, env_float, env_int, env_str
+
+CACHE_BLOB = "tag_cache.json"
+
+def cache_key(text: str, mode_prompt: str = "", num_tags: int = 8, mode: str = "Keywords") -> str:
+    """
+    Key for the tags of 'text' under a given mode / prompt / num_tags / model.
+    Built from the effective prompt, so settings the prompt ignores don't split entries.
+    """
+    from .tagging_utils import TAG_MODEL, build_tag_prompt
+    content = hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+    settings = json.dumps([mode, build_tag_prompt(mode_prompt, num_tags, mode), int(num_tags), TAG_MODEL])
+    return f"{content}:{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]}"
+
+class TagCache:
+    """
+    Persistent text -> tags cache, kept in memory and written back to one blob.
+
+    Entries are LRU-ordered by last use and trimmed to max_entries. Writes are
+    buffered and merged into the blob with ETag-conditional uploads, so several
+    processes (daemon instances, API workers) can share one cache. Flushing happens
+    after flush_every changed entries, flush_interval seconds, or an explicit flush()
+    (the daemon flushes at the end of a run). A flush rewrites the whole blob, so it
+    runs outside the lock that lookups take, on a snapshot of the changes.
+
+    Blob shape (compact JSON):
+      {"stats": {"hits": N, "misses": N}, "entries": {key: [tags, last_used_epoch]}}
+    """
+    def __init__(self, container: str, *, blob_name: str = CACHE_BLOB, max_entries: int = 20000,
+                 flush_every: int = 2000, flush_interval: float = 300.0) -> None:
+        self.container = container
+        self.blob_name = blob_name
+        self.max_entries = max(1, max_entries)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self._dirty: Dict[str, Tuple[List[str], float]] = {}
+        self._hits = self._misses = 0          # since last flush
+        self._total_hits = self._total_misses = 0
+        self._loaded = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+    # ---- lookups ----
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            self._ensure_loaded()
+            hit = self._entries.get(key)
+            if hit is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            entry = (hit[0], time.time())
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._dirty[key] = entry
+            return list(hit[0])
+
+    def put(self, key: str, tags: List[str]) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            entry = (list(tags), time.time())
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._dirty[key] = entry
+            self._trim(self._entries)
+            due = len(self._dirty) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval
+        # A flush already in progress will be followed by the next due one.
+        if due and self._flush_lock.acquire(blocking=False):
+            try:
+                self._flush()
+            except Exception as e:
+                logging.warning("Tag cache flush failed for '%s': %s", self.container, e)
+            finally:
+                self._flush_lock.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._total_hits + self._hits,
+                "misses": self._total_misses + self._misses,
+            }
+
+    # ---- persistence ----
+
+    def flush(self, attempts: int = 5) -> None:
+        with self._flush_lock:
+            self._flush(attempts)
+
+    def _flush(self, attempts: int = 5) -> None:
+        from .blob_utils import load_json_blob_with_etag, write_json_blob_if_match
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._dirty and not self._hits and not self._misses:
+                return
+            dirty, hits, misses = dict(self._dirty), self._hits, self._misses
+        for _ in range(attempts):
+            data, etag = load_json_blob_with_etag(self.container, self.blob_name)
+            merged, stats = self._merge(data, dirty, hits, misses)
+            payload = {"stats": stats, "entries": {k: [v[0], round(v[1], 1)] for k, v in merged.items()}}
+            if write_json_blob_if_match(self.container, self.blob_name, payload, etag, compact=True):
+                with self._lock:
+                    # Entries changed while the blob was written stay dirty for the next flush.
+                    for k, v in dirty.items():
+                        if self._dirty.get(k) is v:
+                            del self._dirty[k]
+                    for k, v in self._dirty.items():
+                        merged[k] = v
+                        merged.move_to_end(k)
+                    self._trim(merged)
+                    self._entries = merged
+                    self._total_hits, self._total_misses = stats["hits"], stats["misses"]
+                    self._hits -= hits
+                    self._misses -= misses
+                return
+        logging.warning("Tag cache flush lost %d times to concurrent writers; keeping changes for next flush", attempts)
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        from .blob_utils import load_json_blob_with_etag
+        try:
+            data, _ = load_json_blob_with_etag(self.container, self.blob_name)
+        except Exception as e:
+            logging.warning("Tag cache load failed for '%s': %s", self.container, e)
+            data = None
+        self._entries, stats = self._merge(data)
+        self._total_hits, self._total_misses = stats["hits"], stats["misses"]
+        self._loaded = True
+
+    def _merge(self, data, dirty: Optional[Dict[str, Tuple[List[str], float]]] = None, hits: int = 0,
+               misses: int = 0) -> Tuple["OrderedDict[str, Tuple[List[str], float]]", Dict[str, int]]:
+        data = data if isinstance(data, dict) else {}
+        combined: Dict[str, Tuple[List[str], float]] = {}
+        for k, v in (data.get("entries") or {}).items():
+            if isinstance(v, list) and len(v) == 2:
+                combined[k] = (v[0], float(v[1]))
+        for k, v in (dirty or {}).items():
+            if k not in combined or combined[k][1] < v[1]:
+                combined[k] = v
+        merged = OrderedDict(sorted(combined.items(), key=lambda kv: kv[1][1]))
+        self._trim(merged)
+        remote = data.get("stats") or {}
+        stats = {
+            "hits": int(remote.get("hits", 0)) + hits,
+            "misses": int(remote.get("misses", 0)) + misses,
+        }
+        return merged, stats
+
+    def _trim(self, entries: "OrderedDict[str, Tuple[List[str], float]]") -> None:
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+# ---------- process-wide instances ----------
+
+_caches: Dict[str, TagCache] = {}
+_caches_lock = threading.Lock()
+
+def get_tag_cache(tenant_id: str) -> Optional[TagCache]:
+    """
+    Returns the cache to use for a tenant, or None when TAG_CACHE_ENABLED=0.
+    TAG_CACHE_SCOPE=global (default) shares one cache in the 'global' container,
+    so a document copied between tenants is only tagged once; 'tenant' keeps one
+    cache per tenant container. TAG_CACHE_MAX_ENTRIES bounds its size.
+    TAG_CACHE_FLUSH_EVERY / TAG_CACHE_FLUSH_SECONDS: changed entries / seconds
+    between blob writes (default 2000 / 300).
+    """
+    if not env_bool("TAG_CACHE_ENABLED", True):
+        return None
+    container = tenant_id if env_str("TAG_CACHE_SCOPE", "global").lower() == "tenant" else "global"
+    with _caches_lock:
+        cache = _caches.get(container)
+        if cache is None:
+            cache = _caches[container] = TagCache(
+                container,
+                max_entries=env_int("TAG_CACHE_MAX_ENTRIES", 20000, minimum=1),
+                flush_every=env_int("TAG_CACHE_FLUSH_EVERY", 2000, minimum=1),
+                flush_interval=env_float("TAG_CACHE_FLUSH_SECONDS", 300.0, minimum=0.0),
+            )
+        return cache
+
+def flush_tag_caches() -> None:
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        try:
+            cache.flush()
+        except Exception as e:
+            logging.warning("Tag cache flush failed for '%s': %s", cache.container, e)
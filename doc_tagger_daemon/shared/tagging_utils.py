@@ -2,81 +2,230 @@
 from __future__ import annotations
 import os
 import re
-import io
-from typing import List
+import time
+import random
+import asyncio
+import threading
+from typing import List, Optional, Tuple
 from .secrets import get_secret
 
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
 def _openai_client():
     """
-    Create OpenAI client on demand. Prefers Key Vault secret 'OpenAI-ApiKey',
-    falls back to env var OPENAI_API_KEY.
+    Shared OpenAI client, created on first use. Prefers Key Vault secret 'OpenAI-ApiKey',
+    falls back to env var OPENAI_API_KEY. Uses the pooled transport from http_client.
+    """
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            key = get_secret("OpenAI-ApiKey", default=os.getenv("OPENAI_API_KEY"))
+            if not key:
+                raise RuntimeError("OpenAI API key not set (Key Vault 'OpenAI-ApiKey' or env 'OPENAI_API_KEY').")
+            # Import lazily to avoid import-time failures
+            from openai import OpenAI
+            from .http_client import get_http_client
+            _client = OpenAI(api_key=key, http_client=get_http_client())
+    return _client
+
+def _async_openai_client():
+    """
+    Shared AsyncOpenAI client for the API's event loop, with its own async connection pool.
+    """
+    global _async_client
+    if _async_client is not None:
+        return _async_client
+    with _client_lock:
+        if _async_client is None:
+            key = get_secret("OpenAI-ApiKey", default=os.getenv("OPENAI_API_KEY"))
+            if not key:
+                raise RuntimeError("OpenAI API key not set (Key Vault 'OpenAI-ApiKey' or env 'OPENAI_API_KEY').")
+            from openai import AsyncOpenAI
+            _async_client = AsyncOpenAI(api_key=key)
+    return _async_client
+
+# Only this much document text is sent to the model.
+TAG_TEXT_CHARS = 3000
+
+def extract_text_with_engine(uploaded_file, max_chars: Optional[int] = None, max_pages: Optional[int] = None,
+                             mime_type: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Like extract_text, but also returns the name of the extractor engine that
+    produced the text (None if none did). See shared/extractors.py.
     """
-    key = get_secret("OpenAI-ApiKey", default=os.getenv("OPENAI_API_KEY"))
-    if not key:
-        raise RuntimeError("OpenAI API key not set (Key Vault 'OpenAI-ApiKey' or env 'OPENAI_API_KEY').")
-    # Import lazily to avoid import-time failures
-    from openai import OpenAI
-    return OpenAI(api_key=key)
+    from .extractors import extract_document
+    return extract_document(uploaded_file.file, uploaded_file.filename, max_chars=max_chars,
+                            max_pages=max_pages, mime_type=mime_type)
 
-def extract_text(uploaded_file) -> str:
+def extract_text(uploaded_file, max_chars: Optional[int] = None, max_pages: Optional[int] = None) -> str:
     """
     Extracts clean text from a FastAPI UploadFile-like object (PDF, DOCX, or TXT).
     Heavy libs are imported inside to avoid import-time side effects.
+
+    max_chars / max_pages bound the work: extraction stops as soon as max_chars
+    characters have been collected or max_pages PDF pages have been read, and the
+    result is cut to max_chars. None means no limit.
     """
-    ext = os.path.splitext(uploaded_file.filename)[1].lower()
-    file_bytes = uploaded_file.file.read()
-
-    if ext == ".txt":
-        return file_bytes.decode("utf-8", errors="ignore")
-
-    if ext == ".docx":
-        from docx import Document
-        doc = Document(io.BytesIO(file_bytes))
-        out = []
-        for para in doc.paragraphs:
-            t = para.text.strip()
-            if t:
-                out.append(t)
-        for table in doc.tables:
-            for row in table.rows:
-                row_text = [c.text.strip() for c in row.cells if c.text.strip()]
-                if row_text:
-                    out.append(" | ".join(row_text))
-        return "\n".join(out)
-
-    if ext == ".pdf":
-        import pdfplumber
-        text = ""
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                t = page.extract_text()
-                if t:
-                    text += t + "\n"
-        return text
-
-    return ""
-
-def get_tags(text: str, mode_prompt: str = "", num_tags: int = 8, mode: str = "Keywords") -> str:
+    text, _ = extract_text_with_engine(uploaded_file, max_chars=max_chars, max_pages=max_pages)
+    return text
+
+# Choose a lightweight model you actually have access to
+TAG_MODEL = "gpt-3.5-turbo"
+
+def build_tag_prompt(mode_prompt: str = "", num_tags: int = 8, mode: str = "Keywords") -> str:
     """
-    Calls OpenAI to extract tags from text. Returns raw model string (parse with parse_tags()).
+    The instruction sent ahead of the document text for a given mode.
     """
-    prompt = {
+    return {
         "Keywords": f"Extract exactly {num_tags} concise keywords that summarize this document.",
         "Topics": f"List {num_tags} major themes or subjects covered in the document.",
         "Custom Prompt": mode_prompt or "Extract relevant tags.",
     }.get(mode, "Extract relevant tags.")
 
-    client = _openai_client()
-    resp = client.chat.completions.create(
-        # Choose a lightweight model you actually have access to
-        model="gpt-3.5-turbo",
-        messages=[
+def build_tag_request(text: str, mode_prompt: str = "", num_tags: int = 8, mode: str = "Keywords") -> dict:
+    """
+    Chat-completions request body for tagging 'text'; shared by get_tags and the Batch API mode.
+    """
+    prompt = build_tag_prompt(mode_prompt, num_tags, mode)
+    return {
+        "model": TAG_MODEL,
+        "messages": [
             {"role": "system", "content": "You extract short, relevant tags from documents."},
             {"role": "user", "content": f"{prompt}\n\n{text}"},
         ],
-        temperature=0.3,
-    )
-    return resp.choices[0].message.content.strip()
+        "temperature": 0.3,
+    }
+
+def get_tags(text: str, mode_prompt: str = "", num_tags: int = 8, mode: str = "Keywords", client=None,
+             tenant_id: Optional[str] = None, max_wait: Optional[float] = None) -> str:
+    """
+    Calls OpenAI to extract tags from text. Returns raw model string (parse with parse_tags()).
+    Pass 'client' to reuse a caller-owned OpenAI client; otherwise the shared one is used.
+
+    When OpenAI budgets are configured (see shared.rate_governor) the call first waits
+    for its share of the global and tenant_id's budget, and raises BudgetExhausted
+    if that would take longer than max_wait seconds. 429s are retried through the
+    governor rather than by the SDK, and so are the connection errors, timeouts and
+    5xx answers the SDK would otherwise retry. A failed call gives back its budget.
+
+    mode="Fast" skips OpenAI and extracts keyphrases locally (shared.keyword_tagger),
+    weighted by tenant_id's document frequencies when available.
+    """
+    if mode == "Fast":
+        from .keyword_tagger import extract_keywords, get_keyword_stats
+        return ", ".join(extract_keywords(text, num_tags, idf=get_keyword_stats(tenant_id)))
+
+    from .rate_governor import get_rate_governor, estimate_tokens
+    from .run_metrics import incr
+    client = client or _openai_client()
+    body = build_tag_request(text, mode_prompt, num_tags, mode)
+    governor = get_rate_governor()
+    if governor is None:
+        resp = client.chat.completions.create(**body)
+        _count_usage(resp)
+        return resp.choices[0].message.content.strip()
+
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+    estimate = estimate_tokens(body)
+    for attempt in range(1, 4):
+        ticket = governor.acquire(estimate, tenant_id, max_wait=max_wait)
+        try:
+            raw = client.with_options(max_retries=0).chat.completions.with_raw_response.create(**body)
+        except RateLimitError as e:
+            governor.release(ticket)
+            _back_off(governor, e, attempt)
+            if attempt == 3:
+                raise
+            incr("openai_retries")
+            continue
+        except (APIConnectionError, APITimeoutError, InternalServerError):
+            governor.release(ticket)
+            if attempt == 3:
+                raise
+            incr("openai_retries")
+            time.sleep(_retry_delay(attempt))
+            continue
+        governor.observe(raw.headers)
+        resp = raw.parse()
+        governor.settle(ticket, getattr(getattr(resp, "usage", None), "total_tokens", None))
+        _count_usage(resp)
+        return resp.choices[0].message.content.strip()
+    raise RuntimeError("unreachable")
+
+async def get_tags_async(text: str, mode_prompt: str = "", num_tags: int = 8, mode: str = "Keywords", client=None,
+                         tenant_id: Optional[str] = None, max_wait: Optional[float] = None) -> str:
+    """
+    get_tags for code running on an event loop (the API): the OpenAI call goes through
+    AsyncOpenAI and budget waits are awaited, so the loop keeps serving other requests
+    meanwhile. Fast mode runs in a worker thread.
+    """
+    if mode == "Fast":
+        return await asyncio.to_thread(get_tags, text, mode_prompt, num_tags, mode, None, tenant_id)
+
+    from .rate_governor import get_rate_governor, estimate_tokens
+    client = client or _async_openai_client()
+    body = build_tag_request(text, mode_prompt, num_tags, mode)
+    governor = get_rate_governor()
+    if governor is None:
+        resp = await client.chat.completions.create(**body)
+        return resp.choices[0].message.content.strip()
+
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+    estimate = estimate_tokens(body)
+    for attempt in range(1, 4):
+        ticket, wait = governor.reserve(estimate, tenant_id, max_wait=max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            raw = await client.with_options(max_retries=0).chat.completions.with_raw_response.create(**body)
+        except RateLimitError as e:
+            governor.release(ticket)
+            _back_off(governor, e, attempt)
+            if attempt == 3:
+                raise
+            continue
+        except (APIConnectionError, APITimeoutError, InternalServerError):
+            governor.release(ticket)
+            if attempt == 3:
+                raise
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+        governor.observe(raw.headers)
+        resp = raw.parse()  # the async raw response is already read; parse() is synchronous
+        governor.settle(ticket, getattr(getattr(resp, "usage", None), "total_tokens", None))
+        return resp.choices[0].message.content.strip()
+    raise RuntimeError("unreachable")
+
+def _back_off(governor, e, attempt: int) -> None:
+    # After a 429: align the governor with OpenAI's headers and hold every caller back.
+    from .rate_governor import parse_reset
+    from .run_metrics import incr
+    incr("openai_429")
+    headers = e.response.headers if getattr(e, "response", None) is not None else {}
+    governor.observe(headers)
+    try:
+        wait = float(headers.get("retry-after") or 0)
+    except ValueError:
+        wait = 0.0
+    governor.backoff(wait or parse_reset(headers.get("x-ratelimit-reset-requests")) or 2.0 ** attempt)
+
+def _retry_delay(attempt: int) -> float:
+    # Connection errors, timeouts and 5xx: roughly the SDK's own backoff. These
+    # hold back only the failing call, unlike a 429.
+    return min(8.0, 0.5 * 2.0 ** attempt) * random.uniform(0.75, 1.0)
+
+def _count_usage(resp) -> None:
+    # Token usage for the daemon's run metrics (a no-op outside a run).
+    from .run_metrics import incr
+    incr("openai_calls")
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        incr("openai_prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        incr("openai_completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
 
 def parse_tags(raw_text: str) -> List[str]:
     """
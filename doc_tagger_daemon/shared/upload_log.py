@@ -0,0 +1,243 @@
+# shared/upload_log.py
+from __future__ import annotations
+import re
+import json
+import codecs
+import logging
+import threading
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .settings import env_str
+
+# Append Blobs under this prefix, one per partition and segment:
+#   upload_log/2026-10-17.000.jsonl   (UPLOAD_LOG_PARTITION=day, default)
+#   upload_log/2026-10.000.jsonl      (UPLOAD_LOG_PARTITION=month)
+# A segment is full at 50,000 appended blocks; writers then roll over to the next.
+LOG_PREFIX = "upload_log/"
+LEGACY_BLOB = "upload_log.json"
+LEGACY_ARCHIVE_BLOB = "upload_log.legacy.json"
+# {"migrated": N}: the first N legacy entries are already in the partitioned log.
+# Kept apart from the legacy blob so recording progress doesn't change its ETag
+# while it's being read.
+MIGRATION_BLOB = "upload_log.migration.json"
+
+# Whitespace and element separators between items of a JSON array.
+_SKIP = re.compile(r"[\s,]*")
+
+# Max bytes per append_block call.
+_MAX_BLOCK = 4 * 1024 * 1024
+
+# (tenant, partition) -> segment currently being appended to
+_segments: Dict[Tuple[str, str], int] = {}
+_segments_lock = threading.Lock()
+
+def _partition_key(entry: Dict[str, Any]) -> str:
+    ts = entry.get("ts") or entry.get("timestamp")
+    try:
+        when = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    except ValueError:
+        when = datetime.now(timezone.utc)
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc)
+    fmt = "%Y-%m" if env_str("UPLOAD_LOG_PARTITION", "day").lower() == "month" else "%Y-%m-%d"
+    return when.strftime(fmt)
+
+def _blob_name(partition: str, segment: int) -> str:
+    return f"{LOG_PREFIX}{partition}.{segment:03d}.jsonl"
+
+def _encode(entry: Dict[str, Any]) -> bytes:
+    return json.dumps(entry, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
+
+def _blocks(lines: List[bytes]) -> Iterator[bytes]:
+    buf: List[bytes] = []
+    size = 0
+    for ln in lines:
+        if buf and size + len(ln) > _MAX_BLOCK:
+            yield b"".join(buf)
+            buf, size = [], 0
+        buf.append(ln)
+        size += len(ln)
+    if buf:
+        yield b"".join(buf)
+
+def _append_block(tenant_id: str, partition: str, block: bytes) -> None:
+    from azure.core import MatchConditions
+    from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+    from .blob_utils import get_blob_client
+    with _segments_lock:
+        segment = _segments.get((tenant_id, partition), 0)
+    while True:
+        blob = get_blob_client(tenant_id, _blob_name(partition, segment))
+        try:
+            blob.append_block(block)
+            break
+        except ResourceNotFoundError:
+            try:
+                blob.create_append_blob(etag="*", match_condition=MatchConditions.IfMissing)
+            except (ResourceExistsError, ResourceModifiedError):
+                pass  # another writer created it first
+            blob.append_block(block)
+            break
+        except HttpResponseError as e:
+            if getattr(e, "error_code", None) != "BlockCountExceedsLimit":
+                raise
+            segment += 1
+    with _segments_lock:
+        if _segments.get((tenant_id, partition), 0) < segment:
+            _segments[(tenant_id, partition)] = segment
+
+def append_upload_log(tenant_id: str, entries: Iterable[Dict[str, Any]]) -> int:
+    """
+    Appends log entries as compact JSON lines to the tenant's partitioned upload log.
+    Each partition gets one append per 4 MiB of entries, so the cost doesn't grow
+    with history and concurrent writers never overwrite each other.
+    Returns the number of entries written.
+    """
+    grouped: Dict[str, List[bytes]] = {}
+    for entry in entries:
+        grouped.setdefault(_partition_key(entry), []).append(_encode(entry))
+    for partition, lines in grouped.items():
+        for block in _blocks(lines):
+            _append_block(tenant_id, partition, block)
+    return sum(len(v) for v in grouped.values())
+
+# ---------- reading ----------
+
+def _iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Yields the elements of a JSON array read from byte chunks without holding the
+    whole document (legacy upload_log.json was a single pretty-printed array).
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buf = ""
+    started = False
+    for chunk in chunks:
+        buf += utf8.decode(chunk)
+        pos = 0
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            if not started:
+                if pos == len(buf):
+                    break
+                if buf[pos] != "[":
+                    raise ValueError("legacy upload log is not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if pos == len(buf) or buf[pos] == "]":
+                break
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break  # element continues in the next chunk
+            yield item
+        buf = buf[pos:]
+
+def _migrated_count(tenant_id: str) -> int:
+    from .blob_utils import load_json_blob
+    try:
+        return max(0, int((load_json_blob(tenant_id, MIGRATION_BLOB) or {}).get("migrated") or 0))
+    except (TypeError, ValueError, AttributeError):
+        return 0
+
+def iter_legacy_upload_log(tenant_id: str) -> Iterator[Dict[str, Any]]:
+    """
+    Entries of the legacy upload_log.json array that an interrupted migration hasn't
+    moved yet.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    from .blob_utils import get_blob_client
+    try:
+        downloader = get_blob_client(tenant_id, LEGACY_BLOB).download_blob()
+    except ResourceNotFoundError:
+        return
+    skip = _migrated_count(tenant_id)
+    for item in _iter_json_array(downloader.chunks()):
+        if isinstance(item, dict):
+            if skip:
+                skip -= 1
+                continue
+            yield item
+
+def _in_range(partition: str, since: Optional[date], until: Optional[date]) -> bool:
+    if since is not None and partition < since.isoformat()[:len(partition)]:
+        return False
+    if until is not None and partition > until.isoformat()[:len(partition)]:
+        return False
+    return True
+
+def iter_upload_log(tenant_id: str, since: Optional[date] = None, until: Optional[date] = None,
+                    include_legacy: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Streams log entries oldest partition first: the legacy upload_log.json array
+    (if it hasn't been migrated), then each JSONL segment in name order.
+    since/until restrict the partitions read (inclusive); legacy entries are not filtered.
+    """
+    from .blob_utils import get_container_client
+    if include_legacy:
+        yield from iter_legacy_upload_log(tenant_id)
+    container = get_container_client(tenant_id)
+    names = sorted(b.name for b in container.list_blobs(name_starts_with=LOG_PREFIX) if b.name.endswith(".jsonl"))
+    for name in names:
+        partition = name[len(LOG_PREFIX):].split(".", 1)[0]
+        if not _in_range(partition, since, until):
+            continue
+        tail = b""
+        for chunk in container.get_blob_client(name).download_blob().chunks():
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for raw in lines:
+                if raw.strip():
+                    try:
+                        yield json.loads(raw)
+                    except ValueError:
+                        logging.warning("Skipping malformed upload log line in %s", name)
+        if tail.strip():
+            try:
+                yield json.loads(tail)
+            except ValueError:
+                logging.warning("Skipping malformed upload log line in %s", name)
+
+def migrate_legacy_upload_log(tenant_id: str, batch_size: int = 5000) -> int:
+    """
+    Moves the entries of the legacy upload_log.json into the partitioned log, then
+    archives the old blob as upload_log.legacy.json and deletes it so readers don't
+    see the entries twice. Returns the number of entries migrated.
+
+    Progress is recorded in MIGRATION_BLOB after every batch, so a migration that
+    fails part way resumes where it stopped instead of appending entries again (at
+    most the one batch in flight can be repeated).
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    from .blob_utils import get_blob_client, write_json_blob
+    legacy = get_blob_client(tenant_id, LEGACY_BLOB)
+    try:
+        legacy.get_blob_properties()
+    except ResourceNotFoundError:
+        return 0
+    done = _migrated_count(tenant_id)
+    moved = 0
+    batch: List[Dict[str, Any]] = []
+
+    def _commit() -> None:
+        nonlocal moved, batch
+        moved += append_upload_log(tenant_id, batch)
+        write_json_blob(tenant_id, MIGRATION_BLOB, {"migrated": done + moved})
+        batch = []
+
+    for entry in iter_legacy_upload_log(tenant_id):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            _commit()
+    if batch:
+        _commit()
+    archive = get_blob_client(tenant_id, LEGACY_ARCHIVE_BLOB)
+    archive.upload_blob(legacy.download_blob().chunks(), overwrite=True)
+    legacy.delete_blob()
+    try:
+        get_blob_client(tenant_id, MIGRATION_BLOB).delete_blob()
+    except ResourceNotFoundError:
+        pass
+    logging.info("Migrated %d legacy upload log entries for tenant %s (%d earlier)", moved, tenant_id, done)
+    return moved
@@ -2,6 +2,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from ..auth_jwt import require_admin_jwt  # ✅ JWT-based admin gate
 from doc_tagger_daemon.shared.graph_auth import get_graph_token
+from doc_tagger_daemon.shared.settings import GRAPH_BASE_URL
 import requests
 from urllib.parse import urlparse
 
@@ -13,7 +14,7 @@ def list_sites(user=Depends(require_admin_jwt)):
     token = get_graph_token(tid)
     headers = {"Authorization": f"Bearer {token}"}
 
-    url = "https://graph.microsoft.com/v1.0/sites?search=."
+    url = f"{GRAPH_BASE_URL}/sites?search=."
     resp = requests.get(url, headers=headers)
 
     if resp.status_code != 200:
@@ -28,7 +29,7 @@ def list_drives(siteId: str = Query(...), user=Depends(require_admin_jwt)):
     token = get_graph_token(tid)
     headers = {"Authorization": f"Bearer {token}"}
 
-    url = f"https://graph.microsoft.com/v1.0/sites/{siteId}/drives"
+    url = f"{GRAPH_BASE_URL}/sites/{siteId}/drives"
     resp = requests.get(url, headers=headers)
 
     if resp.status_code != 200:
@@ -49,7 +50,7 @@ def resolve_site(url: str, user=Depends(require_admin_jwt)):
         raise HTTPException(status_code=400, detail="Invalid SharePoint site URL")
 
     site_path = "/".join(path_parts[:2])
-    graph_url = f"https://graph.microsoft.com/v1.0/sites/{hostname}:/{site_path}"
+    graph_url = f"{GRAPH_BASE_URL}/sites/{hostname}:/{site_path}"
     headers = {"Authorization": f"Bearer {token}"}
 
     resp = requests.get(graph_url, headers=headers)
@@ -71,7 +72,7 @@ def list_folders(siteId: str, driveId: str, user=Depends(require_admin_jwt)):
     folder_paths = []
 
     def fetch_children(folder_path=""):
-        url = f"https://graph.microsoft.com/v1.0/sites/{siteId}/drives/{driveId}/root"
+        url = f"{GRAPH_BASE_URL}/sites/{siteId}/drives/{driveId}/root"
         if folder_path:
             url += f":/{folder_path}:/children"
         else:
@@ -2,12 +2,25 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
 from ..auth_jwt import require_user_jwt  # ✅ JWT-based user gate
 from doc_tagger_daemon.shared.graph_auth import get_graph_token
-from doc_tagger_daemon.shared.blob_utils import append_log_entry, load_json_blob
+from doc_tagger_daemon.shared.blob_utils import load_json_blob
+from doc_tagger_daemon.shared.upload_log import append_upload_log
+from doc_tagger_daemon.shared.settings import GRAPH_BASE_URL, env_int
 from datetime import datetime
 import requests
 
 router = APIRouter()
 
+def _upload_size(file: UploadFile) -> int:
+    size = getattr(file, "size", None)
+    if size is not None:
+        return size
+    f = file.file
+    pos = f.tell()
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(pos)
+    return size
+
 @router.post("/upload-to-sharepoint")
 async def upload_to_sharepoint(
     file: UploadFile = File(...),
@@ -32,13 +45,23 @@ async def upload_to_sharepoint(
     token = get_graph_token(tid)
     headers = {"Authorization": f"Bearer {token}"}
 
-    file_bytes = await file.read()
+    # UPLOAD_MAX_MB caps uploads (default 250, Graph's limit for a simple PUT upload).
+    # The body is streamed from the spooled upload file rather than read into memory.
+    max_bytes = env_int("UPLOAD_MAX_MB", 250, minimum=1) * 1024 * 1024
+    size = _upload_size(file)
+    if size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File is larger than {max_bytes // (1024 * 1024)} MB.")
+    file.file.seek(0)
     filename = file.filename
     sp_path = f"{folder}/{filename}" if folder else filename
 
     # Upload file to SharePoint
-    upload_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/root:/{sp_path}:/content"
-    upload_resp = requests.put(upload_url, headers=headers, data=file_bytes)
+    upload_url = f"{GRAPH_BASE_URL}/sites/{site_id}/drives/{drive_id}/root:/{sp_path}:/content"
+    upload_resp = requests.put(
+        upload_url,
+        headers={**headers, "Content-Length": str(size)},
+        data=file.file,
+    )
     if upload_resp.status_code not in (200, 201):
         raise HTTPException(status_code=upload_resp.status_code, detail=f"Upload failed: {upload_resp.text}")
 
@@ -48,7 +71,7 @@ async def upload_to_sharepoint(
 
     # Patch metadata tags
     if tags and file_id:
-        patch_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{file_id}/listItem/fields"
+        patch_url = f"{GRAPH_BASE_URL}/sites/{site_id}/drives/{drive_id}/items/{file_id}/listItem/fields"
         patch_headers = {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json",
@@ -60,9 +83,9 @@ async def upload_to_sharepoint(
             print("Metadata patch failed:", patch_resp.text)
 
     # Log to blob
-    append_log_entry(
+    append_upload_log(
         tid,
-        {
+        [{
             "timestamp": datetime.utcnow().isoformat() + "Z",
             "filename": filename,
             "folder": folder or "/",
@@ -70,7 +93,7 @@ async def upload_to_sharepoint(
             "user": user.get("email") or user.get("name"),
             "status": "success",
             "method": "manual",
-        },
+        }],
     )
 
     return {"ok": True, "item": {"webUrl": web_url, "id": file_id}}
@@ -1,26 +1,97 @@
 # doctagger_backend/routes/tagging.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, File, UploadFile, Form, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from ..auth_jwt import require_user_jwt  # ✅ JWT-based user gate
-from doc_tagger_daemon.shared.tagging_utils import extract_text, get_tags, parse_tags
+from doc_tagger_daemon.shared.tagging_utils import TAG_TEXT_CHARS, extract_text, get_tags_async, parse_tags
+from doc_tagger_daemon.shared.settings import env_float, env_int
+from doc_tagger_daemon.shared.rate_governor import BudgetExhausted
+from doc_tagger_daemon.shared.extract_pool import ExtractionError, get_extraction_pool
+from doc_tagger_daemon.shared.tag_cache import cache_key, get_tag_cache
 
 router = APIRouter()
 
+# Per-worker limits, so a burst of uploads queues here instead of piling up parsers and
+# OpenAI calls: TAG_MAX_CONCURRENCY requests tag at once (default 8), extraction runs on
+# TAG_EXTRACT_THREADS threads (default 2) off the event loop, and a request that can't
+# start within TAG_QUEUE_TIMEOUT_SECONDS (default 15) gets a 503.
+_extract_executor = ThreadPoolExecutor(max_workers=env_int("TAG_EXTRACT_THREADS", 2, minimum=1),
+                                       thread_name_prefix="tag-extract")
+_slots = None
+
+def _tag_slots() -> asyncio.Semaphore:
+    # Created on first use so it belongs to the worker's running loop.
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(env_int("TAG_MAX_CONCURRENCY", 8, minimum=1))
+    return _slots
+
+def _extract(file: UploadFile) -> str:
+    # Runs on _extract_executor; the parsing itself goes to the extraction process pool
+    # when there is one, so large PDFs don't hold this worker's GIL.
+    max_pages = env_int("EXTRACT_MAX_PAGES", 50, minimum=1)
+    pool = get_extraction_pool()
+    if pool is None:
+        return extract_text(file, max_chars=TAG_TEXT_CHARS, max_pages=max_pages)
+    file.file.seek(0)
+    text, _ = pool.extract(file.file.read(), file.filename or "", max_chars=TAG_TEXT_CHARS, max_pages=max_pages)
+    return text
+
 @router.post("/tag")
 async def tag_document(
     file: UploadFile = File(...),
     mode: str = Form("Keywords"),
     custom_prompt: str = Form(""),
     num_tags: int = Form(10),
+    preview: bool = Form(False),
     user: dict = Depends(require_user_jwt),
 ):
-    # Extract text from the uploaded file
-    text = extract_text(file)
+    slots = _tag_slots()
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=env_float("TAG_QUEUE_TIMEOUT_SECONDS", 15.0, minimum=0.0))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Tagging is busy, please retry shortly.",
+                            headers={"Retry-After": "5"})
+    try:
+        return await _tag(file, mode, custom_prompt, num_tags, preview, user.get("tid"))
+    finally:
+        slots.release()
+
+async def _tag(file: UploadFile, mode: str, custom_prompt: str, num_tags: int, preview: bool, tid):
+    # Extract only the text we'll send (stops early on long documents)
+    loop = asyncio.get_running_loop()
+    try:
+        text = await loop.run_in_executor(_extract_executor, _extract, file)
+    except ExtractionError as e:
+        raise HTTPException(status_code=422, detail=f"Could not extract text: {e}")
 
     if len(text.strip()) < 20:
         raise HTTPException(status_code=400, detail="Document too short to tag")
 
+    # Low-latency preview: local keyphrase extraction, no OpenAI round trip
+    if preview or mode == "Fast":
+        return {"tags": parse_tags(await get_tags_async(text, num_tags=num_tags, mode="Fast", tenant_id=tid))}
+
+    # Same text + settings were tagged before (here or by the daemon): reuse those tags
+    text = text[:TAG_TEXT_CHARS]
+    cache = get_tag_cache(tid or "global")
+    key = cache_key(text, custom_prompt, num_tags, mode)
+    if cache is not None:
+        cached = await run_in_threadpool(cache.get, key)
+        if cached is not None:
+            return {"tags": cached}
+
     # Call your tagger with the (optionally truncated) text
-    raw = get_tags(text[:3000], custom_prompt, num_tags, mode)
+    # Interactive callers only queue briefly for OpenAI budget (TAG_MAX_WAIT_SECONDS, default 10)
+    try:
+        raw = await get_tags_async(text, custom_prompt, num_tags, mode, tenant_id=tid,
+                                   max_wait=env_float("TAG_MAX_WAIT_SECONDS", 10.0, minimum=0.0))
+    except BudgetExhausted as e:
+        raise HTTPException(status_code=429, detail="Tagging is busy, please retry shortly.",
+                            headers={"Retry-After": str(max(1, int(e.retry_after)))})
     tags = parse_tags(raw)
+    if cache is not None and tags:
+        await run_in_threadpool(cache.put, key, tags)
 
     return {"tags": tags}
@@ -70,8 +70,16 @@ def set_upload_target_enabled(label: str, enabled: bool, tid: str = Depends(get_
 
 @router.get("/status")
 def get_daemon_status(tid: str = Depends(get_tid_from_token)):
+    """
+    The tenant's daemon_status.json (totals, lock, run metrics) plus "targets":
+    each target's last run status and metrics from daemon_targets_status.json.
+    """
     try:
-        data = load_json_blob(tid, "daemon_status.json")
-        return data or {}
+        data = load_json_blob(tid, "daemon_status.json") or {}
     except Exception:
-        return {}
+        data = {}
+    try:
+        per_target = (load_json_blob(tid, "daemon_targets_status.json") or {}).get(tid) or {}
+    except Exception:
+        per_target = {}
+    return {**data, "targets": per_target}
@@ -149,6 +149,7 @@ function DashboardPage() {
               <option>Keywords</option>
               <option>Topics</option>
               <option>Custom Prompt</option>
+              <option>Fast</option>
             </select>
           </div>
 
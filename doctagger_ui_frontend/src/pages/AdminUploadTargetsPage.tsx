@@ -10,10 +10,26 @@ type UploadTarget = {
   enabled?: boolean;
 };
 
+type StageMetrics = {
+  count: number;
+  errors: number;
+  total_ms: number;
+  p50_ms: number;
+  p95_ms: number;
+  max_ms: number;
+};
+
+type RunMetrics = {
+  elapsed_s?: number;
+  stages?: Record<string, StageMetrics>;
+  counters?: Record<string, number>;
+};
+
 type DaemonStatus = {
   last_run?: string;
   files_processed?: number;
   last_error?: string;
+  metrics?: RunMetrics;
 };
 
 export default function AdminUploadTargetsPage() {
@@ -53,7 +69,7 @@ export default function AdminUploadTargetsPage() {
   const fetchStatus = async () => {
     const res = await apiFetch("/admin/upload-targets/status");
     const data = await res.json();
-    setStatusByLabel(data);
+    setStatusByLabel(data.targets || {});
   };
 
   useEffect(() => {
@@ -197,6 +213,24 @@ export default function AdminUploadTargetsPage() {
               <div className="text-xs text-gray-500 mt-1 ml-1">
                 <div>🕒 Last run: {status.last_run ? new Date(status.last_run).toLocaleString() : "—"}</div>
                 <div>📄 Files processed: {status.files_processed ?? "—"}</div>
+                {status.metrics && (
+                  <div className="mt-1">
+                    <div>⏱ Run took {status.metrics.elapsed_s ?? "—"}s</div>
+                    {Object.entries(status.metrics.stages || {}).map(([stage, m]) => (
+                      <div key={stage}>
+                        {stage}: {m.count}× p50 {m.p50_ms} ms · p95 {m.p95_ms} ms · max {m.max_ms} ms
+                        {m.errors ? ` · ${m.errors} failed` : ""}
+                      </div>
+                    ))}
+                    {Object.keys(status.metrics.counters || {}).length > 0 && (
+                      <div>
+                        {Object.entries(status.metrics.counters || {})
+                          .map(([k, v]) => `${k}=${v}`)
+                          .join(" · ")}
+                      </div>
+                    )}
+                  </div>
+                )}
                 {status.last_error && <div className="text-red-500 mt-1">❌ Error: {status.last_error}</div>}
               </div>
             </div>
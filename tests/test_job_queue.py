@@ -0,0 +1,30 @@
+import time
+
+from doc_tagger_daemon.shared.job_queue import InMemoryJobQueue
+
+
+def test_delayed_jobs_wait_for_a_later_drain(monkeypatch):
+    jq = InMemoryJobQueue()
+    jq.send([{"n": 1}], delay=30)
+    handled = []
+    assert jq.drain(lambda job, count: handled.append((job, count))) == 0
+    assert handled == [] and len(jq) == 1
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 31)
+    assert jq.drain(lambda job, count: handled.append((job, count))) == 1
+    assert handled == [({"n": 1}, 1)] and len(jq) == 0
+
+
+def test_failing_job_is_poisoned_after_max_dequeue():
+    jq = InMemoryJobQueue(max_dequeue=3)
+    jq.send([{"n": 1}])
+    attempts = []
+
+    def _fail(job, count):
+        attempts.append(count)
+        raise RuntimeError("boom")
+
+    assert jq.drain(_fail, workers=1) == 0
+    assert attempts == [1, 2, 3]
+    assert jq.poison == [{"n": 1}]
@@ -0,0 +1,39 @@
+import threading
+
+from doc_tagger_daemon.shared import blob_utils
+from doc_tagger_daemon.shared.keyword_tagger import KeywordStats
+
+
+def test_observe_does_not_wait_for_a_flush_and_keeps_its_counts(monkeypatch):
+    blob = {"data": None}
+    writing = threading.Event()
+    release = threading.Event()
+
+    def _load(container, name):
+        return blob["data"], "etag"
+
+    def _write(container, name, data, etag, compact=False):
+        writing.set()
+        assert release.wait(5)
+        blob["data"] = data
+        return True
+
+    monkeypatch.setattr(blob_utils, "load_json_blob_with_etag", _load)
+    monkeypatch.setattr(blob_utils, "write_json_blob_if_match", _write)
+
+    stats = KeywordStats("tenant", flush_every=1000, flush_interval=3600)
+    stats.observe("invoice payment terms")
+    flusher = threading.Thread(target=stats.flush)
+    flusher.start()
+    assert writing.wait(5)
+    # The blob write is in progress; observe() and idf() must not block on it.
+    stats.observe("invoice delivery schedule")
+    assert stats.idf("invoice") > 0
+    release.set()
+    flusher.join(5)
+
+    assert blob["data"] == {"docs": 1, "df": {"invoice": 1, "payment": 1, "terms": 1}}
+    stats.flush()
+    assert blob["data"]["docs"] == 2
+    assert blob["data"]["df"]["invoice"] == 2
+    assert blob["data"]["df"]["delivery"] == 1
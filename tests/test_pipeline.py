@@ -0,0 +1,31 @@
+import threading
+import time
+
+from doc_tagger_daemon.shared.pipeline import FairScheduler
+
+
+def test_lane_close_waits_for_done_callbacks():
+    # _process_target reads its totals right after leaving the lane; the tally
+    # callbacks of every file must have run by then.
+    with FairScheduler(4) as scheduler:
+        for _ in range(50):
+            tallied = []
+            lock = threading.Lock()
+
+            def _tally(fut):
+                time.sleep(0.001)
+                with lock:
+                    tallied.append(fut.result())
+
+            with scheduler.lane("tenant", 4) as lane:
+                for i in range(8):
+                    lane.submit(lambda i=i: i).add_done_callback(_tally)
+            assert sorted(tallied) == list(range(8))
+
+
+def test_lane_counts_failed_jobs():
+    with FairScheduler(2) as scheduler:
+        with scheduler.lane("tenant", 2) as lane:
+            fut = lane.submit(lambda: 1 / 0)
+        assert isinstance(fut.exception(), ZeroDivisionError)
+        assert lane._outstanding == 0
@@ -0,0 +1,106 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+from doc_tagger_daemon.shared import rate_governor, tagging_utils
+from doc_tagger_daemon.shared.rate_governor import RateGovernor
+
+
+class _RateLimitError(Exception):
+    def __init__(self, headers):
+        super().__init__("429")
+        self.response = types.SimpleNamespace(headers=headers)
+
+
+class _APIConnectionError(Exception):
+    pass
+
+
+class _APITimeoutError(_APIConnectionError):
+    pass
+
+
+class _InternalServerError(Exception):
+    pass
+
+
+class _RawResponse:
+    # Mirrors openai's LegacyAPIResponse: the body is already read and parse() is synchronous.
+    def __init__(self, content, total_tokens=42):
+        self.headers = {"x-ratelimit-remaining-requests": "100", "x-ratelimit-remaining-tokens": "100000"}
+        self._content = content
+        self._total_tokens = total_tokens
+
+    def parse(self):
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=self._content))],
+            usage=types.SimpleNamespace(total_tokens=self._total_tokens),
+        )
+
+
+class _StubAsyncClient:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(
+            with_raw_response=types.SimpleNamespace(create=self._create),
+        ))
+
+    def with_options(self, **_):
+        return self
+
+    async def _create(self, **body):
+        self.calls.append(body)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def governor(monkeypatch):
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(
+        RateLimitError=_RateLimitError,
+        APIConnectionError=_APIConnectionError,
+        APITimeoutError=_APITimeoutError,
+        InternalServerError=_InternalServerError,
+    ))
+    gov = RateGovernor(600, 1_000_000)
+    monkeypatch.setattr(rate_governor, "_governor", gov)
+    return gov
+
+
+def test_get_tags_async_with_budget_parses_raw_response(governor):
+    client = _StubAsyncClient([_RawResponse(" alpha, beta ")])
+    out = asyncio.run(tagging_utils.get_tags_async("some document text", client=client, tenant_id="t1"))
+    assert out == "alpha, beta"
+    assert len(client.calls) == 1
+
+
+def test_get_tags_async_retries_after_429(governor, monkeypatch):
+    monkeypatch.setattr(governor, "backoff", lambda seconds: None)
+    client = _StubAsyncClient([_RateLimitError({"retry-after": "0"}), _RawResponse("gamma")])
+    out = asyncio.run(tagging_utils.get_tags_async("some document text", client=client, tenant_id="t1"))
+    assert out == "gamma"
+    assert len(client.calls) == 2
+
+
+def test_get_tags_async_retries_connection_errors(governor, monkeypatch):
+    monkeypatch.setattr(tagging_utils, "_retry_delay", lambda attempt: 0)
+    client = _StubAsyncClient([_APITimeoutError(), _InternalServerError(), _RawResponse("delta")])
+    out = asyncio.run(tagging_utils.get_tags_async("some document text", client=client, tenant_id="t1"))
+    assert out == "delta"
+    assert len(client.calls) == 3
+
+
+def test_get_tags_async_gives_back_the_ticket_when_it_gives_up(governor, monkeypatch):
+    monkeypatch.setattr(tagging_utils, "_retry_delay", lambda attempt: 0)
+    released = []
+    release = governor.release
+    monkeypatch.setattr(governor, "release", lambda ticket: (released.append(ticket), release(ticket)))
+    client = _StubAsyncClient([_APIConnectionError() for _ in range(3)])
+    with pytest.raises(_APIConnectionError):
+        asyncio.run(tagging_utils.get_tags_async("some document text", client=client, tenant_id="t1"))
+    assert len(released) == 3